@@ -0,0 +1,158 @@
+# agents/answer_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .base import normalize_query
+
+# --- Finished answers keyed by normalized query + PDF hash, with a semantic fallback:
+# a new question whose embedding is close enough to a cached one (same PDF) reuses
+# its answer. Entries expire after ttl, are evicted LRU past max_entries, and are
+# dropped as soon as one of their source URLs is re-indexed with new content ---
+class AnswerCache:
+    def __init__(self, embeddings=None, path="cache/answers.sqlite", ttl=6 * 3600, max_entries=5_000,
+                 threshold=0.92, semantic=True):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.embeddings = embeddings
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.semantic = semantic and embeddings is not None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, query TEXT, pdf_hash TEXT, answer TEXT, vector BLOB, urls TEXT, "
+            "created_at REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS answer_sources (key TEXT, url TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answer_sources_url ON answer_sources (url)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self.conn.commit()
+        self.query_vectors = OrderedDict()
+        self.matrix = None
+        self.counts = {"exact": 0, "semantic": 0, "misses": 0, "expired": 0, "invalidated": 0}
+
+    @staticmethod
+    def key(query, pdf_hash=""):
+        return hashlib.sha256(f"{normalize_query(query)}\0{pdf_hash or ''}".encode("utf-8")).hexdigest()
+
+    def _vector(self, query):
+        # Unit-length query embedding, remembered briefly so get() then put() embeds once
+        text = normalize_query(query)
+        with self.lock:
+            if text in self.query_vectors:
+                self.query_vectors.move_to_end(text)
+                return self.query_vectors[text]
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self.lock:
+            self.query_vectors[text] = vector
+            if len(self.query_vectors) > 256:
+                self.query_vectors.popitem(last=False)
+        return vector
+
+    def _semantic_index(self):
+        # (keys, pdf_hashes, matrix) of every live entry; rebuilt after writes
+        if self.matrix is None:
+            rows = self.conn.execute(
+                "SELECT key, pdf_hash, vector FROM answers WHERE vector IS NOT NULL AND created_at >= ?",
+                (time.time() - self.ttl,)
+            ).fetchall()
+            vectors = [np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows]
+            self.matrix = ([key for key, _, _ in rows], [pdf for _, pdf, _ in rows],
+                           np.vstack(vectors) if vectors else None)
+        return self.matrix
+
+    def get(self, query, pdf_hash=""):
+        # Returns (answer, "exact" | "semantic") or (None, None)
+        key = self.key(query, pdf_hash)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                return self._hit(key, row[0], "exact", now)
+            if row:
+                self.counts["expired"] += 1
+                self._delete([key])
+                self.conn.commit()
+        if self.semantic:
+            vector = self._vector(query)
+            with self.lock:
+                keys, pdf_hashes, matrix = self._semantic_index()
+                if matrix is not None:
+                    scores = matrix @ vector
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.threshold:
+                            break
+                        if pdf_hashes[i] != (pdf_hash or ""):
+                            continue
+                        row = self.conn.execute(
+                            "SELECT answer, created_at FROM answers WHERE key = ?", (keys[i],)
+                        ).fetchone()
+                        if row and now - row[1] < self.ttl:
+                            return self._hit(keys[i], row[0], "semantic", now)
+        with self.lock:
+            self.counts["misses"] += 1
+        return None, None
+
+    def _hit(self, key, answer, kind, now):
+        self.counts[kind] += 1
+        self.conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return answer, kind
+
+    def put(self, query, pdf_hash, answer, urls):
+        key = self.key(query, pdf_hash)
+        vector = self._vector(query).tobytes() if self.semantic else None
+        urls = list(dict.fromkeys(urls))
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, query, pdf_hash or "", answer, vector, json.dumps(urls), now, now)
+            )
+            self.conn.execute("DELETE FROM answer_sources WHERE key = ?", (key,))
+            self.conn.executemany("INSERT INTO answer_sources VALUES (?, ?)", [(key, url) for url in urls])
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+            if count > self.max_entries:
+                oldest = self.conn.execute(
+                    "SELECT key FROM answers ORDER BY last_used ASC LIMIT ?", (count - self.max_entries,)
+                ).fetchall()
+                self._delete([k for (k,) in oldest])
+            self.conn.commit()
+            self.matrix = None
+
+    # VectorIndex change hook: the source behind these answers has new content
+    def invalidate_url(self, url):
+        with self.lock:
+            keys = [k for (k,) in self.conn.execute(
+                "SELECT DISTINCT key FROM answer_sources WHERE url = ?", (url,)
+            ).fetchall()]
+            if keys:
+                self.counts["invalidated"] += len(keys)
+                self._delete(keys)
+                self.conn.commit()
+        return len(keys)
+
+    def _delete(self, keys):
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            self.conn.execute(f"DELETE FROM answers WHERE key IN ({marks})", batch)
+            self.conn.execute(f"DELETE FROM answer_sources WHERE key IN ({marks})", batch)
+        self.matrix = None
+
+    def stats(self):
+        hits = self.counts["exact"] + self.counts["semantic"]
+        lookups = hits + self.counts["misses"]
+        with self.lock:
+            (entries,) = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        return {**self.counts, "hit_rate": hits / lookups if lookups else 0.0, "entries": entries}
@@ -1,13 +1,85 @@
 # agents/base.py
 
-# --- Dual-purpose logger ---
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# --- Per-request state: one context per pipeline run, visible to every agent on
+# the request's thread and to pool tasks submitted through submit_with_context.
+# `events` is the structured trace (log lines and finished spans, see tracing.py) ---
+class RequestContext:
+    def __init__(self, logs=None, request_id=None):
+        self.logs = logs if logs is not None else []
+        self.request_id = request_id or uuid.uuid4().hex[:8]
+        self.timings = {}
+        self.events = []
+        self.started = time.perf_counter()
+        # Set when the caller gives up; long-running work (token generation) checks it
+        self.cancelled = threading.Event()
+
+    def record(self, kind, **fields):
+        span = _current_span.get()
+        self.events.append({
+            "type": kind,
+            "t": round(time.perf_counter() - self.started, 6),
+            "span_id": span.id if span else None,
+            "agent": span.agent if span else None,
+            **fields
+        })
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+# Innermost open span of the running agent call; managed by agents/tracing.py
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def current_request():
+    return _current_request.get()
+
+@contextmanager
+def request_context(logs=None, request_id=None):
+    # Nested calls without their own logs list join the request already running
+    active = _current_request.get()
+    if active is not None and logs is None:
+        yield active
+        return
+    context = RequestContext(logs=logs, request_id=request_id)
+    token = _current_request.set(context)
+    try:
+        yield context
+    finally:
+        _current_request.reset(token)
+
+# Pool threads do not inherit context variables; this carries the caller's over
+def submit_with_context(pool, fn, *args, **kwargs):
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+# --- Dual-purpose logger; without an explicit list it logs to the current request ---
 def log(msg, logs=None):
     print(msg, flush=True)
+    context = _current_request.get()
+    if logs is None and context is not None:
+        logs = context.logs
     if logs is not None:
         logs.append(msg)
+    if context is not None:
+        context.record("log", message=msg)
+
+# --- Cache key for free-text queries ---
+def normalize_query(query):
+    return " ".join(query.lower().split())
 
-# --- Base agent class ---
+# --- Base agent class; the methods named in traced_methods get a span per call ---
 class BaseAgent:
+    traced_methods = ("run",)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        from .tracing import traced
+        for method in cls.traced_methods:
+            if method in cls.__dict__:
+                setattr(cls, method, traced(cls.__dict__[method]))
+
     def __init__(self, name, llm):
         self.name = name
         self.llm = llm
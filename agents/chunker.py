@@ -1,34 +1,90 @@
 # agents/chunker.py
 
+import os
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Chroma
 from .base import BaseAgent, log
+from .embedding_cache import EmbeddingCache, CachedEmbeddings, LazyEmbeddings
+from .vector_index import VectorIndex, content_hash
+from .compact_store import CompactStore
+from .tracing import count
 
 class ChunkerAgent(BaseAgent):
-    def __init__(self, name, llm, embedding_model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    traced_methods = ("run", "add")
+
+    def __init__(self, name, llm, embedding_model_name="sentence-transformers/all-MiniLM-L6-v2",
+                 cache_path=None, cache_max_entries=200_000, index_directory=None, embeddings=None,
+                 vector_store="chroma", cache_directory="cache"):
         super().__init__(name, llm)
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
-            chunk_overlap=200
+            chunk_overlap=200,
+            add_start_index=True
+        )
+        cache_path = cache_path or os.path.join(cache_directory, "embeddings.sqlite")
+        self.embedding_cache = EmbeddingCache(cache_path, max_entries=cache_max_entries)
+        # Sentence-transformers is only loaded when the first chunk needs embedding
+        embeddings = embeddings or LazyEmbeddings(lambda: HuggingFaceEmbeddings(model_name=embedding_model_name))
+        self.embeddings = CachedEmbeddings(
+            embeddings,
+            self.embedding_cache,
+            embedding_model_name
         )
-        self.embeddings = HuggingFaceEmbeddings(model_name=embedding_model_name)
+        # "compact" keeps quantized vectors in memory-mapped files instead of Chroma (compact_store.py);
+        # each backend has its own default directory, since neither can read the other's files
+        if vector_store == "compact":
+            directory = index_directory or os.path.join(cache_directory, "compact_index")
+            self.index = CompactStore(self.embeddings, directory=directory)
+        else:
+            directory = index_directory or os.path.join(cache_directory, "index")
+            self.index = VectorIndex(self.embeddings, persist_directory=directory)
+
+    # index: another store with the same upsert/view surface (e.g. a throwaway CompactStore)
+    # to fill instead of the shared one
+    def run(self, scraped_sources, logs=None, index=None):
+        index = self.index if index is None else index
+        urls = self.add(scraped_sources, logs=logs, index=index)
+        log("Chunker: Vectorstore ready.", logs)
+        return index.view(urls)
 
-    def run(self, scraped_sources, logs=None):
+    def count_chunks(self, sources):
+        return sum(len(self.text_splitter.split_text(src.get("content", ""))) for src in sources)
+
+    def view(self, urls):
+        return self.index.view(urls)
+
+    # Removes the chunks of url that belong to none of doc_ids (pages a new upload no longer has)
+    def retain(self, url, doc_ids):
+        return self.index.retain(url, doc_ids)
+
+    # --- Split and index sources; returns the URLs that now have chunks in the index ---
+    def add(self, scraped_sources, logs=None, index=None):
+        index = self.index if index is None else index
         log("Chunker: Splitting documents into chunks...", logs)
-        docs = []
+        docs = {}
+        urls = []
         for source in scraped_sources:
             content = source.get("content", "")
             if not content.strip():
                 continue
-            doc = Document(
+            url = source.get("url", "")
+            urls.append(url)
+            docs.setdefault(source.get("doc_id") or url, []).append(Document(
                 page_content=content,
-                metadata={"url": source.get("url", ""), "title": source.get("title", "")}
-            )
-            docs.append(doc)
-        splits = self.text_splitter.split_documents(docs)
-        log(f"Chunker: Created {len(splits)} chunks.", logs)
-        vectorstore = Chroma.from_documents(splits, embedding=self.embeddings)
-        log("Chunker: Vectorstore ready.", logs)
-        return vectorstore
+                metadata={"url": url, "title": source.get("title", "")}
+            ))
+        total = written = 0
+        # Concurrent add() calls share the embedding cache, so only this call's lookups are counted
+        with self.embeddings.tally() as embedded:
+            for doc_id, doc_parts in docs.items():
+                splits = self.text_splitter.split_documents(doc_parts)
+                total += len(splits)
+                digest = content_hash("\0".join(doc.page_content for doc in doc_parts))
+                written += index.upsert(doc_id, digest, splits)
+        count("items", total)
+        count("cache_hits", embedded["hits"])
+        count("cache_misses", embedded["misses"])
+        log(f"Chunker: Created {total} chunks ({written} new or changed, {total - written} already indexed).", logs)
+        log(f"Chunker: Embedding cache {embedded['hits']} hits, {embedded['misses']} misses.", logs)
+        return list(dict.fromkeys(urls))
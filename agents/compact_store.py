@@ -0,0 +1,484 @@
+# agents/compact_store.py
+
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from langchain_core.documents import Document
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Per-row columns next to the vectors, each an append-only file of fixed-width values
+COLUMNS = {
+    "scale": np.float32,      # int8 dequantization factor, 1.0 for float rows
+    "doc": np.int32,          # line in docs.jsonl: doc_id, content hash, url, title
+    "text_offset": np.int64,  # chunk text lives in texts.bin
+    "text_length": np.int32,
+    "meta_offset": np.int64,  # chunk metadata, as JSON, lives in meta.bin
+    "meta_length": np.int32,
+    "list": np.int32,         # IVF list, -1 before a coarse index exists
+}
+
+def quantize(matrix, dtype):
+    # Rows are L2-normalized first, so dot products are cosine similarities
+    matrix = np.asarray(matrix, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.rint(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return matrix.astype(DTYPES[dtype]), np.ones(len(matrix), dtype=np.float32)
+
+def mmr(query, vectors, k, lambda_mult=0.5):
+    # Greedy maximal marginal relevance over unit vectors; returns positions into vectors
+    if not len(vectors):
+        return []
+    relevance = vectors @ query
+    selected = [int(np.argmax(relevance))]
+    redundancy = vectors @ vectors[selected[0]]
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+def _append(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+
+def _offsets(blobs, start):
+    lengths = np.array([len(blob) for blob in blobs], dtype=np.int64)
+    return start + np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths
+
+def _truncate(path, size):
+    if not os.path.exists(path):
+        open(path, "wb").close()
+    elif os.path.getsize(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+# --- Compact, disk-backed alternative to the Chroma VectorIndex: vectors stored as
+# int8 (per-row scale) or float16 in a memory-mapped file, row fields in column
+# files, text and metadata in blobs. Search is brute-force NumPy top-k in blocks,
+# optionally narrowed by an IVF coarse index. state.json is the commit point: it
+# names the generation directory holding the data and the IVF version inside it,
+# and anything appended past the counts it records is discarded on load.
+# Compaction and IVF training write new files next to the old ones and switch over
+# with a single state.json replace, so a crash at any point leaves one complete
+# generation; files no commit points to are removed on load ---
+class CompactStore:
+    def __init__(self, embeddings, directory="cache/compact_index", dtype="int8", block_size=2048,
+                 nlist=0, nprobe=8, ivf_min_candidates=20_000):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPES)}, got {dtype!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.embeddings = embeddings
+        self.directory = directory
+        self.block_size = block_size
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_candidates = ivf_min_candidates
+        self.lock = threading.RLock()
+        self.listeners = []
+        self._load(dtype)
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"gen-{self.generation}", name)
+
+    def _column(self, name, ivf=None):
+        # The IVF list column is rewritten whole on training, so it is versioned like the centroids
+        if name == "list":
+            return f"list-{self.ivf if ivf is None else ivf}.bin"
+        return f"{name}.bin"
+
+    def _load(self, dtype):
+        state = {"generation": 0, "ivf": 0, "dtype": dtype, "dim": None, "rows": 0, "docs": 0,
+                 "text_bytes": 0, "meta_bytes": 0}
+        state_path = os.path.join(self.directory, "state.json")
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        self.generation = state["generation"]
+        self.ivf = state["ivf"]
+        self.dtype = state["dtype"]
+        self.dim = state["dim"]
+        self.rows = state["rows"]
+        self.text_bytes = state["text_bytes"]
+        self.meta_bytes = state["meta_bytes"]
+        self._remove_stale()
+        os.makedirs(self._path(""), exist_ok=True)
+        # Keep what the last commit covers; drop whatever a crashed writer appended after it
+        self.docs = []
+        committed = 0
+        if os.path.exists(self._path("docs.jsonl")):
+            with open(self._path("docs.jsonl"), "rb") as f:
+                for line in f:
+                    if len(self.docs) == state["docs"]:
+                        break
+                    self.docs.append(json.loads(line))
+                    committed += len(line)
+        _truncate(self._path("docs.jsonl"), committed)
+        width = np.dtype(DTYPES[self.dtype]).itemsize * (self.dim or 0)
+        _truncate(self._path("vectors.bin"), self.rows * width)
+        for name, column_dtype in COLUMNS.items():
+            _truncate(self._path(self._column(name)), self.rows * np.dtype(column_dtype).itemsize)
+        _truncate(self._path("texts.bin"), self.text_bytes)
+        _truncate(self._path("meta.bin"), self.meta_bytes)
+        centroids_path = self._path(f"centroids-{self.ivf}.npy")
+        self.centroids = np.load(centroids_path) if self.ivf else None
+        # Latest version of each doc_id; rows of older versions are dead
+        self.latest = {}
+        for code, (doc_id, _, _, _) in enumerate(self.docs):
+            self.latest[doc_id] = code
+        self.snapshot = None
+
+    def _remove_stale(self):
+        # Generations and IVF files left by a compaction or training that crashed before
+        # (or after) its commit
+        current = f"gen-{self.generation}"
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and name != current:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        if not os.path.isdir(self._path("")):
+            return
+        keep = {self._column("list"), f"centroids-{self.ivf}.npy"}
+        for name in os.listdir(self._path("")):
+            if (name.startswith(("list-", "centroids-")) and name not in keep) or name.endswith(".tmp"):
+                os.remove(self._path(name))
+
+    def _commit(self):
+        state = {"generation": self.generation, "ivf": self.ivf, "dtype": self.dtype, "dim": self.dim,
+                 "rows": self.rows, "docs": len(self.docs), "text_bytes": self.text_bytes,
+                 "meta_bytes": self.meta_bytes}
+        state_path = os.path.join(self.directory, "state.json")
+        with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(state_path + ".tmp", state_path)
+        self.snapshot = None
+
+    def _commit_or_reload(self):
+        # For rewrites that moved to new files: if the commit fails, go back to what is on disk
+        try:
+            self._commit()
+        except BaseException:
+            self._load(self.dtype)
+            raise
+
+    def _view(self):
+        # Read-only maps of everything committed; readers keep using theirs while writers append
+        with self.lock:
+            if self.snapshot is None:
+                self.snapshot = self._map()
+            return self.snapshot
+
+    def _map(self):
+        def mapped(name, dtype, shape):
+            if not shape[0]:
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(self._path(name), dtype=dtype, mode="r", shape=shape)
+        live_codes = np.fromiter(self.latest.values(), dtype=np.int32, count=len(self.latest))
+        by_url = {}
+        for code in live_codes:
+            by_url.setdefault(self.docs[code][2], []).append(code)
+        return {
+            "vectors": mapped("vectors.bin", DTYPES[self.dtype], (self.rows, self.dim or 0)),
+            **{name: mapped(self._column(name), dtype, (self.rows,)) for name, dtype in COLUMNS.items()},
+            "texts": mapped("texts.bin", np.uint8, (self.text_bytes,)),
+            "meta": mapped("meta.bin", np.uint8, (self.meta_bytes,)),
+            "docs": list(self.docs),
+            "live_codes": live_codes,
+            "by_url": by_url,
+            "centroids": self.centroids,
+        }
+
+    # callback(url) runs after an indexed source is replaced by a different version
+    def on_change(self, callback):
+        self.listeners.append(callback)
+
+    def upsert(self, doc_id, digest, splits):
+        # Same contract as VectorIndex.upsert: returns the chunks written, 0 if already indexed
+        with self.lock:
+            code = self.latest.get(doc_id)
+            if code is not None and self.docs[code][1] == digest:
+                return 0
+        vectors = self.embeddings.embed_documents([split.page_content for split in splits]) if splits else []
+        changed = None
+        with self.lock:
+            code = self.latest.get(doc_id)
+            if code is not None and self.docs[code][1] == digest:
+                return 0
+            if code is not None:
+                changed = self.docs[code][2] or doc_id
+            url = splits[0].metadata.get("url", doc_id) if splits else doc_id
+            title = splits[0].metadata.get("title", "") if splits else ""
+            self._append(doc_id, digest, url, title, splits, vectors)
+            self._commit()
+            written = len(splits)
+            if self.nlist and self.centroids is None and self.rows >= 40 * self.nlist:
+                self._train_ivf()
+        if changed is not None:
+            for callback in self.listeners:
+                callback(changed)
+        return written
+
+    def retain(self, url, doc_ids):
+        # Same contract as VectorIndex.retain. Each dropped doc_id gets an empty version
+        # (digest None), so its rows are dead and a later upsert indexes it again
+        keep = set(doc_ids)
+        with self.lock:
+            stale = [doc_id for doc_id, code in self.latest.items()
+                     if self.docs[code][2] == url and doc_id not in keep and self.docs[code][1] is not None]
+            if not stale:
+                return 0
+            view = self._view()
+            codes = [self.latest[doc_id] for doc_id in stale]
+            removed = int(np.isin(view["doc"], codes).sum())
+            for doc_id in stale:
+                self._append(doc_id, None, url, "", [], [])
+            self._commit()
+        for callback in self.listeners:
+            callback(url)
+        return removed
+
+    def _append(self, doc_id, digest, url, title, splits, vectors):
+        code = len(self.docs)
+        record = [doc_id, digest, url, title]
+        _append(self._path("docs.jsonl"), (json.dumps(record) + "\n").encode("utf-8"))
+        self.docs.append(record)
+        self.latest[doc_id] = code
+        if not splits:
+            return
+        quantized, scales = quantize(vectors, self.dtype)
+        self.dim = self.dim or quantized.shape[1]
+        texts = [split.page_content.encode("utf-8") for split in splits]
+        metas = [json.dumps({**split.metadata, "doc_id": doc_id, "content_hash": digest}).encode("utf-8")
+                 for split in splits]
+        text_offsets, text_lengths = _offsets(texts, self.text_bytes)
+        meta_offsets, meta_lengths = _offsets(metas, self.meta_bytes)
+        lists = self._assign(quantized, scales) if self.centroids is not None else np.full(len(splits), -1)
+        columns = {
+            "scale": scales,
+            "doc": np.full(len(splits), code),
+            "text_offset": text_offsets,
+            "text_length": text_lengths,
+            "meta_offset": meta_offsets,
+            "meta_length": meta_lengths,
+            "list": lists,
+        }
+        _append(self._path("vectors.bin"), quantized.tobytes())
+        for name, values in columns.items():
+            _append(self._path(self._column(name)), np.asarray(values, dtype=COLUMNS[name]).tobytes())
+        _append(self._path("texts.bin"), b"".join(texts))
+        _append(self._path("meta.bin"), b"".join(metas))
+        self.rows += len(splits)
+        self.text_bytes += int(text_lengths.sum())
+        self.meta_bytes += int(meta_lengths.sum())
+
+    # --- IVF coarse index: spherical k-means over a sample, every row assigned to its
+    # nearest centroid; searches over many rows only score the nprobe closest lists ---
+    def _assign(self, quantized, scales):
+        vectors = quantized.astype(np.float32) * scales[:, None]
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _train_ivf(self, iterations=10, sample=50_000, seed=0):
+        view = self._view()
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(self.rows, size=min(sample, self.rows), replace=False))
+        data = view["vectors"][rows].astype(np.float32) * view["scale"][rows][:, None]
+        centroids = data[rng.choice(len(data), size=self.nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = data[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        old_ivf, self.ivf = self.ivf, self.ivf + 1
+        self.centroids = centroids.astype(np.float32)
+        lists = np.empty(self.rows, dtype=np.int32)
+        for start in range(0, self.rows, self.block_size):
+            end = min(start + self.block_size, self.rows)
+            lists[start:end] = self._assign(np.asarray(view["vectors"][start:end]), np.asarray(view["scale"][start:end]))
+        # New list and centroid files sit beside the old ones until the commit switches versions
+        lists.tofile(self._path(self._column("list")))
+        np.save(self._path(f"centroids-{self.ivf}.npy"), self.centroids)
+        self._commit_or_reload()
+        for name in (self._column("list", old_ivf), f"centroids-{old_ivf}.npy"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def build_ivf(self, nlist=None):
+        with self.lock:
+            self.nlist = nlist or self.nlist or max(1, int(np.sqrt(self.rows)))
+            if self.rows >= self.nlist:
+                self._train_ivf()
+
+    # --- Rewrites the live rows into the next generation directory; readers holding
+    # maps of the old generation keep them until they take a new view ---
+    def compact(self):
+        with self.lock:
+            view = self._view()
+            alive = np.isin(view["doc"], view["live_codes"])
+            if alive.all():
+                return 0
+            generation = self.generation + 1
+            target = os.path.join(self.directory, f"gen-{generation}")
+            shutil.rmtree(target, ignore_errors=True)
+            os.makedirs(target)
+            codes = sorted(self.latest.values())
+            remap = np.full(len(self.docs), -1, dtype=np.int32)
+            remap[codes] = np.arange(len(codes), dtype=np.int32)
+            docs = [self.docs[code] for code in codes]
+            rows = np.flatnonzero(alive)
+            text_bytes = meta_bytes = 0
+            columns = {name: [] for name in COLUMNS}
+            with open(os.path.join(target, "texts.bin"), "wb") as texts, \
+                    open(os.path.join(target, "meta.bin"), "wb") as metas, \
+                    open(os.path.join(target, "vectors.bin"), "wb") as vectors:
+                for start in range(0, len(rows), self.block_size):
+                    block = rows[start:start + self.block_size]
+                    vectors.write(np.asarray(view["vectors"][block]).tobytes())
+                    for blob, out, prefix, total in ((view["texts"], texts, "text", text_bytes),
+                                                     (view["meta"], metas, "meta", meta_bytes)):
+                        offsets, lengths = view[f"{prefix}_offset"][block], view[f"{prefix}_length"][block]
+                        for offset, length in zip(offsets, lengths):
+                            out.write(blob[offset:offset + length].tobytes())
+                        columns[f"{prefix}_offset"].append(total + np.concatenate([[0], np.cumsum(lengths)[:-1]]))
+                        columns[f"{prefix}_length"].append(np.asarray(lengths))
+                    text_bytes += int(columns["text_length"][-1].sum())
+                    meta_bytes += int(columns["meta_length"][-1].sum())
+                    columns["doc"].append(remap[view["doc"][block]])
+                    for name in ("scale", "list"):
+                        columns[name].append(np.asarray(view[name][block]))
+                for f in (texts, metas, vectors):
+                    f.flush()
+                    os.fsync(f.fileno())
+            for name, dtype in COLUMNS.items():
+                values = np.concatenate(columns[name]) if columns[name] else np.zeros(0)
+                values.astype(dtype).tofile(os.path.join(target, self._column(name)))
+            with open(os.path.join(target, "docs.jsonl"), "w", encoding="utf-8") as f:
+                for record in docs:
+                    f.write(json.dumps(record) + "\n")
+            if self.centroids is not None:
+                np.save(os.path.join(target, f"centroids-{self.ivf}.npy"), self.centroids)
+            # One state.json replace switches every file at once; the old generation is
+            # only removed once nothing committed points to it
+            old = self._path("")
+            removed = self.rows - len(rows)
+            self.generation = generation
+            self.docs = docs
+            self.latest = {record[0]: code for code, record in enumerate(docs)}
+            self.rows = len(rows)
+            self.text_bytes = text_bytes
+            self.meta_bytes = meta_bytes
+            self._commit_or_reload()
+            shutil.rmtree(old, ignore_errors=True)
+            return removed
+
+    # --- Search ---
+    def _candidates(self, view, query, urls):
+        live = view["live_codes"]
+        if urls is not None:
+            live = np.array([code for url in set(urls) for code in view["by_url"].get(url, ())], dtype=np.int32)
+        rows = np.flatnonzero(np.isin(view["doc"], live))
+        centroids = view["centroids"]
+        if centroids is not None and len(rows) > self.ivf_min_candidates:
+            probes = np.argsort(-(centroids @ query))[:self.nprobe]
+            rows = rows[np.isin(view["list"][rows], probes)]
+        return rows
+
+    def search(self, query_vector, k=4, urls=None):
+        # Returns [(row, cosine score)] best first, over live rows from the given URLs
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        view = self._view()
+        rows = self._candidates(view, query, urls)
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            # Contiguous runs (unfiltered scans, large sources) read the map directly instead of gathering
+            select = slice(block[0], block[-1] + 1) if block[-1] - block[0] + 1 == len(block) else block
+            scores = (view["vectors"][select].astype(np.float32, copy=False) @ query) * view["scale"][select]
+            best_rows = np.concatenate([best_rows, block])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_rows) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(int(best_rows[i]), float(best_scores[i])) for i in order]
+
+    def vectors(self, rows):
+        view = self._view()
+        return view["vectors"][rows].astype(np.float32) * view["scale"][rows][:, None]
+
+    def document(self, row):
+        view = self._view()
+        text = view["texts"][view["text_offset"][row]:][:view["text_length"][row]]
+        meta = view["meta"][view["meta_offset"][row]:][:view["meta_length"][row]]
+        return Document(page_content=text.tobytes().decode("utf-8"),
+                        metadata=json.loads(meta.tobytes().decode("utf-8")))
+
+    def view(self, urls, k=4):
+        return CompactView(self, urls, k=k)
+
+    def stats(self):
+        view = self._view()
+        return {
+            "dtype": self.dtype,
+            "rows": self.rows,
+            "live_rows": int(np.isin(view["doc"], view["live_codes"]).sum()),
+            "vector_bytes": int(view["vectors"].nbytes + view["scale"].nbytes),
+            "text_bytes": self.text_bytes,
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids)
+        }
+
+# --- Same as_retriever() surface as IndexView, restricted to the given sources ---
+class CompactView:
+    def __init__(self, store, urls, k=4):
+        self.store = store
+        self.urls = list(dict.fromkeys(urls))
+        self.k = k
+
+    def as_retriever(self, search_type="similarity", search_kwargs=None, **kwargs):
+        search_kwargs = dict(search_kwargs or {})
+        search_kwargs.setdefault("k", self.k)
+        search_kwargs["filter"] = {"url": {"$in": self.urls}}
+        return CompactRetriever(self.store, search_type, search_kwargs)
+
+# --- Supports the retriever options the pipeline uses: k, fetch_k, lambda_mult and a
+# Chroma-style url filter ({"url": "..."} or {"url": {"$in": [...]}}) ---
+class CompactRetriever:
+    def __init__(self, store, search_type="similarity", search_kwargs=None):
+        if search_type not in ("similarity", "mmr"):
+            raise ValueError(f"unsupported search_type {search_type!r}")
+        self.store = store
+        self.search_type = search_type
+        self.search_kwargs = search_kwargs or {}
+        url_filter = self.search_kwargs.get("filter", {}).get("url")
+        if isinstance(url_filter, dict):
+            self.urls = url_filter["$in"]
+        elif url_filter is not None:
+            self.urls = [url_filter]
+        else:
+            self.urls = None
+
+    def get_relevant_documents(self, query):
+        k = self.search_kwargs.get("k", 4)
+        query_vector = np.asarray(self.store.embeddings.embed_query(query), dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        if self.search_type == "mmr":
+            hits = self.store.search(query_vector, k=self.search_kwargs.get("fetch_k", 20), urls=self.urls)
+            rows = [row for row, _ in hits]
+            picked = mmr(query_vector, self.store.vectors(rows), k, self.search_kwargs.get("lambda_mult", 0.5))
+            rows = [rows[i] for i in picked]
+        else:
+            rows = [row for row, _ in self.store.search(query_vector, k=k, urls=self.urls)]
+        return [self.store.document(row) for row in rows]
+
+    invoke = get_relevant_documents
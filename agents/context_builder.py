@@ -0,0 +1,66 @@
+# agents/context_builder.py
+
+def approx_tokens(text):
+    return len(text) // 4 + 1
+
+# --- Packs retrieved chunks into a token budget: MMR retrieval for diversity,
+# overlapping chunks from the same indexed document stitched back together, then
+# greedy packing in rank order ---
+class ContextBuilder:
+    def __init__(self, count_tokens=None, budget=3000, k=12, fetch_k=40, lambda_mult=0.6):
+        self.count_tokens = count_tokens or approx_tokens
+        self.budget = budget
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+
+    def retrieve(self, query, vectorstore):
+        retriever = vectorstore.as_retriever(
+            search_type="mmr",
+            search_kwargs={"k": self.k, "fetch_k": self.fetch_k, "lambda_mult": self.lambda_mult}
+        )
+        return retriever.get_relevant_documents(query)
+
+    def merge(self, docs):
+        # Returns [rank, url, title, start, text] spans; chunks without offsets are kept as-is.
+        # Offsets are per doc_id: the pages of a PDF share its URL but each starts at 0
+        spans = []
+        by_doc = {}
+        for rank, doc in enumerate(docs):
+            meta = doc.metadata
+            span = [rank, meta.get("url", ""), meta.get("title", ""), meta.get("start_index"), doc.page_content]
+            if span[3] is None:
+                spans.append(span)
+            else:
+                by_doc.setdefault(meta.get("doc_id") or span[1], []).append(span)
+        for doc_spans in by_doc.values():
+            doc_spans.sort(key=lambda span: span[3])
+            current = doc_spans[0]
+            for span in doc_spans[1:]:
+                end = current[3] + len(current[4])
+                if span[3] <= end:
+                    current[4] += span[4][end - span[3]:]
+                    current[0] = min(current[0], span[0])
+                else:
+                    spans.append(current)
+                    current = span
+            spans.append(current)
+        spans.sort(key=lambda span: span[0])
+        return spans
+
+    def build(self, query, vectorstore):
+        docs = self.retrieve(query, vectorstore)
+        spans = self.merge(docs)
+        parts = []
+        cited = {}
+        used = 0
+        for _, url, title, _, text in spans:
+            tokens = self.count_tokens(text)
+            if used + tokens > self.budget:
+                continue
+            used += tokens
+            parts.append(text)
+            if url and url not in cited:
+                cited[url] = title or url
+        stats = {"retrieved": len(docs), "spans": len(spans), "packed": len(parts), "context_tokens": used}
+        return "\n\n".join(parts), cited, stats
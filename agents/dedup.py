@@ -0,0 +1,95 @@
+# agents/dedup.py
+
+import hashlib
+import numpy as np
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from .base import BaseAgent, log
+from .tracing import count
+
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src", "source", "cmpid", "ncid"}
+MERSENNE_PRIME = (1 << 31) - 1
+
+# --- Scheme-insensitive URL key: lowercase host without "www.", default ports,
+# trailing slash, fragment and tracking parameters removed, query sorted ---
+def canonicalize_url(url):
+    parts = urlparse(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunparse(("", host, parts.path.rstrip("/") or "/", "", urlencode(query), ""))
+
+# --- MinHash over word shingles, with LSH banding so each page is only compared
+# against pages that share at least one band ---
+class DedupAgent(BaseAgent):
+    def __init__(self, name, llm, num_perm=64, bands=16, shingle_size=5, threshold=0.8, seed=1):
+        super().__init__(name, llm)
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+
+    def signature(self, text):
+        words = text.lower().split()
+        n = max(len(words) - self.shingle_size + 1, 1)
+        shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(n)}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") & MERSENNE_PRIME
+             for s in shingles),
+            dtype=np.int64, count=len(shingles)
+        )
+        return ((self.a * hashes + self.b) % MERSENNE_PRIME).min(axis=1)
+
+    def session(self):
+        return DedupSession(self)
+
+    def run(self, sources, logs=None):
+        session = self.session()
+        kept = [src for src in sources if not session.check(src, logs=logs)]
+        count("items", len(kept))
+        return kept
+
+# --- Per-request state, so pages can be checked one at a time as they are scraped ---
+class DedupSession:
+    def __init__(self, agent):
+        self.agent = agent
+        self.urls = {}
+        self.buckets = {}
+        self.kept = []
+        self.dropped = []
+
+    def check(self, src, logs=None):
+        # Returns the URL of the kept page this one duplicates, or None if it is new
+        url = src.get("url", "")
+        canonical = canonicalize_url(url) if url else None
+        if canonical in self.urls:
+            return self._drop(src, self.urls[canonical], "same page as", logs)
+
+        signature = self.agent.signature(src.get("content", "") or src.get("snippet", ""))
+        rows = len(signature) // self.agent.bands
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.agent.bands)]
+        candidates = {i for key in keys for i in self.buckets.get(key, ())}
+        for i in sorted(candidates):
+            kept_url, kept_signature = self.kept[i]
+            similarity = float(np.mean(kept_signature == signature))
+            if similarity >= self.agent.threshold:
+                return self._drop(src, kept_url, f"near-duplicate ({similarity:.2f}) of", logs)
+
+        if canonical:
+            self.urls[canonical] = url
+        for key in keys:
+            self.buckets.setdefault(key, []).append(len(self.kept))
+        self.kept.append((url, signature))
+        return None
+
+    def _drop(self, src, kept, relation, logs):
+        log(f"Dedup: Dropping {src.get('url', '')}, {relation} {kept}", logs)
+        self.dropped.append(src)
+        return kept
@@ -0,0 +1,149 @@
+# agents/domain_health.py
+
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+from utils import percentile
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+class HostStats:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.opened_until = 0.0
+        self.cooldown = 0.0
+        self.probing = 0.0
+        self.trips = 0
+        self.skipped = 0
+
+# --- Rolling per-host fetch statistics shared by every request of a scraper.
+# They drive three things:
+# - timeout(url): a timeout derived from the host's recent latency percentile;
+# - hedge_after(url): how long a fetch may run before a backup URL is worth starting;
+# - allow(url): a circuit breaker. It opens after consecutive failures or a high
+#   recent failure rate. It stays open for a cooldown that doubles on each re-trip,
+#   then lets a single probe through (half-open); the probe's outcome closes or
+#   reopens it. Closing forgets the failures that tripped it, but the cooldown only
+#   resets after `recovery` successes in a row, so a host that keeps relapsing backs
+#   off longer each time.
+# Hosts with fewer than min_samples observations get default_timeout and no hedging.
+# At most max_hosts are tracked; the least recently used are forgotten first ---
+class DomainHealth:
+    def __init__(self, default_timeout=10.0, min_timeout=2.0, max_timeout=None, window=50, min_samples=5,
+                 timeout_percentile=95, timeout_multiplier=2.0, hedge_percentile=90, failure_threshold=3,
+                 max_failure_rate=0.6, cooldown=60.0, max_cooldown=1800.0, recovery=10, max_hosts=5_000):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout or default_timeout
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge_percentile = hedge_percentile
+        self.failure_threshold = failure_threshold
+        self.max_failure_rate = max_failure_rate
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.recovery = recovery
+        self.max_hosts = max_hosts
+        self.lock = threading.Lock()
+        self.hosts = OrderedDict()
+
+    def _host(self, url):
+        host = host_of(url)
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats(self.window)
+            if len(self.hosts) > self.max_hosts:
+                self.hosts.popitem(last=False)
+        else:
+            self.hosts.move_to_end(host)
+        return stats
+
+    def timeout(self, url):
+        with self.lock:
+            latencies = list(self._host(url).latencies)
+        if len(latencies) < self.min_samples:
+            return self.default_timeout
+        observed = percentile(latencies, self.timeout_percentile) * self.timeout_multiplier
+        return min(self.max_timeout, max(self.min_timeout, observed))
+
+    def hedge_after(self, url):
+        # Seconds after which a fetch from this host is slower than expected; None without history
+        with self.lock:
+            latencies = list(self._host(url).latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return percentile(latencies, self.hedge_percentile)
+
+    def allow(self, url):
+        now = time.monotonic()
+        with self.lock:
+            host = self._host(url)
+            if not host.opened_until:
+                return True
+            # A probe that never reported back (e.g. cancelled) stops blocking after max_timeout
+            if now < host.opened_until or now - host.probing < self.max_timeout:
+                host.skipped += 1
+                return False
+            host.probing = now
+            return True
+
+    # latency is None for failures that say nothing about speed (refused, challenge page)
+    def record(self, url, ok, latency=None):
+        now = time.monotonic()
+        with self.lock:
+            host = self._host(url)
+            if latency is not None:
+                host.latencies.append(latency)
+            if ok:
+                host.consecutive_failures = 0
+                host.consecutive_successes += 1
+                if host.opened_until:
+                    # The probe got through: close, starting a fresh failure-rate window
+                    host.outcomes.clear()
+                    host.opened_until = 0.0
+                    host.probing = 0.0
+                if host.consecutive_successes >= self.recovery:
+                    host.cooldown = 0.0
+                host.outcomes.append(ok)
+                return
+            host.outcomes.append(ok)
+            host.consecutive_successes = 0
+            host.consecutive_failures += 1
+            failure_rate = host.outcomes.count(False) / len(host.outcomes)
+            tripped = host.consecutive_failures >= self.failure_threshold or (
+                len(host.outcomes) >= self.min_samples and failure_rate >= self.max_failure_rate
+            )
+            if host.probing or (tripped and not host.opened_until):
+                host.cooldown = min(self.max_cooldown, host.cooldown * 2 or self.base_cooldown)
+                host.opened_until = now + host.cooldown
+                host.probing = 0.0
+                host.trips += 1
+
+    def stats(self, limit=20):
+        # Hosts with an open circuit first, then the slowest; the rest are summarized
+        now = time.monotonic()
+        with self.lock:
+            hosts = [(name, host, host.opened_until > now, percentile(list(host.latencies), 95))
+                     for name, host in self.hosts.items()]
+            worst = heapq.nsmallest(limit, hosts, key=lambda item: (not item[2], -item[3]))
+            rows = []
+            for name, host, is_open, p95 in worst:
+                outcomes = list(host.outcomes)
+                rows.append({
+                    "host": name,
+                    "open": is_open,
+                    "p50": percentile(list(host.latencies), 50),
+                    "p95": p95,
+                    "failure_rate": outcomes.count(False) / len(outcomes) if outcomes else 0.0,
+                    "trips": host.trips,
+                    "skipped": host.skipped
+                })
+        return {"hosts": len(hosts), "open": sum(item[2] for item in hosts), "worst": rows}
@@ -0,0 +1,149 @@
+# agents/embedding_cache.py
+
+import contextvars
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from langchain_core.embeddings import Embeddings
+
+_tally = contextvars.ContextVar("embedding_tally", default=None)
+
+# --- On-disk, content-addressed embedding store with LRU eviction ---
+class EmbeddingCache:
+    def __init__(self, path="cache/embeddings.sqlite", max_entries=200_000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self.lock:
+            (entries,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries
+        }
+
+# --- Embeddings wrapper: only unseen texts reach the model, in one batch.
+# The cache's own hits/misses are process-wide; tally() counts just the calls made
+# by the current thread (or task) inside the block, e.g. one chunker.add() ---
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    @contextmanager
+    def tally(self):
+        counts = {"hits": 0, "misses": 0}
+        token = _tally.set(counts)
+        try:
+            yield counts
+        finally:
+            _tally.reset(token)
+
+    # Returns (vectors, hits, misses) for this call; duplicates within it count once
+    def embed_documents_counted(self, texts):
+        keys = [self.cache.key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        hits = len(vectors)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            fresh = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), fresh))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+        return [vectors[key] for key in keys], hits, len(missing)
+
+    def embed_documents(self, texts):
+        vectors, hits, misses = self.embed_documents_counted(texts)
+        counts = _tally.get()
+        if counts is not None:
+            counts["hits"] += hits
+            counts["misses"] += misses
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+# --- Defers building the wrapped model until the first embedding is requested ---
+class LazyEmbeddings(Embeddings):
+    def __init__(self, loader):
+        self.loader = loader
+        self.embeddings = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        with self.lock:
+            if self.embeddings is None:
+                self.embeddings = self.loader()
+        return self.embeddings
+
+    def embed_documents(self, texts):
+        return self._load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._load().embed_query(text)
@@ -1,16 +1,28 @@
 # agents/evaluator.py
 
 from .base import BaseAgent, log
+from .tracing import count
+from .ranking import BM25Ranker, cosine_scores, is_trusted, top_k as select_top_k
+
+TRUSTED_DOMAINS = ("edu", "gov", "ac.uk", "mit.edu", "nature.com", "sciencedirect.com")
 
 class EvaluatorAgent(BaseAgent):
+    def __init__(self, name, llm, scorer="bm25", embeddings=None, trusted_domains=TRUSTED_DOMAINS):
+        super().__init__(name, llm)
+        self.scorer = scorer
+        self.embeddings = embeddings
+        self.trusted_domains = set(trusted_domains)
+        self.ranker = BM25Ranker()
+
+    def accepts(self, src, min_length=200, logs=None):
+        content = src.get("content", "") or src.get("snippet", "")
+        if len(content.strip()) >= min_length:
+            return True
+        log(f"Evaluator: Skipping short content from {src.get('url', '')}", logs)
+        return False
+
     def run(self, sources, query=None, min_length=200, top_k=5, logs=None):
-        filtered = []
-        for src in sources:
-            content = src.get("content", "") or src.get("snippet", "")
-            if len(content.strip()) >= min_length:
-                filtered.append(src)
-            else:
-                log(f"Evaluator: Skipping short content from {src.get('url', '')}", logs)
+        filtered = [src for src in sources if self.accepts(src, min_length=min_length, logs=logs)]
 
         # Deduplicate by URL
         seen_urls = set()
@@ -23,33 +35,31 @@ class EvaluatorAgent(BaseAgent):
             elif not url:
                 deduped.append(src)  # If no URL, keep (rare)
 
-        # Rank by keyword overlap with query
-        if query:
-            query_words = set(query.lower().split())
-            def relevance(src):
-                content = (src.get("content", "") or src.get("snippet", "")).lower()
-                return sum(word in content for word in query_words)
-            deduped.sort(key=relevance, reverse=True)
+        # Score each source once: BM25 over the query terms, or cosine over
+        # (cached) embeddings when an embeddings model is configured
+        texts = [src.get("content", "") or src.get("snippet", "") for src in deduped]
+        if query and texts:
+            if self.scorer == "embedding" and self.embeddings is not None:
+                scores = cosine_scores(self.embeddings.embed_query(query), self.embeddings.embed_documents(texts))
+            else:
+                scores = self.ranker.scores(texts, query)
+        else:
+            scores = [0.0] * len(texts)
 
         # Prefer trusted domains
-        trusted_domains = [".edu", ".gov", ".ac.uk", "mit.edu", "nature.com", "sciencedirect.com"]
         trusted = []
         others = []
-        for src in deduped:
-            url = src.get("url", "")
-            if any(domain in url for domain in trusted_domains):
-                trusted.append(src)
+        for i, src in enumerate(deduped):
+            if is_trusted(src.get("url", ""), self.trusted_domains):
+                trusted.append(i)
             else:
-                others.append(src)
+                others.append(i)
 
         # Select top_k, prioritizing trusted, but fill with others if needed
-        final = []
-        for src in trusted:
-            if len(final) < top_k:
-                final.append(src)
-        for src in others:
-            if len(final) < top_k:
-                final.append(src)
+        chosen = select_top_k(trusted, scores, top_k)
+        chosen += select_top_k(others, scores, top_k - len(chosen))
+        final = [deduped[i] for i in chosen]
 
+        count("items", len(final))
         log(f"Evaluator: Selected {len(final)} sources (trusted: {len(trusted)}) out of {len(sources)} input sources.", logs)
         return final
@@ -0,0 +1,135 @@
+# agents/extractors.py
+
+import re
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree as lxml_etree
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+DROP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "nav", "header", "footer",
+             "aside", "form", "button", "select"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th",
+              "pre", "blockquote", "dd", "dt", "figcaption", "br", "h1", "h2", "h3", "h4", "h5", "h6"}
+WHITESPACE = re.compile(r"\s+")
+
+# --- Original path: full BeautifulSoup tree, every text node on the page ---
+class SoupExtractor:
+    name = "soup"
+
+    def extract(self, html):
+        return BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+
+# --- Flat text blocks from parser events: dropped subtrees are skipped, text is
+# cut into blocks at block-level tags, link text is counted per block ---
+class BlockCollector:
+    def __init__(self):
+        self.blocks = []
+        self.pieces = []
+        self.link_chars = 0
+        self.skip = 0
+        self.links = 0
+
+    def start(self, tag):
+        if tag in DROP_TAGS:
+            self.skip += 1
+        elif tag == "a":
+            self.links += 1
+        elif tag in BLOCK_TAGS:
+            self.flush()
+
+    def end(self, tag):
+        if tag in DROP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+        elif tag == "a":
+            self.links = max(self.links - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.flush()
+
+    def data(self, text):
+        if self.skip or not text or text.isspace():
+            return
+        self.pieces.append(text)
+        if self.links:
+            self.link_chars += len(text.strip())
+
+    def flush(self):
+        if self.pieces:
+            text = WHITESPACE.sub(" ", " ".join(self.pieces)).strip()
+            if text:
+                self.blocks.append((text, min(self.link_chars / len(text), 1.0)))
+        self.pieces = []
+        self.link_chars = 0
+
+class _StdlibParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br":
+            self.collector.flush()
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+# --- Default path: lxml when installed, stdlib html.parser otherwise (no tree is
+# built), then a boilerplate pass that keeps long, link-poor blocks ---
+class FastExtractor:
+    name = "fast"
+
+    def __init__(self, min_words=10, max_link_density=0.5, min_content_chars=200):
+        self.min_words = min_words
+        self.max_link_density = max_link_density
+        self.min_content_chars = min_content_chars
+
+    def blocks(self, html):
+        collector = BlockCollector()
+        if lxml_html is not None:
+            try:
+                self._walk_lxml(lxml_html.document_fromstring(html), collector)
+                collector.flush()
+                return collector.blocks
+            except (lxml_etree.ParserError, ValueError):
+                collector = BlockCollector()
+        parser = _StdlibParser(collector)
+        parser.feed(html)
+        parser.close()
+        collector.flush()
+        return collector.blocks
+
+    def _walk_lxml(self, root, collector):
+        for event, element in lxml_etree.iterwalk(root, events=("start", "end")):
+            tag = element.tag if isinstance(element.tag, str) else None
+            if event == "start":
+                if tag:
+                    collector.start(tag)
+                    collector.data(element.text)
+            else:
+                if tag:
+                    collector.end(tag)
+                collector.data(element.tail)
+
+    def extract(self, html):
+        blocks = [(text, density) for text, density in self.blocks(html) if density <= self.max_link_density]
+        content = [text for text, _ in blocks if len(text.split()) >= self.min_words]
+        # Pages made of short blocks only (listings, tables): keep every link-poor block
+        if sum(len(text) for text in content) < self.min_content_chars:
+            content = [text for text, _ in blocks]
+        return "\n".join(content)
+
+EXTRACTORS = {"soup": SoupExtractor, "fast": FastExtractor}
+
+def get_extractor(extractor):
+    if isinstance(extractor, str):
+        return EXTRACTORS[extractor]()
+    return extractor
@@ -0,0 +1,92 @@
+# agents/page_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+
+# --- Extracted page text keyed by URL, shared by every worker process via SQLite ---
+class PageCache:
+    def __init__(self, path="cache/pages.sqlite", ttl=24 * 3600, negative_ttl=6 * 3600, max_entries=50_000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, ok INTEGER, content TEXT, etag TEXT, last_modified TEXT, "
+            "raw_bytes INTEGER, fetched_at REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+        self.conn.commit()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get(self, url):
+        # Returns (entry, fresh); a stale entry is returned so the caller can revalidate it
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT ok, content, etag, last_modified, raw_bytes, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            ok, content, etag, last_modified, raw_bytes, fetched_at = row
+            entry = {"ok": bool(ok), "content": content, "etag": etag,
+                     "last_modified": last_modified, "raw_bytes": raw_bytes}
+            fresh = time.time() - fetched_at < (self.ttl if ok else self.negative_ttl)
+            if fresh:
+                self.hits += 1
+                self.bytes_saved += raw_bytes
+                self.conn.execute("UPDATE pages SET last_used = ? WHERE url = ?", (time.time(), url))
+                self.conn.commit()
+            return entry, fresh
+
+    def validators(self, entry):
+        # Conditional headers are only worth sending for pages we would serve again
+        headers = {}
+        if entry and entry["ok"]:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def mark_revalidated(self, url, entry):
+        now = time.time()
+        with self.lock:
+            self.revalidated += 1
+            self.bytes_saved += entry["raw_bytes"]
+            self.conn.execute("UPDATE pages SET fetched_at = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self.conn.commit()
+
+    def put(self, url, content, ok, etag=None, last_modified=None, raw_bytes=0):
+        now = time.time()
+        with self.lock:
+            self.misses += 1
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, int(ok), content, etag, last_modified, raw_bytes, now, now)
+            )
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self.conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved
+        }
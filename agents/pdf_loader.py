@@ -1,11 +1,83 @@
 # agents/pdf_loader.py
 
-from langchain.document_loaders import PyPDFLoader
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
 from .base import BaseAgent, log
+from .tracing import count
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Module-level so worker processes can unpickle it
+def extract_pages(pdf_path, start, stop):
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
 
 class PDFLoaderAgent(BaseAgent):
+    traced_methods = ("run", "iter_pages")
+
+    def __init__(self, name, llm, max_workers=None, pages_per_task=16, cache_dir="cache/pdf"):
+        super().__init__(name, llm)
+        self.max_workers = max_workers or os.cpu_count()
+        self.pages_per_task = pages_per_task
+        self.cache_dir = cache_dir
+
     def run(self, pdf_path, logs=None):
-        log(f"PDFLoader: Loading and chunking PDF: {pdf_path}", logs)
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load_and_split()
-        return [{"content": doc.page_content, "url": pdf_path, "title": "Uploaded PDF"} for doc in docs]
+        return list(self.iter_pages(pdf_path, logs=logs))
+
+    # --- Yields one dict per page, in order. Page ranges are extracted in a process
+    # pool ahead of the consumer; the text is cached on disk by file hash ---
+    def iter_pages(self, pdf_path, logs=None):
+        log(f"PDFLoader: Loading PDF: {pdf_path}", logs)
+        digest = file_hash(pdf_path)
+        count("bytes", os.path.getsize(pdf_path))
+        cache_path = os.path.join(self.cache_dir, f"{digest}.jsonl")
+        if os.path.exists(cache_path):
+            log("PDFLoader: Using cached page text for this file", logs)
+            count("cache_hits")
+            with open(cache_path, encoding="utf-8") as f:
+                for page, line in enumerate(f):
+                    count("items")
+                    yield self._page(pdf_path, page, json.loads(line))
+            return
+
+        n_pages = len(PdfReader(pdf_path).pages)
+        ranges = [(start, min(start + self.pages_per_task, n_pages)) for start in range(0, n_pages, self.pages_per_task)]
+        log(f"PDFLoader: Extracting {n_pages} pages in {len(ranges)} ranges", logs)
+        count("cache_misses")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Unique per call: the same file may be loaded by several requests at once
+        tmp = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, prefix=f"{digest}.",
+                                          suffix=".tmp", delete=False)
+        tmp_path = tmp.name
+        pool = ProcessPoolExecutor(max_workers=min(self.max_workers, len(ranges))) if len(ranges) > 1 else None
+        try:
+            if pool:
+                batches = (job.result() for job in [pool.submit(extract_pages, pdf_path, a, b) for a, b in ranges])
+            else:
+                batches = (extract_pages(pdf_path, a, b) for a, b in ranges)
+            page = 0
+            with tmp as f:
+                for texts in batches:
+                    for text in texts:
+                        f.write(json.dumps(text) + "\n")
+                        count("items")
+                        yield self._page(pdf_path, page, text)
+                        page += 1
+            os.replace(tmp_path, cache_path)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _page(self, pdf_path, page, text):
+        return {"content": text, "url": pdf_path, "title": "Uploaded PDF", "doc_id": f"{pdf_path}#page={page + 1}"}
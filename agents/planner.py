@@ -1,11 +1,125 @@
 # agents/planner.py
 
-from .base import BaseAgent, log
+import math
+import re
+import threading
+from collections import Counter
+from .base import BaseAgent, log, normalize_query
+from .tracing import count
+
+# --- Deterministic rules: (pattern, flow, reason), first match wins ---
+ROUTING_RULES = [
+    (re.compile(r"\b(compare|comparison|versus|vs\.?|pros and cons|differences?|better|best)\b"), 2,
+     "Comparison across sources; evaluate and rank before synthesizing."),
+    (re.compile(r"\b(impact|effects?|evidence|review|survey|trends?|latest|state of|research|studies|study)\b"), 2,
+     "Research question; filter for trusted, substantial sources."),
+    (re.compile(r"^(what|who|when|where) (is|are|was|were)\b|\b(define|definition|meaning of)\b"), 1,
+     "Simple factual lookup; scraped pages can be used directly."),
+]
+
+# --- Labelled examples for the keyword classifier ---
+ROUTING_EXAMPLES = [
+    ("what is a transformer model", 1),
+    ("who founded hugging face", 1),
+    ("how to install pytorch on windows", 1),
+    ("when was the first llama model released", 1),
+    ("define retrieval augmented generation", 1),
+    ("python list comprehension syntax", 1),
+    ("capital of australia", 1),
+    ("how does a vector database work", 1),
+    ("compare llama 3 vs mistral 7b", 2),
+    ("impact of generative ai on scientific research", 2),
+    ("latest advances in protein folding", 2),
+    ("pros and cons of nuclear energy", 2),
+    ("evidence for intermittent fasting benefits", 2),
+    ("state of quantum computing in industry", 2),
+    ("how is machine learning changing drug discovery", 2),
+    ("review of climate change mitigation policies", 2),
+]
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+# --- Bag-of-words nearest-centroid classifier; learns from LLM decisions.
+# Requests route concurrently, so centroids are only read or updated under the lock ---
+class KeywordClassifier:
+    def __init__(self, examples=()):
+        self.centroids = {}
+        self.lock = threading.Lock()
+        for text, flow in examples:
+            self.learn(text, flow)
+
+    def learn(self, text, flow):
+        words = tokenize(text)
+        with self.lock:
+            self.centroids.setdefault(flow, Counter()).update(words)
+
+    def predict(self, text):
+        words = Counter(tokenize(text))
+        norm = math.sqrt(sum(c * c for c in words.values())) or 1.0
+        scores = {}
+        with self.lock:
+            for flow, centroid in self.centroids.items():
+                centroid_norm = math.sqrt(sum(c * c for c in centroid.values())) or 1.0
+                dot = sum(count * centroid[word] for word, count in words.items())
+                scores[flow] = dot / (norm * centroid_norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] == 0:
+            return 2, 0.0
+        best_flow, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return best_flow, (best - runner_up) / best
 
 class PlannerAgent(BaseAgent):
-    def run(self, query, pdf_uploaded):
+    def __init__(self, name, llm, router="local", min_confidence=0.35, max_cached=10_000):
+        super().__init__(name, llm)
+        self.router = router
+        self.min_confidence = min_confidence
+        self.max_cached = max_cached
+        self.classifier = KeywordClassifier(ROUTING_EXAMPLES)
+        self.decisions = {}
+        self.lock = threading.Lock()
+        self.local_routes = 0
+        self.cached_routes = 0
+        self.llm_fallbacks = 0
+
+    def run(self, query, pdf_uploaded, logs=None):
         if pdf_uploaded:
             return 3, "User uploaded a PDF. Using PDF chunking flow."
+        if self.router == "llm":
+            return self._ask_llm(query)
+
+        key = normalize_query(query)
+        with self.lock:
+            decision = self.decisions.get(key)
+        if decision is not None:
+            self.cached_routes += 1
+            count("cache_hits")
+            return decision
+
+        flow_number, reason, confidence = self._route_locally(key)
+        if confidence >= self.min_confidence:
+            self.local_routes += 1
+            return flow_number, reason
+
+        self.llm_fallbacks += 1
+        log(f"Planner: Local routing confidence {confidence:.2f}, asking the LLM", logs)
+        flow_number, reason = self._ask_llm(query)
+        with self.lock:
+            if key not in self.decisions and len(self.decisions) >= self.max_cached:
+                self.decisions.pop(next(iter(self.decisions)))
+            self.decisions[key] = (flow_number, reason)
+        self.classifier.learn(key, flow_number)
+        return flow_number, reason
+
+    def _route_locally(self, query):
+        for pattern, flow_number, reason in ROUTING_RULES:
+            if pattern.search(query):
+                return flow_number, reason, 1.0
+        flow_number, confidence = self.classifier.predict(query)
+        return flow_number, f"Keyword classifier (confidence {confidence:.2f}).", confidence
+
+    def _ask_llm(self, query):
         prompt = (
             f"Given the user query: \"{query}\", pick a task pipeline from:\n"
             "1. Retrieve > Scrape > Synthesize\n"
@@ -14,6 +128,9 @@ class PlannerAgent(BaseAgent):
             "Just return the flow number and a one-line reason."
         )
         response = self.llm(prompt) if self.llm else "2: Default to most robust pipeline."
+        # The model echoes the prompt, whose own "1. Retrieve > ..." line must not be parsed
+        if response.startswith(prompt):
+            response = response[len(prompt):]
         flow_number = 2
         reason = ""
         for line in response.splitlines():
@@ -21,4 +138,17 @@ class PlannerAgent(BaseAgent):
                 flow_number = int(line[0])
                 reason = line[2:].strip()
                 break
+        # Only asked without a PDF: a PDF flow would have nothing to load, and must not
+        # be cached or learned as the route for this query
+        if flow_number == 3:
+            return 2, "No PDF uploaded; using the web research flow instead of the PDF flow."
         return flow_number, reason
+
+    def stats(self):
+        routed = self.local_routes + self.cached_routes + self.llm_fallbacks
+        return {
+            "local": self.local_routes,
+            "cached": self.cached_routes,
+            "llm_fallbacks": self.llm_fallbacks,
+            "fallback_rate": self.llm_fallbacks / routed if routed else 0.0
+        }
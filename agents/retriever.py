@@ -1,22 +1,105 @@
 # agents/retriever.py
 
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from langchain_community.utilities import GoogleSerperAPIWrapper
-from .base import BaseAgent, log
+from .base import BaseAgent, log, normalize_query
+from .tracing import count
 
 class RetrieverAgent(BaseAgent):
+    def __init__(self, name, llm, client=None, fetch_k=20, max_fetch_k=100, cache_ttl=3600, max_cached_queries=1000):
+        super().__init__(name, llm)
+        self.client = client
+        self.clients = {}
+        self.fetch_k = fetch_k
+        self.max_fetch_k = max_fetch_k
+        self.cache_ttl = cache_ttl
+        self.max_cached_queries = max_cached_queries
+        self.cache = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # --- One long-lived Serper client per result depth; an injected client (any object
+    # with .results(query)) is used as-is for every depth ---
+    def _client(self, depth):
+        with self.lock:
+            if self.client is not None:
+                return self.client
+            if depth not in self.clients:
+                self.clients[depth] = GoogleSerperAPIWrapper(serper_api_key=os.environ["SERPER_API_KEY"], k=depth)
+            return self.clients[depth]
+
+    # --- Cached search: at least fetch_k results are kept per normalized query so a
+    # later, larger top_k is still a hit. A top_k past the cached depth fetches deeper
+    # (in steps of fetch_k, up to max_fetch_k) unless the last fetch already came back
+    # short. Concurrent identical queries share one request ---
+    def search(self, query, top_k=None):
+        key = normalize_query(query)
+        steps = -(-(top_k or 0) // self.fetch_k)
+        depth = min(self.max_fetch_k, max(1, steps) * self.fetch_k)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and cached[0] > time.time() and (cached[2] >= depth or len(cached[1]) < cached[2]):
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return cached[1], "cached"
+            future = self.in_flight.get((key, depth))
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[(key, depth)] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result(), "coalesced"
+
+        try:
+            organic = self._client(depth).results(query).get("organic", [])
+        except Exception as e:
+            with self.lock:
+                self.in_flight.pop((key, depth), None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            cached = self.cache.get(key)
+            # A concurrent deeper fetch that is still fresh is not replaced by a shallower one
+            if cached is None or cached[0] <= time.time() or cached[2] <= depth:
+                self.cache[key] = (time.time() + self.cache_ttl, organic, depth)
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached_queries:
+                self.cache.popitem(last=False)
+            self.in_flight.pop((key, depth), None)
+        future.set_result(organic)
+        return organic, "live"
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0
+        }
+
     def run(self, query, top_k=5, logs=None):
         log(f"Retriever: Searching for '{query}'", logs)
-        serper = GoogleSerperAPIWrapper(serper_api_key=os.environ["SERPER_API_KEY"])
-        results = serper.results(query)
+        organic, origin = self.search(query, top_k)
         urls = []
-        if 'organic' in results:
-            for item in results['organic'][:top_k]:
-                if 'link' in item:
-                    urls.append({
-                        "url": item['link'],
-                        "title": item.get('title', ''),
-                        "snippet": item.get('snippet', '')
-                    })
-        log(f"Retriever: Found {len(urls)} URLs", logs)
+        for item in organic[:top_k]:
+            if 'link' in item:
+                urls.append({
+                    "url": item['link'],
+                    "title": item.get('title', ''),
+                    "snippet": item.get('snippet', '')
+                })
+        count("cache_hits" if origin != "live" else "cache_misses")
+        count("items", len(urls))
+        log(f"Retriever: Found {len(urls)} URLs ({origin})", logs)
         return urls
@@ -1,11 +1,205 @@
 # agents/scraper.py
 
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
-from bs4 import BeautifulSoup
-from .base import BaseAgent, log
+from requests.adapters import HTTPAdapter
+from utils import percentile
+from .base import BaseAgent, log, submit_with_context
+from .domain_health import DomainHealth, host_of
+from .extractors import get_extractor
+from .page_cache import PageCache
+from .tracing import count
+
+BLOCK_MARKERS = ("Access Denied", "Enable JavaScript", "Just a moment...")
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+class CircuitOpen(Exception):
+    pass
+
+def is_usable(content):
+    return len(content) >= 100 and not any(marker in content for marker in BLOCK_MARKERS)
 
 class ScraperAgent(BaseAgent):
+    traced_methods = ("run", "iter_scrape")
+
+    def __init__(self, name, llm, max_workers=8, per_host_limit=2, timeout=10, concurrent=True, session=None,
+                 cache_path="cache/pages.sqlite", cache_ttl=24 * 3600, negative_cache_ttl=6 * 3600,
+                 extractor="fast", max_bytes=2_000_000, domain_health=True):
+        super().__init__(name, llm)
+        self.extractor = get_extractor(extractor)
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.concurrent = concurrent
+        self.session = session or self._make_session()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scraper")
+        self.page_cache = None
+        if cache_path:
+            self.page_cache = PageCache(cache_path, ttl=cache_ttl, negative_ttl=negative_cache_ttl)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.coalesced = 0
+        # Per-host timeouts, circuit breaking and hedging; False keeps the flat timeout
+        if domain_health is True:
+            domain_health = DomainHealth(default_timeout=timeout)
+        self.health = domain_health or None
+
+    # --- One keep-alive session, at most per_host_limit sockets per host ---
+    def _make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.per_host_limit,
+            pool_block=True
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"User-Agent": "Mozilla/5.0"})
+        return session
+
+    # --- Concurrent requests that want the same URL share one fetch ---
+    def _fetch(self, source):
+        url = source["url"]
+        with self.lock:
+            future = self.in_flight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[url] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            _, content, error, elapsed = future.result()
+            count("cache_hits")
+            return source, content, error, elapsed
+        result = (source, None, RuntimeError("fetch did not complete"), 0.0)
+        try:
+            result = self._fetch_page(source)
+        finally:
+            with self.lock:
+                self.in_flight.pop(url, None)
+            future.set_result(result)
+        return result
+
+    def _fetch_page(self, source):
+        start = time.perf_counter()
+        url = source["url"]
+        try:
+            entry, fresh = self.page_cache.get(url) if self.page_cache else (None, False)
+            if fresh:
+                count("cache_hits")
+                return source, entry["content"], None, time.perf_counter() - start
+            if self.health is not None and not self.health.allow(url):
+                raise CircuitOpen(f"Skipping {host_of(url)}: circuit open after repeated failures")
+            headers = self.page_cache.validators(entry) if self.page_cache else {}
+            timeout = self.health.timeout(url) if self.health is not None else self.timeout
+            with self.session.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+                if entry and headers and resp.status_code == 304:
+                    self._record(url, True, time.perf_counter() - start)
+                    self.page_cache.mark_revalidated(url, entry)
+                    count("cache_hits")
+                    return source, entry["content"], None, time.perf_counter() - start
+                # Only successful responses are cached; errors and rate limits are retried next time
+                cacheable = self.page_cache is not None and 200 <= resp.status_code < 300
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type and content_type not in HTML_TYPES:
+                    self._record(url, True, time.perf_counter() - start)
+                    if cacheable:
+                        self.page_cache.put(url, "", False)
+                    raise ValueError(f"Skipping non-HTML content type {content_type}")
+                body = self._read_body(resp)
+            latency = time.perf_counter() - start
+            count("cache_misses")
+            count("bytes", len(body))
+            content = self.extractor.extract(body.decode(resp.encoding or "utf-8", errors="replace"))
+            # Server errors, rate limits and challenge pages count against the host like failed fetches
+            healthy = resp.status_code < 500 and resp.status_code != 429 and not any(
+                marker in content for marker in BLOCK_MARKERS
+            )
+            self._record(url, healthy, latency if healthy else None)
+            if cacheable:
+                self.page_cache.put(
+                    url, content, is_usable(content),
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                    raw_bytes=len(body)
+                )
+            return source, content, None, time.perf_counter() - start
+        except requests.exceptions.RequestException as e:
+            # Timeouts say the host is at least this slow; other errors say nothing about speed
+            timed_out = isinstance(e, requests.exceptions.Timeout)
+            self._record(url, False, time.perf_counter() - start if timed_out else None)
+            return source, None, e, time.perf_counter() - start
+        except Exception as e:
+            return source, None, e, time.perf_counter() - start
+
+    def _record(self, url, ok, latency=None):
+        if self.health is not None:
+            self.health.record(url, ok, latency)
+
+    # --- Reads at most max_bytes of the body; anything past the cap is never downloaded ---
+    def _read_body(self, resp):
+        chunks = []
+        size = 0
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_bytes:
+                break
+        return b"".join(chunks)[:self.max_bytes]
+
+    # times collects the fetch latencies of the current run
+    def _accept(self, source, content, error, elapsed, logs, times):
+        url = source["url"]
+        times.append(elapsed)
+        if error is not None:
+            log(f"Scraper: Exception scraping {url}: {error}", logs)
+            return None
+        log(f"Scraper: Content length {len(content)}", logs)
+        if any(marker in content for marker in BLOCK_MARKERS):
+            log(f"Scraper: Blocked or JS required for {url}", logs)
+            return None
+        if len(content) < 100:
+            log(f"Scraper: Content too short for {url}", logs)
+            return None
+        return {"url": url, "title": source.get("title", ""), "content": content}
+
+    @staticmethod
+    def latency_stats(times):
+        return {"count": len(times), "p50": percentile(times, 50), "p99": percentile(times, 99)}
+
     def run(self, sources, retriever, query, desired_count=5, max_attempts=3, logs=None):
+        return list(self.iter_scrape(sources, retriever, query, desired_count, max_attempts, logs))
+
+    # --- Yields each accepted page as soon as it is scraped ---
+    def iter_scrape(self, sources, retriever, query, desired_count=5, max_attempts=3, logs=None):
+        start = time.perf_counter()
+        times = []
+        if self.concurrent:
+            pages = self._iter_concurrent(sources, retriever, query, desired_count, max_attempts, logs, times)
+        else:
+            pages = self._iter_sequential(sources, retriever, query, desired_count, max_attempts, logs, times)
+        accepted = 0
+        try:
+            for page in pages:
+                accepted += 1
+                count("items")
+                yield page
+        finally:
+            pages.close()
+            stats = self.latency_stats(times)
+            log(f"Scraper: Final scraped results: {accepted}", logs)
+            log(f"Scraper: Run took {time.perf_counter() - start:.2f}s "
+                f"(per-page p50 {stats['p50']:.2f}s, p99 {stats['p99']:.2f}s over {stats['count']} fetches)", logs)
+            if self.page_cache:
+                cache = self.page_cache.stats()
+                log(f"Scraper: Page cache hit rate {cache['hit_rate']:.0%} "
+                    f"({cache['revalidated']} revalidated), {cache['bytes_saved']} bytes saved", logs)
+
+    def _iter_sequential(self, sources, retriever, query, desired_count, max_attempts, logs, times):
         scraped_results = []
         attempted_urls = set()
         attempts = 0
@@ -18,29 +212,81 @@ class ScraperAgent(BaseAgent):
                     continue
                 attempted_urls.add(url)
                 log(f"Scraper: Scraping {url}", logs)
-                try:
-                    resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
-                    soup = BeautifulSoup(resp.text, "html.parser")
-                    content = soup.get_text(separator=" ", strip=True)
-                    log(f"Scraper: Content length {len(content)}", logs)
-                    if ("Access Denied" in content or "Enable JavaScript" in content or "Just a moment..." in content):
-                        log(f"Scraper: Blocked or JS required for {url}", logs)
-                        continue
-                    if len(content) < 100:
-                        log(f"Scraper: Content too short for {url}", logs)
-                        continue
-                    scraped_results.append({
-                        "url": url,
-                        "title": source.get("title", ""),
-                        "content": content
-                    })
-                except Exception as e:
-                    log(f"Scraper: Exception scraping {url}: {e}", logs)
+                result = self._accept(*self._fetch(source), logs, times)
+                if result:
+                    scraped_results.append(result)
+                    yield result
             if len(scraped_results) < desired_count:
                 extra_needed = desired_count - len(scraped_results)
                 log(f"Scraper: Fetching {extra_needed} more URLs from retriever...", logs)
                 sources = retriever.run(query, top_k=extra_needed * (attempts + 2))
             attempts += 1
 
-        log(f"Scraper: Final scraped results: {len(scraped_results)}", logs)
-        return scraped_results
+    # --- Fetch everything in flight at once; refill from the retriever as soon as
+    # the in-flight fetches can no longer reach desired_count on their own. A fetch
+    # running past its host's usual latency (DomainHealth.hedge_after) stops counting
+    # as in flight, so a backup URL is fetched alongside it; whichever finishes first wins ---
+    def _iter_concurrent(self, sources, retriever, query, desired_count, max_attempts, logs, times):
+        scraped = 0
+        attempted_urls = set()
+        pending = set()
+        urls = {}
+        deadlines = {}
+        hedged = set()
+        refill = None
+
+        def submit(batch):
+            for source in batch:
+                url = source['url']
+                if url in attempted_urls:
+                    continue
+                attempted_urls.add(url)
+                log(f"Scraper: Scraping {url}", logs)
+                fut = submit_with_context(self.pool, self._fetch, source)
+                pending.add(fut)
+                urls[fut] = url
+                expected = self.health.hedge_after(url) if self.health is not None else None
+                if expected is not None:
+                    deadlines[fut] = time.monotonic() + expected
+
+        log(f"Scraper: Attempt 1, fetching {len(sources)} URLs concurrently", logs)
+        submit(sources)
+        attempts = 1
+
+        try:
+            while scraped < desired_count and (pending or refill or attempts < max_attempts):
+                in_play = len(pending - hedged)
+                if refill is None and attempts < max_attempts and scraped + in_play < desired_count:
+                    extra_needed = desired_count - scraped
+                    log(f"Scraper: Fetching {extra_needed} more URLs from retriever...", logs)
+                    refill = submit_with_context(
+                        self.pool, retriever.run, query, top_k=extra_needed * (attempts + 1)
+                    )
+                    attempts += 1
+
+                waiting = [deadlines[fut] for fut in pending - hedged if fut in deadlines]
+                timeout = max(0.0, min(waiting) - time.monotonic()) if waiting else None
+                done, _ = wait(pending | ({refill} if refill else set()), timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for fut in pending - hedged - done:
+                    if fut in deadlines and deadlines[fut] <= now:
+                        hedged.add(fut)
+                        log(f"Scraper: {urls[fut]} is slower than usual for its host, hedging with a backup URL", logs)
+                for fut in done:
+                    if fut is refill:
+                        refill = None
+                        try:
+                            submit(fut.result())
+                        except Exception as e:
+                            log(f"Scraper: Exception refilling from retriever: {e}", logs)
+                        continue
+                    pending.discard(fut)
+                    result = self._accept(*fut.result(), logs, times)
+                    if result and scraped < desired_count:
+                        scraped += 1
+                        yield result
+        finally:
+            # Early stop: drop fetches that have not started; running ones finish in the background
+            for fut in pending:
+                fut.cancel()
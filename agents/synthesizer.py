@@ -1,50 +1,67 @@
 # agents/synthesizer.py
 
 import re
-from .base import BaseAgent, log
+import time
+from .base import BaseAgent, log, current_request
+from .context_builder import ContextBuilder
+from .tracing import count
+
+AI_KEYWORDS = [
+    "ai", "artificial intelligence", "machine learning", "generative",
+    "research", "science", "scientific"
+]
+
+CLOSING = (
+    "\n\nResponsible adoption of generative AI-guided by transparency, ethical standards, and human oversight-"
+    "will be essential to maximize its benefits and maintain trust in scientific research."
+)
+
+# --- Fixed instruction blocks; everything request-specific comes after them, so the
+# model can reuse their cached past-key-values (see llm_setup.register_prefix) ---
+AI_INSTRUCTIONS = (
+    "Using only the context below, write a nuanced and engaging summary answering the question. "
+    "Highlight how generative AI is changing scientific research, giving concrete examples where possible. "
+    "Discuss both the transformative benefits and the most pressing challenges, making connections between them. "
+    "Conclude with a sentence on the importance of responsible adoption and human oversight. "
+    "Write in a clear, professional, but lively style as if for a science magazine or a research newsletter. "
+    "At the end, list each unique source in markdown link format as a clean, deduplicated list.\n\n"
+)
+
+GENERAL_INSTRUCTIONS = (
+    "Using only the context below, write a clear, engaging, and accurate summary answering the question. "
+    "Focus on the main facts, insights, and relevant details. "
+    "At the end, list each unique source in markdown link format as a clean, deduplicated list.\n\n"
+)
+
+PROMPT_PREFIXES = (AI_INSTRUCTIONS, GENERAL_INSTRUCTIONS)
 
 class SynthesizerAgent(BaseAgent):
-    def run(self, query, vectorstore):
-        retriever = vectorstore.as_retriever()
-        relevant_docs = retriever.get_relevant_documents(query)
-        context = ""
-        cited = {}
-        for doc in relevant_docs:
-            meta = doc.metadata
-            url = meta.get('url', '')
-            title = meta.get('title', '') or url
-            if url and url not in cited:
-                cited[url] = title
-            context += f"{doc.page_content}\n\n"
-
-        ai_keywords = [
-            "ai", "artificial intelligence", "machine learning", "generative",
-            "research", "science", "scientific"
-        ]
-        if any(word in query.lower() for word in ai_keywords):
-            prompt = (
-                f"Using only the context below, write a nuanced and engaging summary answering the question. "
-                f"Highlight how generative AI is changing scientific research, giving concrete examples where possible. "
-                f"Discuss both the transformative benefits and the most pressing challenges, making connections between them. "
-                f"Conclude with a sentence on the importance of responsible adoption and human oversight. "
-                f"Write in a clear, professional, but lively style as if for a science magazine or a research newsletter. "
-                f"At the end, list each unique source in markdown link format as a clean, deduplicated list.\n\n"
-                f"Context:\n{context}\n\n"
-                f"Question: {query}\n"
-                f"Answer:"
-            )
-        else:
-            prompt = (
-                f"Using only the context below, write a clear, engaging, and accurate summary answering the question. "
-                f"Focus on the main facts, insights, and relevant details. "
-                f"At the end, list each unique source in markdown link format as a clean, deduplicated list.\n\n"
-                f"Context:\n{context}\n\n"
-                f"Question: {query}\n"
-                f"Answer:"
-            )
+    traced_methods = ("run", "stream")
 
-        answer = self.llm(prompt) if self.llm else prompt
+    def __init__(self, name, llm, stream_llm=None, context_builder=None):
+        super().__init__(name, llm)
+        self.stream_llm = stream_llm
+        self.context_builder = context_builder or ContextBuilder()
 
+    def _build_prompt(self, query, vectorstore, logs=None):
+        context, cited, stats = self.context_builder.build(query, vectorstore)
+        request = current_request()
+        if request is not None:
+            # The exact context the answer is grounded on, for faithfulness judging
+            request.record("context", text=context, sources=list(cited))
+
+        instructions = AI_INSTRUCTIONS if any(word in query.lower() for word in AI_KEYWORDS) else GENERAL_INSTRUCTIONS
+        prompt = instructions + f"Context:\n{context}\n\nQuestion: {query}\nAnswer:"
+        prompt_tokens = self.context_builder.count_tokens(prompt)
+        count("tokens_in", prompt_tokens)
+        count("items", stats["packed"])
+        log(f"Synthesizer: Prompt is {prompt_tokens} tokens "
+            f"({stats['context_tokens']}/{self.context_builder.budget} context tokens from "
+            f"{stats['packed']} of {stats['spans']} merged spans, {stats['retrieved']} chunks retrieved)", logs)
+        return prompt, cited, prompt_tokens
+
+    # --- Cleanup that is safe to re-run on a growing partial answer ---
+    def _clean(self, answer):
         # Only display the part after "Answer:"
         if "Answer:" in answer:
             answer = answer.split("Answer:", 1)[1].strip()
@@ -54,14 +71,13 @@ class SynthesizerAgent(BaseAgent):
         answer = re.sub(r'(\nSummary:.*?)(\nSummary:)', r'\2', answer, flags=re.IGNORECASE | re.DOTALL)
         answer = re.sub(r'(\nSources:.*?)(\nSources:)', r'\2', answer, flags=re.IGNORECASE | re.DOTALL)
         answer = re.sub(r'\n{3,}', '\n\n', answer)
+        return answer
 
-        closing = (
-            "\n\nResponsible adoption of generative AI-guided by transparency, ethical standards, and human oversight-"
-            "will be essential to maximize its benefits and maintain trust in scientific research."
-        )
-        if any(word in query.lower() for word in ai_keywords):
-            if closing.strip() not in answer:
-                answer += closing
+    # --- Additions that only make sense once the answer is complete ---
+    def _finish(self, query, answer, cited):
+        if any(word in query.lower() for word in AI_KEYWORDS):
+            if CLOSING.strip() not in answer:
+                answer += CLOSING
 
         if cited and "sources:" not in answer.lower():
             answer += "\n\nSources:\n"
@@ -69,3 +85,36 @@ class SynthesizerAgent(BaseAgent):
                 answer += f"- [{title}]({url})\n"
 
         return answer
+
+    # The batched LLM returns the whole answer at once, so prefill is not timed on its own
+    # here; stream() reports it as time to first token
+    def run(self, query, vectorstore, logs=None):
+        prompt, cited, prompt_tokens = self._build_prompt(query, vectorstore, logs)
+        start = time.perf_counter()
+        answer = self.llm(prompt) if self.llm else prompt
+        # The backend echoes the prompt ahead of the completion
+        completion = answer[len(prompt):] if answer.startswith(prompt) else answer
+        completion_tokens = self.context_builder.count_tokens(completion)
+        count("tokens_out", completion_tokens)
+        log(f"Synthesizer: Generation took {time.perf_counter() - start:.2f}s end to end "
+            f"({prompt_tokens} prompt tokens in, {completion_tokens} tokens out; "
+            f"prefill is not timed separately when batched)", logs)
+        return self._finish(query, self._clean(answer), cited)
+
+    # --- Yields the cleaned answer so far after every streamed piece, then the final answer ---
+    def stream(self, query, vectorstore, logs=None):
+        if self.stream_llm is None:
+            yield self.run(query, vectorstore, logs=logs)
+            return
+        prompt, cited, prompt_tokens = self._build_prompt(query, vectorstore, logs)
+        start = time.perf_counter()
+        raw = ""
+        for piece in self.stream_llm(prompt):
+            if not raw and piece:
+                log(f"Synthesizer: First token (prefill of {prompt_tokens} prompt tokens) after "
+                    f"{time.perf_counter() - start:.2f}s", logs)
+            raw += piece
+            yield self._clean(raw)
+        count("tokens_out", self.context_builder.count_tokens(raw))
+        log(f"Synthesizer: Generation finished in {time.perf_counter() - start:.2f}s", logs)
+        yield self._finish(query, self._clean(raw), cited)
@@ -0,0 +1,148 @@
+# agents/tracing.py
+
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from .base import _current_request, _current_span
+
+COUNTERS = ("items", "bytes", "tokens_in", "tokens_out", "tokens_reused", "cache_hits", "cache_misses")
+_span_ids = itertools.count(1)
+
+# --- One timed agent call. Wall time covers the whole call; CPU time is the calling
+# thread's only, so work handed to pools shows up as wall time ---
+class Span:
+    def __init__(self, name, agent):
+        self.id = next(_span_ids)
+        parent = _current_span.get()
+        self.parent_id = parent.id if parent else None
+        self.name = name
+        self.agent = agent
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+        self.error = None
+        self.cpu = 0.0
+        self.start = time.perf_counter()
+
+    def add(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def finish(self):
+        wall = time.perf_counter() - self.start
+        METRICS.observe(self, wall)
+        context = _current_request.get()
+        if context is not None:
+            token = _current_span.set(self)
+            try:
+                context.record(
+                    "span", name=self.name, parent_id=self.parent_id,
+                    start=round(self.start - context.started, 6), wall=round(wall, 6), cpu=round(self.cpu, 6),
+                    counts=dict(self.counts), error=self.error
+                )
+            finally:
+                _current_span.reset(token)
+
+# Adds to a counter of the innermost open span; a no-op outside any span
+def count(key, n=1):
+    span = _current_span.get()
+    if span is not None and n:
+        span.add(key, n)
+
+# --- Wraps an agent method in a span named "<agent name>.<method>". Generator
+# methods keep their span open until exhausted, but it is only current while the
+# generator body runs, not while the consumer handles a yielded item ---
+def traced(method):
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            span = Span(f"{self.name}.{method.__name__}", self.name)
+            inner = method(self, *args, **kwargs)
+            try:
+                while True:
+                    token = _current_span.set(span)
+                    cpu_start = time.thread_time()
+                    try:
+                        value = next(inner)
+                    except StopIteration:
+                        return
+                    finally:
+                        span.cpu += time.thread_time() - cpu_start
+                        _current_span.reset(token)
+                    yield value
+            except BaseException as e:
+                if not isinstance(e, GeneratorExit):
+                    span.error = repr(e)
+                raise
+            finally:
+                inner.close()
+                span.finish()
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        span = Span(f"{self.name}.{method.__name__}", self.name)
+        token = _current_span.set(span)
+        cpu_start = time.thread_time()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.cpu = time.thread_time() - cpu_start
+            _current_span.reset(token)
+            span.finish()
+    return wrapper
+
+# --- Process-wide totals per span name, for scraping as Prometheus counters ---
+class SpanMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Counts stay ints; only the *_seconds totals become floats
+        self.totals = defaultdict(lambda: defaultdict(int))
+
+    def observe(self, span, wall):
+        with self.lock:
+            totals = self.totals[span.name]
+            totals["calls"] += 1
+            totals["errors"] += span.error is not None
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += span.cpu
+            for key, n in span.counts.items():
+                totals[key] += n
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(totals) for name, totals in self.totals.items()}
+
+    def prometheus(self, prefix="intellimesh"):
+        lines = []
+        snapshot = self.snapshot()
+        metrics = ["calls", "errors", "wall_seconds", "cpu_seconds", *COUNTERS]
+        for metric in metrics:
+            lines.append(f"# TYPE {prefix}_span_{metric}_total counter")
+            for name, totals in sorted(snapshot.items()):
+                if metric in totals:
+                    # :g would round large counters to 6 significant digits
+                    value = totals[metric]
+                    value = f"{value:d}" if isinstance(value, int) else repr(float(value))
+                    lines.append(f'{prefix}_span_{metric}_total{{span="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+METRICS = SpanMetrics()
+
+# --- One JSON object per event, tagged with the request it belongs to ---
+def write_jsonl(context, path):
+    with open(path, "a", encoding="utf-8") as f:
+        for event in context.events:
+            f.write(json.dumps({"request_id": context.request_id, **event}) + "\n")
+
+def spans(events):
+    return [event for event in events if event["type"] == "span"]
+
+def agents_used(events):
+    return {event["agent"] for event in spans(events)}
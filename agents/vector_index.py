@@ -0,0 +1,81 @@
+# agents/vector_index.py
+
+import hashlib
+import threading
+from langchain.vectorstores import Chroma
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+# --- Long-lived Chroma collection shared across requests, one version per URL ---
+class VectorIndex:
+    def __init__(self, embeddings, persist_directory="cache/index", collection_name="intellimesh"):
+        self.store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=persist_directory
+        )
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    # callback(url) runs after an indexed source is replaced by a different version
+    def on_change(self, callback):
+        self.listeners.append(callback)
+
+    def upsert(self, doc_id, digest, splits):
+        # doc_id is the URL, or URL plus part for sources indexed piecewise (PDF pages).
+        # Returns the number of chunks written; 0 when this version is already indexed
+        changed = None
+        with self.lock:
+            existing = self.store.get(where={"doc_id": doc_id}, include=["metadatas"])
+            if existing["ids"] and all(m.get("content_hash") == digest for m in existing["metadatas"]):
+                return 0
+            if existing["ids"]:
+                self.store.delete(ids=existing["ids"])
+                changed = existing["metadatas"][0].get("url", doc_id)
+            written = self._add(doc_id, digest, splits)
+        if changed is not None:
+            for callback in self.listeners:
+                callback(changed)
+        return written
+
+    def retain(self, url, doc_ids):
+        # Drops the chunks of `url` whose doc_id is not in doc_ids, e.g. the pages past the
+        # end of a shorter PDF uploaded to the same path; returns the chunks removed
+        keep = set(doc_ids)
+        with self.lock:
+            existing = self.store.get(where={"url": url}, include=["metadatas"])
+            stale = [id_ for id_, meta in zip(existing["ids"], existing["metadatas"]) if meta.get("doc_id") not in keep]
+            if stale:
+                self.store.delete(ids=stale)
+        if stale:
+            for callback in self.listeners:
+                callback(url)
+        return len(stale)
+
+    def _add(self, doc_id, digest, splits):
+        if not splits:
+            return 0
+        prefix = hashlib.sha256(doc_id.encode("utf-8")).hexdigest()[:16]
+        for split in splits:
+            split.metadata["doc_id"] = doc_id
+            split.metadata["content_hash"] = digest
+        ids = [f"{prefix}:{digest}:{i}" for i in range(len(splits))]
+        self.store.add_documents(splits, ids=ids)
+        return len(splits)
+
+    def view(self, urls, k=4):
+        return IndexView(self.store, urls, k=k)
+
+# --- Same as_retriever() surface as a Chroma store, restricted to the given sources ---
+class IndexView:
+    def __init__(self, store, urls, k=4):
+        self.store = store
+        self.urls = list(dict.fromkeys(urls))
+        self.k = k
+
+    def as_retriever(self, **kwargs):
+        search_kwargs = dict(kwargs.pop("search_kwargs", None) or {})
+        search_kwargs.setdefault("k", self.k)
+        search_kwargs["filter"] = {"url": {"$in": self.urls}}
+        return self.store.as_retriever(search_kwargs=search_kwargs, **kwargs)
@@ -1,20 +1,47 @@
+import os
 import gradio as gr
 from orchestrator import orchestrator  # The instance, not the class
-from utils import style_logs, style_answer
+from llm_setup import registry
+from utils import render_events, style_answer
+from workers import RequestPool, ServerBusy
+from agents.tracing import METRICS
 import time
+from threading import Thread
+
+# Pipelines running at once, and requests allowed to wait for a free worker
+WORKERS = int(os.environ.get("INTELLIMESH_WORKERS", "4"))
+MAX_QUEUE = int(os.environ.get("INTELLIMESH_MAX_QUEUE", "16"))
+# Optional JSON-lines file that receives every request's trace
+TRACE_PATH = os.environ.get("INTELLIMESH_TRACE_PATH")
+
+requests_pool = RequestPool(orchestrator.stream, max_workers=WORKERS, max_queue=MAX_QUEUE, trace_path=TRACE_PATH)
 
 def research_pipeline(query, pdf=None):
-    logs = []
     pdf_path = pdf.name if pdf else None
     start_time = time.time()
+    answer = ""
+    events = []
+    extra = []
     try:
-        answer = orchestrator.run(query, pdf_path=pdf_path, logs=logs)
+        handle = requests_pool.submit(query, pdf_path=pdf_path)
+    except ServerBusy:
+        yield style_answer("The server is busy right now, please try again in a moment."), render_events([])
+        return
+    try:
+        # Partial answers are re-rendered at most every 100 ms; the final one always is
+        for latest, events in handle.updates(interval=0.1):
+            answer = latest or ""
+            yield style_answer(answer), render_events(events)
     except Exception as e:
         answer = "An error occurred during processing."
-        logs.append(f"Error: {e}")
+        events = handle.events
+        extra.append(f"❌ **Error:** {e}")
+    finally:
+        # The browser went away: stop the pipeline at its next step
+        handle.cancel()
     elapsed = time.time() - start_time
-    logs.append(f"✅ **Completed in {elapsed:.2f} seconds.**")
-    return style_answer(answer), style_logs('\n'.join(logs))
+    extra.append(f"✅ **Completed in {elapsed:.2f} seconds.**")
+    yield style_answer(answer), render_events(events, extra)
 
 custom_theme = gr.themes.Default(
     primary_hue="emerald",
@@ -55,4 +82,29 @@ with gr.Blocks(theme=custom_theme) as demo:
         None,
         btn
     )
-demo.launch()
+
+# Gradio admits as many handlers as the pool can hold; the pool does the queueing
+demo.queue(default_concurrency_limit=requests_pool.capacity, max_size=requests_pool.capacity)
+
+# Answers as soon as the server is up, before any weights are loaded
+def health():
+    status = {"status": "ok", **registry.status(), "requests": requests_pool.stats()}
+    if orchestrator.answer_cache is not None:
+        status["answer_cache"] = orchestrator.answer_cache.stats()
+    if orchestrator.scraper.health is not None:
+        status["domains"] = orchestrator.scraper.health.stats()
+    return status
+
+# Per-agent call totals (wall/CPU seconds, items, bytes, tokens, cache hits) for Prometheus
+def metrics():
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(METRICS.prometheus(), media_type="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
+    import uvicorn
+    from fastapi import FastAPI
+    Thread(target=registry.warmup, name="warmup", daemon=True).start()
+    api = FastAPI()
+    api.get("/health")(health)
+    api.get("/metrics")(metrics)
+    uvicorn.run(gr.mount_gradio_app(api, demo, path="/"), host="0.0.0.0", port=7860)
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from agents.base import normalize_query, request_context, submit_with_context
+from agents.tracing import spans
+from utils import read_jsonl
+
+# --- Input: one JSON object per line with "query" (or "topic") and optional "id" and
+# "pdf"; ids default to the line number ---
+def read_jobs(path):
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("topic")
+            if not query:
+                print(f"Skipping line {line_number}: no query", file=sys.stderr)
+                continue
+            jobs.append({"id": str(record.get("id", line_number)), "query": query, "pdf": record.get("pdf")})
+    return jobs
+
+# --- Output: one JSON line per answered id, flushed as it is written. Reopening the
+# same file skips ids that already have an answer; failed ids, and a row whose write
+# was cut short, run again ---
+class BatchOutput:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            for row in read_jsonl(path):
+                if row.get("error") is None:
+                    self.done.add(row["id"])
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, row):
+        with self.lock:
+            self.file.write(json.dumps(row) + "\n")
+            self.file.flush()
+            if row.get("error") is None:
+                self.done.add(row["id"])
+
+    def close(self):
+        self.file.close()
+
+def request_stats(request):
+    # Stage timings plus wall time and counters per agent call, as in evaluation.run_query
+    stages = dict(request.timings)
+    counts = defaultdict(int)
+    for span in spans(request.events):
+        stages[span["name"]] = stages.get(span["name"], 0.0) + span["wall"]
+        for key, n in span["counts"].items():
+            counts[key] += n
+    return {"stages": {stage: round(secs, 4) for stage, secs in stages.items()}, "counts": dict(counts)}
+
+# --- Pushes a batch through one orchestrator. Identical questions (same normalized
+# query and PDF) run once and answer every id that asked them. Retrieval, scraping and
+# indexing run on io_workers threads; synthesis runs on model_workers threads, enough
+# to fill the LLM batcher, and at most max_ready prepared jobs wait for a model
+# thread, so preparation stays ahead of the model without piling up vectorstores.
+# The orchestrator's caches (search results, pages, embeddings, index) are shared by
+# the whole batch ---
+class BatchRunner:
+    def __init__(self, orchestrator, output, io_workers=8, model_workers=8, max_ready=None, use_cache=True):
+        self.orchestrator = orchestrator
+        self.output = output
+        self.use_cache = use_cache
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="batch-io")
+        self.model_pool = ThreadPoolExecutor(max_workers=model_workers, thread_name_prefix="batch-model")
+        self.ready = threading.BoundedSemaphore(max_ready or 2 * model_workers)
+        self.lock = threading.Lock()
+        self.model_jobs = []
+        self.counts = defaultdict(int)
+        self.model_busy = 0.0
+
+    def run(self, jobs):
+        start = time.perf_counter()
+        groups = defaultdict(list)
+        for job in jobs:
+            if job["id"] in self.output.done:
+                self.counts["skipped"] += 1
+                continue
+            groups[(normalize_query(job["query"]), job["pdf"] or "")].append(job)
+        self.counts["deduplicated"] = sum(len(group) - 1 for group in groups.values())
+        print(f"Batch: {len(groups)} unique questions to run, {self.counts['deduplicated']} duplicates, "
+              f"{self.counts['skipped']} already answered", file=sys.stderr)
+        wait([self.io_pool.submit(self._prepare, group) for group in groups.values()])
+        # Model jobs are all queued once every prepare has finished
+        wait(self.model_jobs)
+        self.io_pool.shutdown()
+        self.model_pool.shutdown()
+        return self.summary(time.perf_counter() - start)
+
+    def _prepare(self, group):
+        job = group[0]
+        with request_context(logs=[], request_id=job["id"]) as request:
+            try:
+                pdf_hash = ""
+                if job["pdf"]:
+                    from agents.pdf_loader import file_hash
+                    pdf_hash = file_hash(job["pdf"])
+                cached = self.orchestrator.cached_answer(job["query"], pdf_hash) if self.use_cache else None
+                if cached is not None:
+                    self._emit(group, request, answer=cached, cached=True)
+                    return
+                vectorstore = self.orchestrator.prepare(job["query"], pdf_path=job["pdf"])
+            except Exception as e:
+                self._emit(group, request, error=e)
+                return
+            # Blocks this IO thread while max_ready prepared jobs already wait for the model
+            self.ready.acquire()
+            future = submit_with_context(self.model_pool, self._synthesize, group, request, vectorstore, pdf_hash)
+            with self.lock:
+                self.model_jobs.append(future)
+
+    def _synthesize(self, group, request, vectorstore, pdf_hash):
+        start = time.perf_counter()
+        try:
+            answer = self.orchestrator.synthesize(group[0]["query"], vectorstore, pdf_hash)
+        except Exception as e:
+            self._emit(group, request, error=e)
+            return
+        finally:
+            self.ready.release()
+            with self.lock:
+                self.model_busy += time.perf_counter() - start
+        self._emit(group, request, answer=answer)
+
+    def _emit(self, group, request, answer=None, error=None, cached=False):
+        stats = request_stats(request)
+        elapsed = time.perf_counter() - request.started
+        for i, job in enumerate(group):
+            row = {
+                "id": job["id"],
+                "query": job["query"],
+                "answer": answer,
+                "error": repr(error) if error is not None else None,
+                "cached": cached,
+                # Later ids with the same question reuse the first one's answer
+                "shared_from": group[0]["id"] if i else None,
+                "seconds": round(elapsed, 4),
+                **stats
+            }
+            self.output.write(row)
+        with self.lock:
+            self.counts["errors" if error is not None else "answered"] += len(group)
+            self.counts["cached"] += len(group) if cached else 0
+
+    def summary(self, elapsed):
+        orchestrator = self.orchestrator
+        summary = {
+            **self.counts,
+            "seconds": round(elapsed, 2),
+            "questions_per_second": round((self.counts["answered"] + self.counts["errors"]) / elapsed, 3) if elapsed else 0.0,
+            # Average number of synthesis calls in flight; model_workers means the model never waited
+            "model_concurrency": round(self.model_busy / elapsed, 2) if elapsed else 0.0,
+            "search": orchestrator.retriever.stats(),
+            "pages_coalesced": orchestrator.scraper.coalesced,
+            "embedding_cache": orchestrator.chunker.embedding_cache.stats(),
+        }
+        if orchestrator.scraper.page_cache is not None:
+            summary["page_cache"] = orchestrator.scraper.page_cache.stats()
+        if orchestrator.answer_cache is not None:
+            summary["answer_cache"] = orchestrator.answer_cache.stats()
+        return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of research queries in bulk")
+    parser.add_argument("input", help="JSONL with one {\"id\", \"query\", \"pdf\"} object per line")
+    parser.add_argument("output", help="JSONL answers; rerunning with the same file resumes the batch")
+    parser.add_argument("--io-workers", type=int, default=8, help="threads for search, scraping and indexing")
+    parser.add_argument("--model-workers", type=int, default=8, help="concurrent synthesis calls (LLM batch size)")
+    parser.add_argument("--max-ready", type=int, help="prepared questions allowed to wait for the model")
+    parser.add_argument("--no-answer-cache", action="store_true", help="answer every question from scratch")
+    args = parser.parse_args()
+
+    from orchestrator import build_orchestrator
+    orchestrator = build_orchestrator(cache_answers=not args.no_answer_cache)
+    output = BatchOutput(args.output)
+    try:
+        runner = BatchRunner(orchestrator, output, io_workers=args.io_workers, model_workers=args.model_workers,
+                             max_ready=args.max_ready, use_cache=not args.no_answer_cache)
+        print(json.dumps(runner.run(read_jobs(args.input)), indent=2), file=sys.stderr)
+    finally:
+        output.close()
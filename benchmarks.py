@@ -0,0 +1,585 @@
+import itertools
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain.vectorstores import Chroma
+from langchain.document_loaders import PyPDFLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from agents.answer_cache import AnswerCache
+from agents.base import log
+from agents.domain_health import DomainHealth
+from agents.evaluator import EvaluatorAgent
+from agents.extractors import EXTRACTORS
+from agents.pdf_loader import PDFLoaderAgent
+from agents.retriever import RetrieverAgent
+from agents.scraper import ScraperAgent
+from agents.vector_index import VectorIndex, content_hash
+from llm_server import BatchingLLM
+from replay import Archive, ReplayPolicy, ReplaySearchClient, replay_session
+from utils import percentile
+from workers import RequestPool, ServerBusy
+
+# --- Shared helpers ---
+def _words(rng, n):
+    vocab = ["model", "data", "science", "protein", "climate", "energy", "policy", "neural",
+             "genome", "quantum", "market", "health", "ocean", "robot", "language", "vision"]
+    return " ".join(rng.choice(vocab) for _ in range(n))
+
+def _report(name, samples):
+    print(f"{name:<36} p50 {percentile(samples, 50) * 1000:>9.2f} ms   p99 {percentile(samples, 99) * 1000:>9.2f} ms")
+
+# --- Throwaway Chroma per query vs. long-lived VectorIndex ---
+def bench_vector_index(corpus_sizes=(1_000, 10_000, 100_000), chunks_per_doc=5, docs_per_query=5,
+                       queries=20, embeddings=None, seed=0):
+    rng = random.Random(seed)
+    embeddings = embeddings or DeterministicFakeEmbedding(size=384)
+    for corpus_size in corpus_sizes:
+        corpus = {
+            f"https://example.com/{d}": [_words(rng, 150) for _ in range(chunks_per_doc)]
+            for d in range(corpus_size // chunks_per_doc)
+        }
+        digests = {url: content_hash("\0".join(texts)) for url, texts in corpus.items()}
+
+        def splits_for(url):
+            return [Document(page_content=text, metadata={"url": url, "title": url}) for text in corpus[url]]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = VectorIndex(embeddings, persist_directory=tmp, collection_name="bench")
+            start = time.perf_counter()
+            for url in corpus:
+                index.upsert(url, digests[url], splits_for(url))
+            load_time = time.perf_counter() - start
+
+            throwaway_build, throwaway_query, index_upsert, index_query = [], [], [], []
+            for q in range(queries):
+                urls = rng.sample(list(corpus), docs_per_query)
+                query = _words(rng, 6)
+
+                start = time.perf_counter()
+                store = Chroma.from_documents(
+                    [split for url in urls for split in splits_for(url)],
+                    embedding=embeddings,
+                    collection_name=f"throwaway-{q}"
+                )
+                throwaway_build.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                store.as_retriever().get_relevant_documents(query)
+                throwaway_query.append(time.perf_counter() - start)
+                store.delete_collection()
+
+                start = time.perf_counter()
+                for url in urls:
+                    index.upsert(url, digests[url], splits_for(url))
+                index_upsert.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                index.view(urls).as_retriever().get_relevant_documents(query)
+                index_query.append(time.perf_counter() - start)
+
+        print(f"\nCorpus {corpus_size} chunks (initial index load {load_time:.1f}s)")
+        _report("Throwaway Chroma build", throwaway_build)
+        _report("Throwaway Chroma query", throwaway_query)
+        _report("VectorIndex upsert (unchanged)", index_upsert)
+        _report("VectorIndex filtered query", index_query)
+
+# --- Source ranking: the original substring-overlap evaluator vs. BM25 ---
+def legacy_evaluate(sources, query, min_length=200, top_k=5):
+    filtered = [src for src in sources if len((src.get("content", "") or src.get("snippet", "")).strip()) >= min_length]
+    seen_urls = set()
+    deduped = []
+    for src in filtered:
+        url = src.get("url", "")
+        if url and url not in seen_urls:
+            deduped.append(src)
+            seen_urls.add(url)
+    query_words = set(query.lower().split())
+    def relevance(src):
+        content = (src.get("content", "") or src.get("snippet", "")).lower()
+        return sum(word in content for word in query_words)
+    deduped.sort(key=relevance, reverse=True)
+    trusted_domains = [".edu", ".gov", ".ac.uk", "mit.edu", "nature.com", "sciencedirect.com"]
+    trusted = [src for src in deduped if any(domain in src["url"] for domain in trusted_domains)]
+    others = [src for src in deduped if not any(domain in src["url"] for domain in trusted_domains)]
+    return (trusted + others)[:top_k]
+
+# Page text with a Zipf-distributed vocabulary, some capitals and punctuation, and
+# query words drawn from the mid-frequency range, like topical terms in real pages
+def _zipf_corpus(rng, vocab_size=20_000, paragraphs=400, words_per_paragraph=200):
+    vocab = list(dict.fromkeys(
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))) for _ in range(2 * vocab_size)
+    ))[:vocab_size]
+    weights = list(itertools.accumulate(1 / (rank + 1) ** 1.07 for rank in range(len(vocab))))
+
+    def paragraph():
+        words = rng.choices(vocab, cum_weights=weights, k=words_per_paragraph)
+        return " ".join(word.capitalize() if rng.random() < 0.05 else word + (rng.choice(",.;") if rng.random() < 0.08 else "")
+                        for word in words)
+    return [paragraph() for _ in range(paragraphs)], vocab[50:3000]
+
+def bench_ranking(source_counts=(1_000, 10_000), paragraphs_per_doc=8, queries=5, seed=0):
+    rng = random.Random(seed)
+    paragraphs, query_words = _zipf_corpus(rng)
+    hosts = ["example.com", "news.example.org", "cs.mit.edu", "www.nature.com", "data.gov", "blog.example.net"]
+    evaluator = EvaluatorAgent("Evaluator", None)
+    for count in source_counts:
+        sources = [
+            {"url": f"https://{rng.choice(hosts)}/{i}", "content": " ".join(rng.sample(paragraphs, paragraphs_per_doc))}
+            for i in range(count)
+        ]
+        size_kb = sum(len(src["content"]) for src in sources) / count / 1024
+        legacy, bm25 = [], []
+        for _ in range(queries):
+            query = " ".join(rng.sample(query_words, 4))
+            start = time.perf_counter()
+            legacy_evaluate(sources, query)
+            legacy.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            evaluator.run(sources, query=query)
+            bm25.append(time.perf_counter() - start)
+        print(f"\nRanking {count} sources (~{size_kb:.0f} KB each)")
+        _report("Substring overlap (original)", legacy)
+        _report("BM25 over query terms", bm25)
+
+# --- PDF ingestion: load_and_split + second split vs. parallel streaming pages ---
+def write_text_pdf(path, n_pages, lines_per_page=45, seed=0):
+    rng = random.Random(seed)
+    page_ids = [4 + 2 * i for i in range(n_pages)]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in page_ids)}] /Count {n_pages} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_id in page_ids:
+        lines = " ".join(f"({_words(rng, 12)}) '" for _ in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 50 780 Td 14 TL {lines} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def bench_pdf(page_counts=(100, 500), repeats=3):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_pages in page_counts:
+            path = os.path.join(tmp, f"generated-{n_pages}.pdf")
+            write_text_pdf(path, n_pages)
+            legacy, cold, cached, first_page = [], [], [], []
+            for r in range(repeats):
+                start = time.perf_counter()
+                splitter.split_documents(PyPDFLoader(path).load_and_split())
+                legacy.append(time.perf_counter() - start)
+
+                loader = PDFLoaderAgent("PDFLoader", None, cache_dir=os.path.join(tmp, f"cache-{n_pages}-{r}"))
+                for samples in (cold, cached):
+                    start = time.perf_counter()
+                    for page in loader.iter_pages(path):
+                        if page["doc_id"].endswith("#page=1") and samples is cold:
+                            first_page.append(time.perf_counter() - start)
+                        splitter.split_text(page["content"])
+                    samples.append(time.perf_counter() - start)
+            print(f"\nPDF with {n_pages} pages ({os.path.getsize(path) // 1024} KB)")
+            _report("load_and_split + chunker split", legacy)
+            _report("Process pool, split once", cold)
+            _report("  first page available after", first_page)
+            _report("Re-upload (text cache hit)", cached)
+
+# --- HTML extraction: BeautifulSoup get_text vs. fast block extractor ---
+def synthetic_html(rng, paragraphs=30):
+    nav = "".join(f'<li><a href="/{i}">{_words(rng, 2)}</a></li>' for i in range(40))
+    body = "".join(f"<p>{_words(rng, 60)} <a href='/x'>{_words(rng, 2)}</a> {_words(rng, 30)}</p>"
+                   for _ in range(paragraphs))
+    script = "var config = {" + ", ".join(f'"k{i}": {i}' for i in range(300)) + "};"
+    return (f"<html><head><title>{_words(rng, 5)}</title><style>body {{ margin: 0 }}</style>"
+            f"<script>{script}</script></head><body><header><nav><ul>{nav}</ul></nav></header>"
+            f"<main><article><h1>{_words(rng, 6)}</h1>{body}</article></main>"
+            f"<aside><ul>{nav}</ul></aside><footer>{_words(rng, 20)}</footer></body></html>")
+
+def bench_extraction(corpus_dir=None, pages=200, seed=0):
+    # corpus_dir: a directory of saved .html pages; generated pages otherwise
+    if corpus_dir:
+        corpus = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(corpus_dir, name), encoding="utf-8", errors="replace") as f:
+                    corpus.append(f.read())
+    else:
+        rng = random.Random(seed)
+        corpus = [synthetic_html(rng, paragraphs=rng.randint(5, 60)) for _ in range(pages)]
+    print(f"\n{len(corpus)} pages, {sum(len(html) for html in corpus) // 1024} KB of HTML")
+    for name, extractor_cls in EXTRACTORS.items():
+        extractor = extractor_cls()
+        samples, sizes = [], []
+        for html in corpus:
+            start = time.perf_counter()
+            text = extractor.extract(html)
+            samples.append(time.perf_counter() - start)
+            sizes.append(len(text))
+        _report(f"{name} extractor per page", samples)
+        print(f"{'':<36} output {sum(sizes) / len(sizes):>9.0f} chars/page")
+
+# --- Load test: concurrent users against the request pool and one shared model ---
+def simulated_pipeline(llm, io_seconds=0.2, pieces=20):
+    # Retrieval and scraping wait on the network; synthesis goes through the shared model
+    def handler(query, pdf_path=None):
+        log(f"Retriever: Searching for {query}")
+        time.sleep(io_seconds)
+        answer = llm(query)
+        for i in range(1, pieces + 1):
+            yield answer[:len(answer) * i // pieces]
+    return handler
+
+def bench_load(user_counts=(1, 2, 4, 8, 16, 32), requests_per_user=5, max_workers=4, max_queue=8,
+               batch_seconds=0.05, per_prompt_seconds=0.01):
+    def generate_batch(prompts):
+        time.sleep(batch_seconds + per_prompt_seconds * len(prompts))
+        return [f"answer to {prompt} " * 20 for prompt in prompts]
+
+    llm = BatchingLLM(generate_batch, max_batch_size=8, max_wait=0.02, guard=threading.BoundedSemaphore(1))
+    print(f"\nLoad test: {max_workers} workers, queue {max_queue}, {requests_per_user} requests per user")
+    for users in user_counts:
+        pool = RequestPool(simulated_pipeline(llm), max_workers=max_workers, max_queue=max_queue)
+        latencies, rejected = [], []
+
+        def user(u):
+            for r in range(requests_per_user):
+                start = time.perf_counter()
+                try:
+                    handle = pool.submit(f"user {u} question {r}")
+                except ServerBusy:
+                    rejected.append(u)
+                    time.sleep(0.1)
+                    continue
+                for _ in handle.updates(interval=0.05):
+                    pass
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(u,)) for u in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{users:>3} users: {len(latencies) / elapsed:6.2f} req/s, "
+              f"p50 {percentile(latencies, 50) * 1000:7.0f} ms, p99 {percentile(latencies, 99) * 1000:7.0f} ms, "
+              f"{len(rejected)} rejected")
+        pool.pool.shutdown()
+    print(f"LLM batches: {llm.metrics()['batch_sizes']}")
+
+# --- Answer cache: lookup latency for repeat questions at a given cache size ---
+def bench_answer_cache(entry_counts=(1_000, 5_000), lookups=200, seed=0):
+    rng = random.Random(seed)
+    embeddings = DeterministicFakeEmbedding(size=384)
+    for entries in entry_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AnswerCache(embeddings, path=os.path.join(tmp, "answers.sqlite"), max_entries=entries)
+            queries = [_words(rng, 8) for _ in range(entries)]
+            for query in queries:
+                cache.put(query, "", _words(rng, 300), [f"https://example.com/{rng.randrange(10_000)}"])
+            exact, miss = [], []
+            for _ in range(lookups):
+                start = time.perf_counter()
+                cache.get(rng.choice(queries).upper())
+                exact.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                cache.get(_words(rng, 9))
+                miss.append(time.perf_counter() - start)
+            print(f"\nAnswer cache with {entries} answers")
+            _report("Repeat question (exact hit)", exact)
+            _report("New question (semantic scan, miss)", miss)
+            print(f"{'':<36} {cache.stats()}")
+
+# --- Scraping over replayed traffic: sequential vs. concurrent, same recorded latencies ---
+def synthetic_archive(queries=5, results_per_query=10, failure_rate=0.1, median_latency=0.3, seed=0):
+    rng = random.Random(seed)
+    archive = Archive()
+    for q in range(queries):
+        organic = []
+        for r in range(results_per_query):
+            url = f"https://site{r}.example.org/query{q}"
+            organic.append({"link": url, "title": f"Result {r}", "snippet": _words(rng, 20)})
+            record = {"kind": "http", "key": url, "elapsed": median_latency * rng.lognormvariate(0, 0.6)}
+            if rng.random() < failure_rate:
+                record.update(error="ConnectTimeout", message="recorded timeout")
+            else:
+                record.update(status=200, headers={"Content-Type": "text/html; charset=utf-8"},
+                              text=synthetic_html(rng, paragraphs=rng.randint(5, 30)))
+            archive.add(record)
+        archive.add({"kind": "search", "key": f"query {q}", "elapsed": 0.4, "response": {"organic": organic}})
+    return archive
+
+def bench_scrape(archive_path=None, latency_scale=1.0, failure_rate=0.0, desired_count=5):
+    # archive_path: a recorded archive (replay.py); a synthetic one otherwise
+    archive = Archive(archive_path) if archive_path else synthetic_archive()
+    queries = [key for kind, key in archive.records if kind == "search"]
+    print(f"\nScraping {len(queries)} replayed queries, latency x{latency_scale}, extra failures {failure_rate:.0%}")
+    for concurrent in (False, True):
+        archive.rewind()
+        policy = ReplayPolicy(latency_scale=latency_scale, failure_rate=failure_rate)
+        retriever = RetrieverAgent("Retriever", None, client=ReplaySearchClient(archive, policy))
+        scraper = ScraperAgent("Scraper", None, concurrent=concurrent, cache_path=None,
+                               session=replay_session(archive, policy))
+        samples, pages, failed = [], 0, 0
+        for query in queries:
+            start = time.perf_counter()
+            try:
+                sources = retriever.run(query, top_k=desired_count)
+                pages += len(scraper.run(sources, retriever, query, desired_count=desired_count))
+            except Exception:
+                failed += 1
+            samples.append(time.perf_counter() - start)
+        _report("Concurrent scraper" if concurrent else "Sequential scraper", samples)
+        print(f"{'':<36} {pages} pages, {failed} failed queries, {policy.injected} injected failures")
+
+# --- Flat timeout vs. DomainHealth against local HTTP servers, one per simulated host:
+# healthy, slow-tailed, black-holed (never answers in time), challenge pages and
+# flaky 503s. Every query's results list the bad hosts first ---
+HOST_BEHAVIOURS = {
+    "fast": lambda rng: (rng.uniform(0.02, 0.08), 200, None),
+    "slow_tail": lambda rng: (1.5 if rng.random() < 0.08 else 0.1, 200, None),
+    "black_hole": lambda rng: (30.0, 200, None),
+    "challenge": lambda rng: (0.05, 200, "<html><title>Just a moment...</title><body>Just a moment...</body></html>"),
+    "flaky": lambda rng: (0.05, 503, None) if rng.random() < 0.7 else (0.05, 200, None),
+}
+
+def _simulated_host(behaviour, seed):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                delay, status, body = HOST_BEHAVIOURS[behaviour](rng)
+                body = body or synthetic_html(rng, paragraphs=8)
+            time.sleep(delay)
+            try:
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class _LocalSearch:
+    def __init__(self, hosts, per_host=4):
+        self.hosts = hosts
+        self.per_host = per_host
+
+    def results(self, query):
+        slug = query.replace(" ", "-")
+        order = ["black_hole", "challenge", "flaky", "slow_tail", "fast"]
+        organic = [{"link": f"http://127.0.0.1:{self.hosts[name]}/{slug}/{i}", "title": f"{name} {i}"}
+                   for i in range(self.per_host) for name in order]
+        return {"organic": organic}
+
+def bench_domain_health(queries=30, desired_count=3, timeout=2.0, seed=0):
+    servers = {name: _simulated_host(name, seed) for name in HOST_BEHAVIOURS}
+    hosts = {name: server.server_address[1] for name, server in servers.items()}
+    print(f"\nScraping {queries} queries from local simulated hosts, {timeout:.0f}s flat timeout")
+    try:
+        for name, health in (("Flat timeout", False),
+                             ("Domain health", DomainHealth(default_timeout=timeout, cooldown=600))):
+            retriever = RetrieverAgent("Retriever", None, client=_LocalSearch(hosts))
+            scraper = ScraperAgent("Scraper", None, cache_path=None, timeout=timeout, domain_health=health)
+            samples, pages = [], 0
+            for q in range(queries):
+                query = f"{name} query {q}"
+                start = time.perf_counter()
+                sources = retriever.run(query, top_k=desired_count + 1)
+                pages += len(scraper.run(sources, retriever, query, desired_count=desired_count))
+                samples.append(time.perf_counter() - start)
+            _report(name, samples)
+            print(f"{'':<36} {pages} pages")
+            if health:
+                for row in health.stats()["worst"]:
+                    behaviour = next(b for b, port in hosts.items() if row["host"].endswith(f":{port}"))
+                    print(f"{'':<36} {behaviour:<11} open={row['open']!s:<5} p95 {row['p95']:.2f}s "
+                          f"failures {row['failure_rate']:.0%} skipped {row['skipped']}")
+    finally:
+        for server in servers.values():
+            server.shutdown()
+
+# --- Cold start per entry point, each measured in a fresh interpreter ---
+COLD_START_SNIPPETS = {
+    "import llm_setup": "import llm_setup",
+    "import evaluation": "import evaluation",
+    "build orchestrator": "from orchestrator import orchestrator",
+    "import app (UI built)": "import app",
+    "registry.warmup()": "import llm_setup; llm_setup.registry.warmup()",
+}
+
+def bench_cold_start(backend="fake", repeats=3):
+    env = dict(os.environ, INTELLIMESH_BACKEND=backend)
+    print(f"\nCold start ({backend} backend)")
+    for name, snippet in COLD_START_SNIPPETS.items():
+        code = f"import time; t = time.perf_counter(); {snippet}; print(time.perf_counter() - t)"
+        samples = []
+        for _ in range(repeats):
+            proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+            if proc.returncode:
+                print(f"{name:<36} failed: {(proc.stderr.strip().splitlines() or ['?'])[-1]}")
+                break
+            samples.append(float(proc.stdout.strip().splitlines()[-1]))
+        else:
+            _report(name, samples)
+
+# --- Compact store: vector bytes, reopen time, query latency and recall@k of float16,
+# int8 and int8 + IVF against the float32 layout. Vectors are clustered like real
+# sentence embeddings, so the coarse index has structure to exploit ---
+class _TableEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return self.vectors[[int(text.split(":")[1]) for text in texts]]
+
+def bench_compact_store(corpus_sizes=(10_000, 100_000), dim=384, chunks_per_doc=10, queries=50, k=10,
+                        clusters=200, seed=0):
+    from agents.compact_store import CompactStore
+    rng = np.random.default_rng(seed)
+    for size in corpus_sizes:
+        centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+        vectors = centers[rng.integers(clusters, size=size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        query_vectors = vectors[rng.choice(size, size=queries, replace=False)] + 0.3 * rng.standard_normal((queries, dim))
+        exact = [set(np.argsort(-(vectors @ q))[:k]) for q in query_vectors]
+        embeddings = _TableEmbeddings(vectors)
+        print(f"\nCompact store with {size} chunks ({dim} dims), recall@{k} vs exact float32")
+        variants = [("float32", {}), ("float16", {}), ("int8", {}),
+                    ("int8 + IVF", {"nlist": int(np.sqrt(size)), "nprobe": 8, "ivf_min_candidates": 0})]
+        for name, options in variants:
+            with tempfile.TemporaryDirectory() as tmp:
+                dtype = name.split()[0]
+                store = CompactStore(embeddings, directory=tmp, dtype=dtype, **options)
+                for d in range(0, size, chunks_per_doc):
+                    rows = range(d, min(d + chunks_per_doc, size))
+                    store.upsert(f"doc{d}", "v1", [Document(page_content=f"chunk:{row}", metadata={"url": f"doc{d}"})
+                                                   for row in rows])
+                if options:
+                    store.build_ivf()
+                start = time.perf_counter()
+                store = CompactStore(embeddings, directory=tmp, **options)
+                store.search(query_vectors[0], k=k)
+                load = time.perf_counter() - start
+                latencies, recall = [], []
+                for q, truth in zip(query_vectors, exact):
+                    start = time.perf_counter()
+                    hits = store.search(q, k=k)
+                    latencies.append(time.perf_counter() - start)
+                    recall.append(len(truth & {row for row, _ in hits}) / k)
+                stats = store.stats()
+                _report(f"{name} search", latencies)
+                print(f"{'':<36} {stats['vector_bytes'] / 2**20:.1f} MiB vectors, reopen + first query "
+                      f"{load * 1000:.1f} ms, recall@{k} {np.mean(recall):.3f}")
+
+# --- Prefill with and without the cached prompt prefix, on a small model on CPU.
+# max_new_tokens=1 makes each call (almost) pure prefill. Then the throughput of a
+# full batch: cached prefixes one prompt at a time against one pipeline batch ---
+def bench_prefix_cache(model_name="HuggingFaceTB/SmolLM2-135M", context_words=(100, 400), calls=10, batch_size=8,
+                       new_tokens=32, seed=0):
+    from agents.synthesizer import AI_INSTRUCTIONS, GENERAL_INSTRUCTIONS
+    from evaluation import FAITHFULNESS_PROMPT, RELEVANCE_PREFIX, FAITHFULNESS_PREFIX
+    from llm_setup import ModelRegistry
+    rng = random.Random(seed)
+    registry = ModelRegistry(backend="hf", model_name=model_name, quantize=False)
+    print(f"\nPrefix KV cache ({model_name}, CPU)")
+    for words in context_words:
+        prompts = {
+            "Synthesizer (AI template)": [
+                AI_INSTRUCTIONS + f"Context:\n{_words(rng, words)}\n\nQuestion: {_words(rng, 8)}\nAnswer:"
+                for _ in range(calls)
+            ],
+            "Synthesizer (general template)": [
+                GENERAL_INSTRUCTIONS + f"Context:\n{_words(rng, words)}\n\nQuestion: {_words(rng, 8)}\nAnswer:"
+                for _ in range(calls)
+            ],
+            "Faithfulness judge": [
+                FAITHFULNESS_PROMPT.format(context=_words(rng, words), answer=_words(rng, 60))
+                for _ in range(calls)
+            ],
+        }
+        print(f"{words}-word variable part")
+        for name, batch in prompts.items():
+            registry.prefix_cache.prefixes.clear()
+            registry.generate(batch[0], max_new_tokens=1)
+            cold = []
+            for prompt in batch:
+                start = time.perf_counter()
+                registry.generate(prompt, max_new_tokens=1)
+                cold.append(time.perf_counter() - start)
+            for prefix in (AI_INSTRUCTIONS, GENERAL_INSTRUCTIONS, RELEVANCE_PREFIX, FAITHFULNESS_PREFIX):
+                registry.register_prefix(prefix)
+            registry.generate(batch[0], max_new_tokens=1)
+            reused = []
+            for prompt in batch:
+                start = time.perf_counter()
+                registry.generate(prompt, max_new_tokens=1)
+                reused.append(time.perf_counter() - start)
+            _report(f"{name}, full prefill", cold)
+            _report(f"{name}, cached prefix", reused)
+    print(f"{'':<36} {registry.prefix_cache.stats()}")
+    # Throughput for a full batch: prefix reuse one prompt at a time vs one padded pipeline batch
+    batch = [AI_INSTRUCTIONS + f"Context:\n{_words(rng, context_words[0])}\n\nQuestion: {_words(rng, 8)}\nAnswer:"
+             for _ in range(batch_size)]
+    start = time.perf_counter()
+    for prompt in batch:
+        registry.generate(prompt, max_new_tokens=new_tokens)
+    serial = time.perf_counter() - start
+    pipe = registry.pipeline()
+    pipe(batch[:1], max_new_tokens=new_tokens)
+    start = time.perf_counter()
+    pipe(batch, max_new_tokens=new_tokens, batch_size=batch_size)
+    batched = time.perf_counter() - start
+    print(f"Batch of {batch_size}, {new_tokens} new tokens each")
+    print(f"{'cached prefix, one at a time':<36} {batch_size / serial:8.2f} prompts/s")
+    print(f"{'pipeline batch, full prefill':<36} {batch_size / batched:8.2f} prompts/s")
+
+BENCHMARKS = {
+    "vector_index": bench_vector_index,
+    "ranking": bench_ranking,
+    "pdf": bench_pdf,
+    "extraction": bench_extraction,
+    "load": bench_load,
+    "answer_cache": bench_answer_cache,
+    "scrape": bench_scrape,
+    "cold_start": bench_cold_start,
+    "prefix_cache": bench_prefix_cache,
+    "compact_store": bench_compact_store,
+    "domain_health": bench_domain_health,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
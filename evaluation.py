@@ -1,9 +1,21 @@
-import time
+import argparse
+import json
+import os
 import re
-from collections import Counter
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agents.base import request_context
+from agents.compact_store import CompactStore
+from agents.tracing import agents_used, spans
+from utils import percentile, read_jsonl
 
 # --- LLM-as-a-Judge Prompts (Chain-of-Thought + rubric) ---
-RELEVANCE_PROMPT = """
+# The rubric and instructions come first and never change, so their past-key-values
+# can be cached (JUDGE_PREFIXES); only the query, context and answer vary per call
+RELEVANCE_PREFIX = """
 You are an expert evaluator. Given the user query and the system answer, first explain step by step how relevant the answer is to the query, then rate the relevance on a scale from 1 to 5, where:
 1 = Completely irrelevant
 2 = Slightly relevant
@@ -11,13 +23,11 @@ You are an expert evaluator. Given the user query and the system answer, first e
 4 = Mostly relevant
 5 = Highly relevant
 
-Query: {query}
-Answer: {answer}
-
 First, explain your reasoning. Then, on a new line, respond with only the number (1 to 5).
+
 """
 
-FAITHFULNESS_PROMPT = """
+FAITHFULNESS_PREFIX = """
 You are an expert evaluator. Given the system answer and the supporting context, first explain step by step how faithful the answer is to the context. A faithful answer only contains information present in the context, and does not hallucinate or contradict the context. Then, rate the faithfulness on a scale from 1 to 5, where:
 1 = Completely unfaithful (hallucinated, contradicts context)
 2 = Slightly faithful
@@ -25,125 +35,221 @@ You are an expert evaluator. Given the system answer and the supporting context,
 4 = Mostly faithful
 5 = Fully faithful (all info is in the context)
 
-Context: {context}
+First, explain your reasoning. Then, on a new line, respond with only the number (1 to 5).
+
+"""
+
+RELEVANCE_PROMPT = RELEVANCE_PREFIX + """Query: {query}
 Answer: {answer}
+"""
 
-First, explain your reasoning. Then, on a new line, respond with only the number (1 to 5).
+FAITHFULNESS_PROMPT = FAITHFULNESS_PREFIX + """Context: {context}
+Answer: {answer}
 """
 
+JUDGE_PREFIXES = (RELEVANCE_PREFIX, FAITHFULNESS_PREFIX)
+
 # --- LLM-as-a-Judge Functions ---
-def llm_judge_relevance(llm, query, answer):
-    prompt = RELEVANCE_PROMPT.format(query=query, answer=answer)
-    result = llm(prompt)
+def parse_score(result):
     matches = re.findall(r"\b[1-5]\b", result)
     return int(matches[-1]) if matches else 1
 
+def llm_judge_relevance(llm, query, answer):
+    return parse_score(llm(RELEVANCE_PROMPT.format(query=query, answer=answer)))
+
 def llm_judge_faithfulness(llm, context, answer):
-    prompt = FAITHFULNESS_PROMPT.format(context=context, answer=answer)
-    result = llm(prompt)
-    matches = re.findall(r"\b[1-5]\b", result)
-    return int(matches[-1]) if matches else 1
+    return parse_score(llm(FAITHFULNESS_PROMPT.format(context=context, answer=answer)))
+
+# Both judge prompts go to the model together; a batching LLM (llm.submit) runs them,
+# and the prompts of other in-flight queries, in the same batch
+def judge(llm, query, answer, context):
+    prompts = [RELEVANCE_PROMPT.format(query=query, answer=answer),
+               FAITHFULNESS_PROMPT.format(context=context, answer=answer)]
+    if hasattr(llm, "submit"):
+        results = [future.result() for future in [llm.submit(prompt) for prompt in prompts]]
+    else:
+        results = [llm(prompt) for prompt in prompts]
+    return tuple(parse_score(result) for result in results)
+
+# --- Finished rows as JSON lines, keyed by (system, query, repeat); a rerun with the
+# same file skips every run recorded without a pipeline or judge error, and runs the
+# failed ones again ---
+class Checkpoint:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.rows = {}
+        if path and os.path.exists(path):
+            for row in read_jsonl(path):
+                if row["error"] is None and row.get("judge_error") is None:
+                    self.rows[self.key(row["system"], row["query"], row["repeat"])] = row
+
+    @staticmethod
+    def key(system, query, repeat):
+        return f"{system}\0{query}\0{repeat}"
+
+    def get(self, system, query, repeat):
+        return self.rows.get(self.key(system, query, repeat))
 
-# --- Evaluation for a single pipeline ---
-def evaluate_pipeline(queries, orchestrator, llm, is_baseline=False, agent_usage=None):
-    relevance_results = []
-    faithfulness_results = []
-    latencies = []
-    successful_runs = 0
-    total_runs = 0
-
-    for query in queries:
-        logs = []
-        start = time.time()
-        try:
-            if is_baseline:
-                # Baseline: Retriever only, no scraping/evaluation
-                sources = orchestrator.retriever.run(query, logs=logs)
-                if agent_usage is not None:
-                    agent_usage['Retriever'] += 1
-                pseudo_scraped = []
-                for src in sources:
-                    content = src.get("snippet", "") or src.get("title", "")
-                    if content.strip():
-                        pseudo_scraped.append({
-                            "url": src.get("url", ""),
-                            "title": src.get("title", ""),
-                            "content": content
-                        })
-                if not pseudo_scraped:
-                    answer = "No relevant information could be found for this query."
-                    context = ""
-                else:
-                    vectorstore = orchestrator.chunker.run(pseudo_scraped, logs=logs)
-                    if agent_usage is not None:
-                        agent_usage['Chunker'] += 1
-                    if vectorstore is None:
-                        answer = "No relevant information could be found for this query."
-                        context = ""
-                    else:
-                        answer = orchestrator.synthesizer.run(query, vectorstore)
-                        if agent_usage is not None:
-                            agent_usage['Synthesizer'] += 1
-                        context = " ".join([doc["content"] for doc in pseudo_scraped[:3]])
+    def add(self, row):
+        with self.lock:
+            self.rows[self.key(row["system"], row["query"], row["repeat"])] = row
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(row) + "\n")
+
+# --- One query through the full pipeline or the retriever-only baseline. Runs in its
+# own request context so stage timings, spans and the retrieved context are per query.
+# Baseline snippets are indexed into a throwaway store: under their page URLs in the
+# shared index they would replace the pipeline's full-page chunks, and each other's ---
+def run_query(query, orchestrator, is_baseline=False):
+    with request_context(logs=[]) as request:
+        if is_baseline:
+            sources = orchestrator.retriever.run(query)
+            pseudo_scraped = []
+            for src in sources:
+                content = src.get("snippet", "") or src.get("title", "")
+                if content.strip():
+                    pseudo_scraped.append({
+                        "url": src.get("url", ""),
+                        "title": src.get("title", ""),
+                        "content": content
+                    })
+            if not pseudo_scraped:
+                answer = "No relevant information could be found for this query."
             else:
-                # Full pipeline (uses orchestrator)
-                answer = orchestrator.run(query, logs=logs)
-                # Count agent usage from logs (simple heuristic)
-                if agent_usage is not None:
-                    for agent in ['Retriever', 'Scraper', 'Evaluator', 'Chunker', 'Synthesizer']:
-                        if any(agent in log for log in logs):
-                            agent_usage[agent] += 1
-                context = "\n".join(logs)[-2000:]
-            end = time.time()
-            latency = end - start
-            latencies.append(latency)
-            successful_runs += 1
-        except Exception as e:
-            print(f"Error: {e}")
-            answer = ""
-            context = ""
-            end = time.time()
-            latency = end - start
-            latencies.append(latency)
-        total_runs += 1
-
-        # Judge relevance (CoT)
-        relevance_score = llm_judge_relevance(llm, query, answer)
-        relevance_results.append(relevance_score)
-
-        # Judge faithfulness (CoT)
-        faithfulness_score = llm_judge_faithfulness(llm, context, answer)
-        faithfulness_results.append(faithfulness_score)
-
-    # Normalize to [0, 1] for reporting
-    relevance_norm = sum(relevance_results) / (5 * len(relevance_results)) if relevance_results else 0
-    faithfulness_norm = sum(faithfulness_results) / (5 * len(faithfulness_results)) if faithfulness_results else 0
-    avg_latency = sum(latencies) / len(latencies) if latencies else 0
+                with tempfile.TemporaryDirectory(prefix="baseline-") as directory:
+                    scratch = CompactStore(orchestrator.chunker.embeddings, directory=directory)
+                    vectorstore = orchestrator.chunker.run(pseudo_scraped, index=scratch)
+                    answer = orchestrator.synthesizer.run(query, vectorstore)
+        else:
+            answer = orchestrator.run(query, use_cache=False)
+    stages = dict(request.timings)
+    for span in spans(request.events):
+        stages[span["name"]] = stages.get(span["name"], 0.0) + span["wall"]
+    contexts = [event["text"] for event in request.events if event["type"] == "context"]
+    return answer, (contexts[-1] if contexts else ""), stages, sorted(agents_used(request.events))
+
+def evaluate_one(system, query, repeat, orchestrator, llm, is_baseline):
+    start = time.perf_counter()
+    row = {"system": system, "query": query, "repeat": repeat, "error": None, "judge_error": None}
+    try:
+        answer, context, stages, agents = run_query(query, orchestrator, is_baseline)
+    except Exception as e:
+        print(f"Error: {e}")
+        answer, context, stages, agents = "", "", {}, []
+        row["error"] = repr(e)
+    row.update(latency=time.perf_counter() - start, answer=answer, context=context, stages=stages, agents=agents)
+    # A failed judge call is recorded on the row instead of aborting the whole run
+    try:
+        row["relevance"], row["faithfulness"] = judge(llm, query, answer, context)
+    except Exception as e:
+        print(f"Judge error: {e}")
+        row["relevance"] = row["faithfulness"] = None
+        row["judge_error"] = repr(e)
+    return row
+
+def summarize(rows, throughput):
+    latencies = [row["latency"] for row in rows]
+    ok = [row for row in rows if row["error"] is None]
+    judged = [row for row in rows if row.get("judge_error") is None]
+    stage_times = defaultdict(list)
+    for row in rows:
+        for stage, secs in row["stages"].items():
+            stage_times[stage].append(secs)
+    query_times = defaultdict(list)
+    for row in rows:
+        query_times[row["query"]].append(row["latency"])
+
+    def pcts(values):
+        return {f"p{pct}": percentile(values, pct) for pct in (50, 90, 99)}
 
     return {
-        "relevance": relevance_norm,
-        "faithfulness": faithfulness_norm,
-        "avg_latency": avg_latency,
-        "throughput": len(queries) / sum(latencies) * 60 if latencies and sum(latencies) > 0 else 0,
-        "uptime": successful_runs / total_runs if total_runs else 0,
-        "error_rate": 1 - (successful_runs / total_runs) if total_runs else 1,
-        "agent_usage": dict(agent_usage) if agent_usage is not None else None,
-        "total_runs": total_runs
+        "relevance": sum(row["relevance"] for row in judged) / (5 * len(judged)) if judged else 0,
+        "faithfulness": sum(row["faithfulness"] for row in judged) / (5 * len(judged)) if judged else 0,
+        "judge_errors": len(rows) - len(judged),
+        "avg_latency": sum(latencies) / len(latencies) if latencies else 0,
+        "latency": pcts(latencies),
+        "throughput": throughput,
+        "uptime": len(ok) / len(rows) if rows else 0,
+        "error_rate": 1 - len(ok) / len(rows) if rows else 1,
+        "stages": {stage: pcts(values) for stage, values in sorted(stage_times.items())},
+        "queries": {query: pcts(values) for query, values in query_times.items()},
+        "total_runs": len(rows)
     }
 
+# --- Evaluation for a single pipeline: queries x repeats, `parallelism` at a time ---
+def evaluate_pipeline(queries, orchestrator, llm, is_baseline=False, agent_usage=None,
+                      parallelism=4, repeats=1, checkpoint=None):
+    system = "baseline" if is_baseline else "pipeline"
+    checkpoint = checkpoint or Checkpoint()
+    rows = []
+    todo = []
+    for repeat in range(repeats):
+        for query in queries:
+            done = checkpoint.get(system, query, repeat)
+            if done is not None:
+                rows.append(done)
+            else:
+                todo.append((query, repeat))
+    if len(rows):
+        print(f"Resuming {system}: {len(rows)} runs from the checkpoint, {len(todo)} to go")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="eval") as pool:
+        jobs = [pool.submit(evaluate_one, system, query, repeat, orchestrator, llm, is_baseline)
+                for query, repeat in todo]
+        for job in as_completed(jobs):
+            row = job.result()
+            checkpoint.add(row)
+            rows.append(row)
+    wall_time = time.perf_counter() - start
+    # Queries per minute over this session's runs; a fully resumed run can only estimate it
+    if todo:
+        throughput = len(todo) / wall_time * 60
+    else:
+        busy = sum(row["latency"] for row in rows) / parallelism
+        throughput = len(rows) / busy * 60 if busy > 0 else 0
+
+    scores = summarize(rows, throughput)
+    if agent_usage is not None:
+        for row in rows:
+            for agent in row["agents"]:
+                if agent in agent_usage:
+                    agent_usage[agent] += 1
+    scores["agent_usage"] = dict(agent_usage) if agent_usage is not None else None
+    return scores
+
+def print_percentiles(title, table):
+    print(f"\n{title}")
+    print(f"{'':<40} {'p50 (s)':>9} {'p90 (s)':>9} {'p99 (s)':>9}")
+    for name, pcts in table.items():
+        print(f"{name[:40]:<40} {pcts['p50']:>9.2f} {pcts['p90']:>9.2f} {pcts['p99']:>9.2f}")
+
 # --- Benchmarking: Compare pipeline vs. baseline ---
-def benchmark(queries, orchestrator, llm):
-    agent_usage_pipeline = Counter({agent: 0 for agent in ['Retriever', 'Scraper', 'Evaluator', 'Chunker', 'Synthesizer']})
-    agent_usage_baseline = Counter({agent: 0 for agent in ['Retriever', 'Scraper', 'Evaluator', 'Chunker', 'Synthesizer']})
+def benchmark(queries, orchestrator, llm, parallelism=4, repeats=1, checkpoint_path=None):
+    agents = ['Retriever', 'Scraper', 'Evaluator', 'Chunker', 'Synthesizer']
+    agent_usage_pipeline = Counter({agent: 0 for agent in agents})
+    agent_usage_baseline = Counter({agent: 0 for agent in agents})
+    checkpoint = Checkpoint(checkpoint_path)
 
     print("Evaluating full pipeline...")
-    pipeline_scores = evaluate_pipeline(queries, orchestrator, llm, is_baseline=False, agent_usage=agent_usage_pipeline)
+    pipeline_scores = evaluate_pipeline(queries, orchestrator, llm, is_baseline=False, agent_usage=agent_usage_pipeline,
+                                        parallelism=parallelism, repeats=repeats, checkpoint=checkpoint)
     print("Evaluating baseline (retriever only)...")
-    baseline_scores = evaluate_pipeline(queries, orchestrator, llm, is_baseline=True, agent_usage=agent_usage_baseline)
+    baseline_scores = evaluate_pipeline(queries, orchestrator, llm, is_baseline=True, agent_usage=agent_usage_baseline,
+                                        parallelism=parallelism, repeats=repeats, checkpoint=checkpoint)
     print("\nResults (normalized to 1.0):")
-    print(f"{'System':<15} {'Relevance':<10} {'Faithfulness':<13} {'Latency (s)':<12} {'Throughput':<12} {'Uptime':<8} {'ErrorRate':<10}")
-    print(f"{'Pipeline':<15} {pipeline_scores['relevance']:<10.2f} {pipeline_scores['faithfulness']:<13.2f} {pipeline_scores['avg_latency']:<12.2f} {pipeline_scores['throughput']:<12.2f} {pipeline_scores['uptime']*100:<8.1f}% {pipeline_scores['error_rate']*100:<10.1f}%")
-    print(f"{'Baseline':<15} {baseline_scores['relevance']:<10.2f} {baseline_scores['faithfulness']:<13.2f} {baseline_scores['avg_latency']:<12.2f} {baseline_scores['throughput']:<12.2f} {baseline_scores['uptime']*100:<8.1f}% {baseline_scores['error_rate']*100:<10.1f}%")
+    print(f"{'System':<15} {'Relevance':<10} {'Faithfulness':<13} {'p50 (s)':<9} {'p90 (s)':<9} {'p99 (s)':<9} {'Throughput':<12} {'Uptime':<8} {'ErrorRate':<10}")
+    for name, scores in (("Pipeline", pipeline_scores), ("Baseline", baseline_scores)):
+        latency = scores["latency"]
+        print(f"{name:<15} {scores['relevance']:<10.2f} {scores['faithfulness']:<13.2f} {latency['p50']:<9.2f} {latency['p90']:<9.2f} {latency['p99']:<9.2f} {scores['throughput']:<12.2f} {scores['uptime']*100:<8.1f}% {scores['error_rate']*100:<10.1f}%")
+        if scores["judge_errors"]:
+            print(f"{'':<15} {scores['judge_errors']} runs could not be judged and are left out of the scores")
+
+    print_percentiles("Pipeline stage latency", pipeline_scores["stages"])
+    print_percentiles("Baseline stage latency", baseline_scores["stages"])
+    print_percentiles("Pipeline latency per query", pipeline_scores["queries"])
 
     # Agent Utilization
     print("\nAgent Utilization (as % of runs):")
@@ -158,3 +264,47 @@ def benchmark(queries, orchestrator, llm):
         "pipeline": pipeline_scores,
         "baseline": baseline_scores
     }
+
+# python evaluation.py queries.txt --archive runs.jsonl.gz [--record] --parallel 4 --checkpoint eval.jsonl
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IntelliMesh pipeline against a retriever-only baseline")
+    parser.add_argument("queries", help="text file with one query per line")
+    parser.add_argument("--parallel", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--checkpoint", help="JSON-lines file to resume from and append to")
+    parser.add_argument("--archive", help="recorded search and page traffic to replay offline (see replay.py)")
+    parser.add_argument("--record", action="store_true", help="use the live services and save them to --archive")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="replay recorded latencies, scaled")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="extra simulated fetch failures")
+    parser.add_argument("--cache-dir", help="embedding cache and index for this run (default: <model cache>/eval)")
+    args = parser.parse_args()
+
+    from orchestrator import build_orchestrator
+    from llm_setup import LazyLLM, registry
+    import replay
+    for prefix in JUDGE_PREFIXES:
+        registry.register_prefix(prefix)
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    search_client = http_session = archive = None
+    if args.archive:
+        archive = replay.Archive(args.archive)
+        if args.record:
+            from langchain_community.utilities import GoogleSerperAPIWrapper
+            serper = GoogleSerperAPIWrapper(serper_api_key=os.environ["SERPER_API_KEY"], k=20)
+            search_client = replay.RecordingSearchClient(serper, archive)
+            http_session = replay.recording_session(archive)
+        else:
+            policy = replay.ReplayPolicy(latency_scale=args.latency_scale, failure_rate=args.failure_rate)
+            search_client = replay.ReplaySearchClient(archive, policy)
+            http_session = replay.replay_session(archive, policy)
+    # Never the app's own index: evaluation pages would replace or invalidate its entries
+    orchestrator = build_orchestrator(search_client=search_client, http_session=http_session,
+                                      cache_pages=not args.archive, cache_answers=False,
+                                      cache_directory=args.cache_dir or os.path.join(registry.cache_directory, "eval"))
+    try:
+        benchmark(queries, orchestrator, LazyLLM(), parallelism=args.parallel, repeats=args.repeats,
+                  checkpoint_path=args.checkpoint)
+    finally:
+        if args.record:
+            archive.save()
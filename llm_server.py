@@ -0,0 +1,83 @@
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+# LangChain LLMs accept a list of prompts through generate(); plain callables are mapped
+def batch_function(llm):
+    if hasattr(llm, "generate"):
+        def generate_batch(prompts):
+            return [generation[0].text for generation in llm.generate(prompts).generations]
+    else:
+        def generate_batch(prompts):
+            return [llm(prompt) for prompt in prompts]
+    return generate_batch
+
+# --- Dynamic batching front-end: callers block on a future while one worker thread
+# drains the queue in batches of up to max_batch_size, waiting at most max_wait
+# seconds for a batch to fill. Instances are callable like the LangChain LLM they wrap.
+# `guard` (a lock or semaphore) is held around each batch when the model is shared. ---
+class BatchingLLM:
+    def __init__(self, generate_batch, max_batch_size=8, max_wait=0.05, guard=None):
+        self.generate_batch = generate_batch
+        self.guard = guard or nullcontext()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.worker = threading.Thread(target=self._loop, name="llm-batcher", daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def from_llm(cls, llm, **kwargs):
+        return cls(batch_function(llm), **kwargs)
+
+    def submit(self, prompt):
+        future = Future()
+        self.queue.put((prompt, future))
+        return future
+
+    def __call__(self, prompt):
+        return self.submit(prompt).result()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [(prompt, future) for prompt, future in batch if future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self.batch_sizes[len(batch)] += 1
+            self.requests += len(batch)
+            try:
+                with self.guard:
+                    outputs = self.generate_batch([prompt for prompt, _ in batch])
+                for (_, future), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def metrics(self):
+        batches = sum(self.batch_sizes.values())
+        return {
+            "queue_depth": self.queue.qsize(),
+            "requests": self.requests,
+            "batches": batches,
+            "avg_batch_size": self.requests / batches if batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items()))
+        }
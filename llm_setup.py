@@ -1,37 +1,303 @@
+import contextvars
+import copy
 import os
-from transformers import BitsAndBytesConfig, AutoModelForCausalLM, AutoTokenizer, pipeline
-from langchain.llms import HuggingFacePipeline
+import threading
+import time
+from threading import Thread
+from llm_server import BatchingLLM, batch_function
+from prefix_cache import PrefixCache
 
 # Set API keys and model names
 os.environ["HUGGINGFACE_API_KEY"] = "your_hf_key"
 os.environ["SERPER_API_KEY"] = "your_serper_key"
 model_name = "meta-llama/Meta-Llama-3-8B-Instruct"
+embedding_model_name = "sentence-transformers/all-MiniLM-L6-v2"
 
-# Quantization config
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_compute_dtype="float16",
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-)
-
-# Load model and tokenizer
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    quantization_config=bnb_config,
-    device_map="auto",
-    trust_remote_code=True
-)
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-# HuggingFace pipeline
-pipe = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_new_tokens=512,
-    device_map="auto"
-)
-
-# LangChain LLM wrapper
-llm = HuggingFacePipeline(pipeline=pipe)
+# "hf" loads the real models; "fake" is a deterministic CPU stand-in for tests and tooling
+BACKEND = os.environ.get("INTELLIMESH_BACKEND", "hf")
+# How many generate() calls may run on the model at once, batched or streamed
+MAX_GENERATIONS = int(os.environ.get("INTELLIMESH_MAX_GENERATIONS", "1"))
+# Memory budget for the past-key-values of registered prompt prefixes
+PREFIX_CACHE_MB = int(os.environ.get("INTELLIMESH_PREFIX_CACHE_MB", "1024"))
+
+# --- Fake backend: echoes the prompt like a text-generation pipeline with return_full_text ---
+def fake_completion(prompt):
+    return f"\n2: fake backend answer ({len(prompt.split())} prompt words)."
+
+def fake_generate(prompt):
+    return prompt + fake_completion(prompt)
+
+def fake_stream(prompt, max_new_tokens=512):
+    for word in fake_completion(prompt).split(" ")[:max_new_tokens]:
+        yield word + " "
+
+# --- Serializes calls into an embedding model shared by request workers; HF fast
+# tokenizers are not safe to call from several threads at once ---
+class SerializedEmbeddings:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.lock:
+            return self.embeddings.embed_query(text)
+
+# --- Process-wide registry: every model is built on first use, exactly once.
+# Request workers share the models; generation_slots bounds concurrent generate()
+# calls and tokenizer_lock guards direct tokenizer use. Prompts that start with a
+# registered prefix skip its prefill by reusing cached past-key-values ---
+class ModelRegistry:
+    def __init__(self, backend=BACKEND, max_generations=MAX_GENERATIONS, model_name=model_name,
+                 quantize=True, prefix_cache_bytes=PREFIX_CACHE_MB << 20):
+        self.backend = backend
+        # Caches derived from model outputs (embeddings, index, answers) are kept per backend
+        self.cache_directory = "cache" if backend == "hf" else os.path.join("cache", backend)
+        self.model_name = model_name
+        self.quantize = quantize
+        self.lock = threading.RLock()
+        self.generation_slots = threading.BoundedSemaphore(max_generations)
+        self.tokenizer_lock = threading.Lock()
+        self.prefix_cache = PrefixCache(max_bytes=prefix_cache_bytes)
+        self.models = {}
+        self.load_times = {}
+
+    def _get(self, key, loader):
+        if key in self.models:
+            return self.models[key]
+        with self.lock:
+            if key not in self.models:
+                start = time.perf_counter()
+                self.models[key] = loader()
+                self.load_times[key] = time.perf_counter() - start
+            return self.models[key]
+
+    def model(self):
+        def load():
+            from transformers import BitsAndBytesConfig, AutoModelForCausalLM
+            if not self.quantize:
+                return AutoModelForCausalLM.from_pretrained(self.model_name)
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype="float16",
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_use_double_quant=True,
+            )
+            return AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                quantization_config=bnb_config,
+                device_map="auto",
+                trust_remote_code=True
+            )
+        return self._get("model", load)
+
+    def tokenizer(self):
+        def load():
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            # Batched generation pads on the left; Llama 3 ships without a pad token
+            tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+            tokenizer.padding_side = "left"
+            return tokenizer
+        return self._get("tokenizer", load)
+
+    def pipeline(self):
+        def load():
+            from transformers import pipeline
+            return pipeline(
+                "text-generation",
+                model=self.model(),
+                tokenizer=self.tokenizer(),
+                max_new_tokens=512,
+                device_map="auto"
+            )
+        return self._get("pipeline", load)
+
+    def base_llm(self):
+        def load():
+            if self.backend == "fake":
+                return fake_generate
+            from langchain.llms import HuggingFacePipeline
+            return HuggingFacePipeline(pipeline=self.pipeline(), batch_size=8)
+        return self._get("base_llm", load)
+
+    # Shared, dynamically batched entry point for every agent and judge
+    def llm(self):
+        return self._get("llm", lambda: BatchingLLM(
+            self._generate_batch, max_batch_size=8, max_wait=0.05, guard=self.generation_slots
+        ))
+
+    # Runs under the batcher's guard. A lone prompt with a cached prefix is generated on top
+    # of its past-key-values; batches of several prompts go through the pipeline together,
+    # since one batched prefill beats prefix reuse with one prompt at a time
+    # (benchmarks.bench_prefix_cache compares both)
+    def _generate_batch(self, prompts):
+        if self.backend != "fake" and len(prompts) == 1 and self.prefix_cache.match(prompts[0]):
+            return [self._generate_with_prefix(prompts[0])]
+        return batch_function(self.base_llm())(prompts)
+
+    # --- Prompt prefixes: static instruction blocks put in front of every variable part ---
+    def register_prefix(self, text):
+        if self.backend != "fake":
+            self.prefix_cache.register(text)
+
+    def _prefixed_inputs(self, prompt):
+        # (input_ids, attention_mask, past_key_values or None, prefix tokens reused, prefill
+        # seconds saved). Callers hold a generation slot: building a prefix entry runs the model
+        import torch
+        model, tokenizer = self.model(), self.tokenizer()
+        prefix = self.prefix_cache.match(prompt)
+        if prefix is None:
+            with self.tokenizer_lock:
+                input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device)
+            return input_ids, torch.ones_like(input_ids), None, 0, 0.0
+
+        def build():
+            with self.tokenizer_lock:
+                ids = tokenizer(prefix, return_tensors="pt").input_ids.to(model.device)
+            start = time.perf_counter()
+            with torch.no_grad():
+                past = model(input_ids=ids, use_cache=True).past_key_values
+            return ids, past, time.perf_counter() - start
+
+        prefix_ids, past, saved = self.prefix_cache.get(prefix, build)
+        # The suffix is tokenized on its own so the prefix tokens match the cached ones exactly
+        with self.tokenizer_lock:
+            suffix_ids = tokenizer(prompt[len(prefix):], add_special_tokens=False,
+                                   return_tensors="pt").input_ids.to(model.device)
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+        # generate() appends to the cache it is given, so every call works on a copy
+        reused = prefix_ids.shape[1] if saved else 0
+        return input_ids, torch.ones_like(input_ids), copy.deepcopy(past), reused, saved
+
+    @staticmethod
+    def _log_prefix_reuse(input_ids, reused, saved):
+        if reused:
+            from agents.base import log
+            from agents.tracing import count
+            count("tokens_reused", reused)
+            log(f"LLM: Reused {reused} cached prefix tokens of {input_ids.shape[1]} "
+                f"(~{saved:.2f}s prefill saved)")
+
+    def _generate_with_prefix(self, prompt, max_new_tokens=512):
+        import torch
+        model, tokenizer = self.model(), self.tokenizer()
+        input_ids, attention_mask, past, reused, saved = self._prefixed_inputs(prompt)
+        self._log_prefix_reuse(input_ids, reused, saved)
+        with torch.no_grad():
+            output = model.generate(input_ids=input_ids, attention_mask=attention_mask, past_key_values=past,
+                                    max_new_tokens=max_new_tokens, pad_token_id=tokenizer.pad_token_id)
+        # Same shape as the pipeline's output: the prompt followed by the completion
+        return prompt + tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    # Single prompt outside the batcher, e.g. for benchmarks
+    def generate(self, prompt, max_new_tokens=512):
+        if self.backend == "fake":
+            return fake_generate(prompt)
+        with self.generation_slots:
+            return self._generate_with_prefix(prompt, max_new_tokens)
+
+    def embeddings(self, name=embedding_model_name):
+        def load():
+            if self.backend == "fake":
+                from langchain_community.embeddings import DeterministicFakeEmbedding
+                return DeterministicFakeEmbedding(size=384)
+            from langchain.embeddings import HuggingFaceEmbeddings
+            return SerializedEmbeddings(HuggingFaceEmbeddings(model_name=name))
+        return self._get(f"embeddings:{name}", load)
+
+    def embedding_cache_name(self, name=embedding_model_name):
+        # Key for the embedding cache: fake vectors must never be served for the real model
+        return name if self.backend == "hf" else f"{self.backend}:{name}"
+
+    def count_tokens(self, text):
+        if self.backend == "fake":
+            return len(text.split())
+        tokenizer = self.tokenizer()
+        with self.tokenizer_lock:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+
+    # Token streaming: generate() runs on a worker thread and pushes decoded text into the
+    # streamer. Generation stops early when the consumer stops reading (closed generator,
+    # no token within `timeout` seconds) or the request is cancelled, which frees the slot
+    def stream_llm(self, prompt, max_new_tokens=512, timeout=300.0):
+        if self.backend == "fake":
+            yield from fake_stream(prompt, max_new_tokens)
+            return
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+        from agents.base import current_request
+        model, tokenizer = self.model(), self.tokenizer()
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+        stopped = threading.Event()
+        request = current_request()
+
+        class Stop(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                stop = stopped.is_set() or (request is not None and request.cancelled.is_set())
+                return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+        def generate():
+            with self.generation_slots:
+                try:
+                    if stopped.is_set():
+                        return
+                    input_ids, attention_mask, past, reused, saved = self._prefixed_inputs(prompt)
+                    self._log_prefix_reuse(input_ids, reused, saved)
+                    model.generate(input_ids=input_ids, attention_mask=attention_mask, past_key_values=past,
+                                   streamer=streamer, max_new_tokens=max_new_tokens,
+                                   stopping_criteria=StoppingCriteriaList([Stop()]))
+                except Exception:
+                    # Unblock the consumer instead of leaving it waiting on the streamer
+                    streamer.end()
+                    raise
+
+        # The worker thread carries the request context so the reuse line lands in its logs
+        Thread(target=contextvars.copy_context().run, args=(generate,), daemon=True).start()
+        try:
+            yield from streamer
+        finally:
+            stopped.set()
+
+    def warmup(self, llm=True, embeddings=(embedding_model_name,)):
+        if llm:
+            self.llm()
+        for name in embeddings:
+            self.embeddings(name)
+        return self.status()
+
+    def status(self):
+        return {
+            "backend": self.backend,
+            "loaded": {key: round(secs, 3) for key, secs in self.load_times.items()},
+            "prefix_cache": self.prefix_cache.stats()
+        }
+
+registry = ModelRegistry()
+
+# --- Stand-ins agents can hold from startup; the model loads on the first call ---
+class LazyLLM:
+    def __call__(self, prompt):
+        return registry.llm()(prompt)
+
+    def submit(self, prompt):
+        return registry.llm().submit(prompt)
+
+def stream_llm(prompt, max_new_tokens=512, timeout=300.0):
+    yield from registry.stream_llm(prompt, max_new_tokens, timeout)
+
+# The old module attributes (llm, model, tokenizer, pipe, base_llm) still work, lazily
+def __getattr__(name):
+    loaders = {
+        "llm": registry.llm,
+        "base_llm": registry.base_llm,
+        "model": registry.model,
+        "tokenizer": registry.tokenizer,
+        "pipe": registry.pipeline,
+    }
+    if name in loaders:
+        return loaders[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,21 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agents.base import log, current_request, request_context, submit_with_context
 from agents.retriever import RetrieverAgent
 from agents.scraper import ScraperAgent
 from agents.evaluator import EvaluatorAgent
 from agents.chunker import ChunkerAgent
-from agents.synthesizer import SynthesizerAgent
+from agents.synthesizer import SynthesizerAgent, PROMPT_PREFIXES
 from agents.planner import PlannerAgent
-from agents.pdf_loader import PDFLoaderAgent
+from agents.pdf_loader import PDFLoaderAgent, file_hash
+from agents.dedup import DedupAgent
+from agents.context_builder import ContextBuilder
+from agents.answer_cache import AnswerCache
 
 class Orchestrator:
-    def __init__(self, retriever, scraper, evaluator, chunker, synthesizer, planner, pdf_loader):
+    def __init__(self, retriever, scraper, evaluator, chunker, synthesizer, planner, pdf_loader, dedup=None, streaming=True,
+                 answer_cache=None, indexing_workers=2):
         self.retriever = retriever
         self.scraper = scraper
         self.evaluator = evaluator
@@ -15,38 +23,263 @@ class Orchestrator:
         self.synthesizer = synthesizer
         self.planner = planner
         self.pdf_loader = pdf_loader
+        self.dedup = dedup
+        self.streaming = streaming
+        self.answer_cache = answer_cache
+        if answer_cache is not None:
+            # Re-indexing a page with new content retires the answers built on it
+            chunker.index.on_change(answer_cache.invalidate_url)
+        # Each streaming request gets its own indexing threads, so a large PDF upload
+        # cannot queue its batches ahead of another request's pages
+        self.indexing_workers = indexing_workers
+        self.last_timings = {}
 
-    def run(self, topic, pdf_path=None, logs=None):
+    # Logs and stage timings live on the request context; `logs` is only needed
+    # by callers that run the pipeline outside one
+    # use_cache=False runs the full pipeline even for a cached question (benchmarks)
+    def run(self, topic, pdf_path=None, logs=None, use_cache=True):
+        with request_context(logs=logs):
+            pdf_hash = file_hash(pdf_path) if pdf_path else ""
+            cached = self.cached_answer(topic, pdf_hash) if use_cache else None
+            if cached is not None:
+                return cached
+            vectorstore = self.prepare(topic, pdf_path=pdf_path)
+            return self.synthesize(topic, vectorstore, pdf_hash)
+
+    # --- The model-bound half of run(), for callers that schedule prepare() separately ---
+    def synthesize(self, topic, vectorstore, pdf_hash=""):
+        with request_context():
+            start = time.perf_counter()
+            summary = self.synthesizer.run(topic, vectorstore)
+            self._finish_timings(start)
+            self._store_answer(topic, pdf_hash, summary, vectorstore)
+            return summary
+
+    # --- Same as run(), but yields the partial answer as tokens arrive ---
+    def stream(self, topic, pdf_path=None, logs=None, use_cache=True):
+        with request_context(logs=logs):
+            pdf_hash = file_hash(pdf_path) if pdf_path else ""
+            cached = self.cached_answer(topic, pdf_hash) if use_cache else None
+            if cached is not None:
+                yield cached
+                return
+            vectorstore = self.prepare(topic, pdf_path=pdf_path)
+            start = time.perf_counter()
+            answer = None
+            for answer in self.synthesizer.stream(topic, vectorstore):
+                yield answer
+            self._finish_timings(start)
+            self._store_answer(topic, pdf_hash, answer, vectorstore)
+
+    def cached_answer(self, topic, pdf_hash=""):
+        if self.answer_cache is None:
+            return None
+        start = time.perf_counter()
+        answer, kind = self.answer_cache.get(topic, pdf_hash)
+        if answer is not None:
+            log(f"Pipeline: Answer cache {kind} hit in {(time.perf_counter() - start) * 1000:.1f} ms "
+                f"(hit rate {self.answer_cache.stats()['hit_rate']:.0%})")
+        return answer
+
+    def _store_answer(self, topic, pdf_hash, answer, vectorstore):
+        # Answers without any indexed source behind them are not worth keeping
+        urls = getattr(vectorstore, "urls", None)
+        if self.answer_cache is not None and answer and urls:
+            self.answer_cache.put(topic, pdf_hash, answer, urls)
+
+    def _finish_timings(self, synth_start):
+        timings = current_request().timings
+        if not timings:
+            return
+        timings["synthesize"] = time.perf_counter() - synth_start
+        timings["total"] = sum(timings.values())
+        self.last_timings = timings
+        log("Pipeline: Stage timings " + ", ".join(f"{stage} {secs:.2f}s" for stage, secs in timings.items()))
+
+    # --- Everything up to synthesis; returns the vectorstore to synthesize from ---
+    def prepare(self, topic, pdf_path=None):
+        with request_context():
+            return self._prepare(topic, pdf_path)
+
+    def _prepare(self, topic, pdf_path):
         pdf_uploaded = pdf_path is not None
         flow_number, reason = self.planner.run(topic, pdf_uploaded)
-        if logs is not None:
-            logs.append(f"Planner chose flow {flow_number}: {reason}")
+        log(f"Planner chose flow {flow_number}: {reason}")
 
         if flow_number == 3 and pdf_uploaded:
-            logs.append("Pipeline: Load PDF > Chunk > Synthesize")
-            pdf_docs = self.pdf_loader.run(pdf_path, logs=logs)
-            summary = self.synthesizer.run(topic, self.chunker.run(pdf_docs))
-            return summary
+            log("Pipeline: Load PDF > Chunk > Synthesize")
+            if self.streaming:
+                return self._prepare_pdf_streaming(pdf_path)
+            pdf_docs = self.pdf_loader.run(pdf_path)
+            vectorstore = self.chunker.run(pdf_docs)
+            self.chunker.retain(pdf_path, [page["doc_id"] for page in pdf_docs])
+            return vectorstore
 
         elif flow_number == 1:
-            logs.append("Pipeline: Retrieve > Scrape > Synthesize")
-            sources = self.retriever.run(topic, logs=logs)
-            scraped = self.scraper.run(sources, self.retriever, topic, logs=logs)
-            summary = self.synthesizer.run(topic, self.chunker.run(scraped))
-            return summary
+            log("Pipeline: Retrieve > Scrape > Synthesize")
+            if self.streaming:
+                return self._prepare_streaming(topic, evaluate=False)
+            sources = self.retriever.run(topic)
+            scraped = self._deduplicate(self.scraper.run(sources, self.retriever, topic))
+            return self.chunker.run(scraped)
 
         elif flow_number == 2:
-            logs.append("Pipeline: Retrieve > Scrape > Evaluate > Synthesize")
-            sources = self.retriever.run(topic, logs=logs)
-            scraped = self.scraper.run(sources, self.retriever, topic, logs=logs)
-            curated = self.evaluator.run(scraped, query=topic, logs=logs)
-            summary = self.synthesizer.run(topic, self.chunker.run(curated))
-            return summary
+            log("Pipeline: Retrieve > Scrape > Evaluate > Synthesize")
+            if self.streaming:
+                return self._prepare_streaming(topic, evaluate=True)
+            sources = self.retriever.run(topic)
+            scraped = self._deduplicate(self.scraper.run(sources, self.retriever, topic))
+            curated = self.evaluator.run(scraped, query=topic)
+            return self.chunker.run(curated)
 
         else:
-            logs.append("Unknown pipeline flow. Defaulting to pipeline 2.")
-            sources = self.retriever.run(topic, logs=logs)
-            scraped = self.scraper.run(sources, self.retriever, topic, logs=logs)
-            curated = self.evaluator.run(scraped, query=topic, logs=logs)
-            summary = self.synthesizer.run(topic, self.chunker.run(curated))
-            return summary
+            log("Unknown pipeline flow. Defaulting to pipeline 2.")
+            if self.streaming:
+                return self._prepare_streaming(topic, evaluate=True)
+            sources = self.retriever.run(topic)
+            scraped = self._deduplicate(self.scraper.run(sources, self.retriever, topic))
+            curated = self.evaluator.run(scraped, query=topic)
+            return self.chunker.run(curated)
+
+    # --- Drop mirrors and near-duplicates before they are chunked and embedded ---
+    def _deduplicate(self, pages):
+        if self.dedup is None:
+            return pages
+        session = self.dedup.session()
+        kept = [page for page in pages if not session.check(page)]
+        self._log_dedup_savings(session)
+        return kept
+
+    def _log_dedup_savings(self, session):
+        # Skipped work, not embedding calls saved: some of these chunks may have been cache hits
+        if session is not None and session.dropped:
+            chunks = self.chunker.count_chunks(session.dropped)
+            chars = sum(len(page.get("content", "")) for page in session.dropped)
+            log(f"Dedup: Dropped {len(session.dropped)} redundant pages, "
+                f"skipping {chunks} chunks ({chars} characters) of splitting and embedding")
+
+    def _indexing_pool(self):
+        return ThreadPoolExecutor(max_workers=self.indexing_workers, thread_name_prefix="index")
+
+    # --- Streaming PDF flow: pages are chunked and embedded in batches while later
+    # page ranges are still being extracted ---
+    def _prepare_pdf_streaming(self, pdf_path, batch_size=32):
+        timings = current_request().timings
+        start = time.perf_counter()
+        indexing = []
+        batch = []
+        doc_ids = []
+        pool = self._indexing_pool()
+        try:
+            for page in self.pdf_loader.iter_pages(pdf_path):
+                doc_ids.append(page["doc_id"])
+                batch.append(page)
+                if len(batch) >= batch_size:
+                    indexing.append(submit_with_context(pool, self.chunker.add, batch))
+                    batch = []
+            if batch:
+                indexing.append(submit_with_context(pool, self.chunker.add, batch))
+            timings["extract"] = time.perf_counter() - start
+
+            stage_start = time.perf_counter()
+            for job in indexing:
+                job.result()
+            timings["index_tail"] = time.perf_counter() - stage_start
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        # Pages past the end of a shorter file uploaded to the same path are stale
+        self.chunker.retain(pdf_path, doc_ids)
+        log("Chunker: Vectorstore ready.")
+
+        return self.chunker.view([pdf_path])
+
+    # --- Streaming web flow: each scraped page is filtered and handed to the chunker
+    # (split + embed + index) on an indexing thread while other fetches are still in flight.
+    # Ranking only needs the page texts, so synthesis starts as soon as the scraper
+    # stops and the last embeddings land. It does not start earlier on a partial
+    # index: every selected page must be searchable before the context is built ---
+    def _prepare_streaming(self, topic, evaluate):
+        timings = current_request().timings
+        start = time.perf_counter()
+        sources = self.retriever.run(topic)
+        timings["retrieve"] = time.perf_counter() - start
+
+        stage_start = time.perf_counter()
+        accepted = []
+        indexing = []
+        dedup = self.dedup.session() if self.dedup else None
+        pool = self._indexing_pool()
+        try:
+            for page in self.scraper.iter_scrape(sources, self.retriever, topic):
+                if evaluate and not self.evaluator.accepts(page):
+                    continue
+                if dedup and dedup.check(page):
+                    continue
+                accepted.append(page)
+                indexing.append(submit_with_context(pool, self.chunker.add, [page]))
+            timings["scrape"] = time.perf_counter() - stage_start
+            self._log_dedup_savings(dedup)
+
+            stage_start = time.perf_counter()
+            selected = self.evaluator.run(accepted, query=topic) if evaluate else accepted
+            timings["evaluate"] = time.perf_counter() - stage_start
+
+            # Only the indexing that did not overlap with scraping shows up here
+            stage_start = time.perf_counter()
+            for job in indexing:
+                job.result()
+            timings["index_tail"] = time.perf_counter() - stage_start
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        log("Chunker: Vectorstore ready.")
+
+        return self.chunker.view([page["url"] for page in selected])
+
+# --- Process-wide instance; agents hold lazy handles, so no weights load until first use ---
+# search_client / http_session swap the network for a replay archive (replay.py);
+# cache_pages=False makes every run fetch through http_session; vector_store (or
+# INTELLIMESH_VECTOR_STORE) picks "chroma" or the quantized "compact" index;
+# cache_directory (default registry.cache_directory) holds the embeddings, index and answers
+def build_orchestrator(search_client=None, http_session=None, cache_pages=True, cache_answers=True,
+                       vector_store=None, cache_directory=None):
+    from llm_setup import registry, LazyLLM, stream_llm
+    from agents.embedding_cache import LazyEmbeddings
+    llm = LazyLLM()
+    for prefix in PROMPT_PREFIXES:
+        registry.register_prefix(prefix)
+    vector_store = vector_store or os.environ.get("INTELLIMESH_VECTOR_STORE", "chroma")
+    cache_directory = cache_directory or registry.cache_directory
+    # The fake backend gets its own embedding, index and answer caches (registry.cache_directory)
+    chunker = ChunkerAgent(
+        "Chunker", llm, embedding_model_name=registry.embedding_cache_name(),
+        embeddings=LazyEmbeddings(registry.embeddings), vector_store=vector_store,
+        cache_directory=cache_directory
+    )
+    scraper_kwargs = {} if cache_pages else {"cache_path": None}
+    return Orchestrator(
+        retriever=RetrieverAgent("Retriever", llm, client=search_client),
+        scraper=ScraperAgent("Scraper", llm, session=http_session, **scraper_kwargs),
+        evaluator=EvaluatorAgent("Evaluator", llm),
+        chunker=chunker,
+        synthesizer=SynthesizerAgent(
+            "Synthesizer", llm, stream_llm=stream_llm,
+            context_builder=ContextBuilder(count_tokens=registry.count_tokens)
+        ),
+        planner=PlannerAgent("Planner", llm),
+        pdf_loader=PDFLoaderAgent("PDFLoader", llm),
+        dedup=DedupAgent("Dedup", llm),
+        answer_cache=AnswerCache(
+            embeddings=chunker.embeddings, path=os.path.join(cache_directory, "answers.sqlite")
+        ) if cache_answers else None
+    )
+
+_orchestrator = None
+
+# `from orchestrator import orchestrator` builds the instance on first import
+def __getattr__(name):
+    global _orchestrator
+    if name == "orchestrator":
+        if _orchestrator is None:
+            _orchestrator = build_orchestrator()
+        return _orchestrator
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
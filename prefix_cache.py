@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+def cache_nbytes(past_key_values):
+    # Works for DynamicCache (per-layer .keys/.values or iteration) and legacy tuples
+    layers = getattr(past_key_values, "layers", None)
+    if layers is not None:
+        tensors = [t for layer in layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = [t for layer in past_key_values for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+# --- Past-key-values of registered static prompt prefixes (instruction blocks, judge
+# rubrics), built on first use and kept in an LRU bounded by tensor bytes. Each hit
+# saves the prefill of the prefix tokens; the saving is estimated with the prefill
+# time measured when the entry was built ---
+class PrefixCache:
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.prefixes = set()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+        self.seconds_saved = 0.0
+
+    def register(self, text):
+        with self.lock:
+            self.prefixes.add(text)
+
+    def match(self, prompt):
+        # Longest registered prefix of the prompt, or None
+        with self.lock:
+            candidates = [prefix for prefix in self.prefixes if prompt.startswith(prefix)]
+        return max(candidates, key=len) if candidates else None
+
+    def get(self, prefix, build):
+        # build() -> (input_ids, past_key_values, prefill_seconds); returns (input_ids,
+        # past_key_values, prefill_seconds_saved). Callers must copy the cache before
+        # generating, since generate() appends to it
+        with self.lock:
+            entry = self.entries.get(prefix)
+            if entry is not None:
+                self.entries.move_to_end(prefix)
+                ids, past, nbytes, seconds = entry
+                self.hits += 1
+                self.tokens_reused += ids.shape[-1]
+                self.seconds_saved += seconds
+                return ids, past, seconds
+            self.misses += 1
+        ids, past, seconds = build()
+        nbytes = cache_nbytes(past)
+        with self.lock:
+            if nbytes <= self.max_bytes and prefix not in self.entries:
+                self.entries[prefix] = (ids, past, nbytes, seconds)
+                self.bytes += nbytes
+                while self.bytes > self.max_bytes:
+                    _, (_, _, evicted, _) = self.entries.popitem(last=False)
+                    self.bytes -= evicted
+        return ids, past, 0.0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "prefixes": len(self.prefixes),
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "tokens_reused": self.tokens_reused,
+                "prefill_seconds_saved": round(self.seconds_saved, 3)
+            }
@@ -0,0 +1,227 @@
+import gzip
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Recorded exception names mapped back to what requests would have raised
+ERRORS = {
+    "ConnectTimeout": requests.exceptions.ConnectTimeout,
+    "ReadTimeout": requests.exceptions.ReadTimeout,
+    "Timeout": requests.exceptions.Timeout,
+    "ConnectionError": requests.exceptions.ConnectionError,
+    "SSLError": requests.exceptions.SSLError,
+    "TooManyRedirects": requests.exceptions.TooManyRedirects,
+    "HTTPError": requests.exceptions.HTTPError,
+}
+
+# --- Search responses and HTTP exchanges with their timings, one JSON object per line
+# in a gzip file. Several records per key replay in order, then wrap around ---
+class Archive:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = defaultdict(list)
+        self.attempts = defaultdict(int)
+        self.replayed = 0
+        self.missing = 0
+        if path and os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[(record["kind"], record["key"])].append(record)
+
+    def add(self, record):
+        with self.lock:
+            self.records[(record["kind"], record["key"])].append(record)
+
+    def next(self, kind, key):
+        # Returns (record, attempt); record is None when the key was never recorded
+        with self.lock:
+            attempt = self.attempts[(kind, key)]
+            self.attempts[(kind, key)] += 1
+            records = self.records.get((kind, key))
+            if not records:
+                self.missing += 1
+                return None, attempt
+            self.replayed += 1
+            return records[attempt % len(records)], attempt
+
+    # Start every key from its first record again, e.g. before replaying a second variant
+    def rewind(self):
+        with self.lock:
+            self.attempts.clear()
+            self.replayed = 0
+            self.missing = 0
+
+    def save(self, path=None):
+        path = path or self.path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self.lock, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for records in self.records.values():
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "keys": len(self.records),
+                "records": sum(len(records) for records in self.records.values()),
+                "replayed": self.replayed,
+                "missing": self.missing
+            }
+
+# --- Replay knobs shared by search and HTTP: latency_scale multiplies the recorded
+# timings (0 replays instantly), failure_rate injects extra connection errors. Both are
+# deterministic per (seed, key, attempt), so concurrent runs see the same outcomes ---
+class ReplayPolicy:
+    def __init__(self, latency_scale=0.0, failure_rate=0.0, seed=0):
+        self.latency_scale = latency_scale
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.injected = 0
+
+    def wait(self, record, timeout=None):
+        delay = record.get("elapsed", 0.0) * self.latency_scale
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"replayed response took {delay:.2f}s")
+        if delay > 0:
+            time.sleep(delay)
+
+    def maybe_fail(self, kind, key, attempt):
+        if self.failure_rate and random.Random(f"{self.seed}:{kind}:{key}:{attempt}").random() < self.failure_rate:
+            self.injected += 1
+            raise requests.exceptions.ConnectionError(f"simulated failure for {key}")
+
+def _raise_recorded(record):
+    raise ERRORS.get(record["error"], requests.exceptions.RequestException)(record.get("message", record["error"]))
+
+# --- Search client layer: wraps anything with .results(query), like the Serper wrapper ---
+class RecordingSearchClient:
+    def __init__(self, client, archive):
+        self.client = client
+        self.archive = archive
+
+    def results(self, query):
+        start = time.perf_counter()
+        record = {"kind": "search", "key": query, "recorded_at": time.time()}
+        try:
+            response = self.client.results(query)
+        except Exception as e:
+            self.archive.add({**record, "elapsed": time.perf_counter() - start,
+                              "error": type(e).__name__, "message": str(e)})
+            raise
+        self.archive.add({**record, "elapsed": time.perf_counter() - start, "response": response})
+        return response
+
+class ReplaySearchClient:
+    def __init__(self, archive, policy=None):
+        self.archive = archive
+        self.policy = policy or ReplayPolicy()
+
+    def results(self, query):
+        record, attempt = self.archive.next("search", query)
+        if record is None:
+            return {"organic": []}
+        self.policy.wait(record)
+        self.policy.maybe_fail("search", query, attempt)
+        if record.get("error"):
+            _raise_recorded(record)
+        return record["response"]
+
+# --- HTTP layer: transport adapters mounted on a requests.Session, so the scraper's own
+# code (streaming, size cap, content types, conditional requests) runs unchanged ---
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, archive, max_body_bytes=5_000_000, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+        self.max_body_bytes = max_body_bytes
+
+    def send(self, request, stream=False, **kwargs):
+        start = time.perf_counter()
+        record = {"kind": "http", "key": request.url, "recorded_at": time.time()}
+        try:
+            resp = super().send(request, stream=stream, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.archive.add({**record, "elapsed": time.perf_counter() - start,
+                              "error": type(e).__name__, "message": str(e)})
+            raise
+        body = b""
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) >= self.max_body_bytes:
+                break
+        resp.close()
+        # iter_content already undid any transfer compression, so those headers would lie
+        headers = {key: value for key, value in resp.headers.items()
+                   if key.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        record.update(elapsed=time.perf_counter() - start, status=resp.status_code, reason=resp.reason,
+                      headers=headers)
+        try:
+            record["text"] = body.decode("utf-8")
+        except UnicodeDecodeError:
+            record["latin1"] = body.decode("latin-1")
+        self.archive.add(record)
+        return _build_response(request, record)
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, archive, policy=None):
+        super().__init__()
+        self.archive = archive
+        self.policy = policy or ReplayPolicy()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        record, attempt = self.archive.next("http", request.url)
+        if record is None:
+            raise requests.exceptions.ConnectionError(f"{request.url} is not in the replay archive")
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        self.policy.wait(record, read_timeout)
+        self.policy.maybe_fail("http", request.url, attempt)
+        if record.get("error"):
+            _raise_recorded(record)
+        return _build_response(request, record)
+
+    def close(self):
+        pass
+
+def _build_response(request, record):
+    headers = CaseInsensitiveDict(record["headers"])
+    if "text" in record:
+        body = record["text"].encode("utf-8")
+    else:
+        body = record["latin1"].encode("latin-1")
+    resp = requests.Response()
+    resp.status_code = record["status"]
+    resp.reason = record.get("reason", "")
+    resp.headers = headers
+    resp.encoding = get_encoding_from_headers(headers)
+    resp.raw = io.BytesIO(body)
+    resp.url = request.url
+    resp.request = request
+    return resp
+
+def _session(adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    return session
+
+def recording_session(archive, pool_connections=8, pool_maxsize=2):
+    return _session(RecordingAdapter(archive, pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize, pool_block=True))
+
+def replay_session(archive, policy=None):
+    return _session(ReplayAdapter(archive, policy))
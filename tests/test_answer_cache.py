@@ -0,0 +1,32 @@
+import time
+from agents.answer_cache import AnswerCache
+
+# Queries sharing their first word embed to the same direction
+class FirstWordEmbeddings:
+    def embed_query(self, text):
+        word = text.split()[0]
+        return [1.0 if word == "solar" else 0.0, 1.0 if word == "wind" else 0.0, 0.1]
+
+def open_cache(tmp_path, **kwargs):
+    return AnswerCache(embeddings=FirstWordEmbeddings(), path=str(tmp_path / "answers.sqlite"), **kwargs)
+
+def test_exact_and_semantic_hits_respect_the_pdf(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put("Solar  power costs", "", "answer", ["http://a.test/"])
+    assert cache.get("solar power costs") == ("answer", "exact")
+    assert cache.get("solar panel prices") == ("answer", "semantic")
+    assert cache.get("solar panel prices", "pdf-hash") == (None, None)
+    assert cache.get("wind power costs") == (None, None)
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_reindexed_sources_and_expired_entries_are_dropped(tmp_path):
+    cache = open_cache(tmp_path, semantic=False)
+    cache.put("solar", "", "answer", ["http://a.test/", "http://b.test/"])
+    cache.put("wind", "", "answer", ["http://c.test/"])
+    assert cache.invalidate_url("http://b.test/") == 1
+    assert cache.get("solar") == (None, None)
+    assert cache.get("wind") == ("answer", "exact")
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get("wind") == (None, None)
+    assert cache.stats()["expired"] == 1 and cache.stats()["entries"] == 0
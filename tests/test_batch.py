@@ -0,0 +1,26 @@
+import json
+from batch import BatchOutput, read_jobs
+
+def test_read_jobs(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text('{"id": "a", "query": "q1"}\n\n{"topic": "q2", "pdf": "x.pdf"}\n{"id": "c"}\n')
+    assert read_jobs(path) == [{"id": "a", "query": "q1", "pdf": None}, {"id": "3", "query": "q2", "pdf": "x.pdf"}]
+
+def test_output_resumes_answered_ids_only(tmp_path):
+    path = tmp_path / "out.jsonl"
+    output = BatchOutput(str(path))
+    output.write({"id": "1", "answer": "a", "error": None})
+    output.write({"id": "2", "answer": None, "error": "Timeout()"})
+    output.close()
+    assert BatchOutput(str(path)).done == {"1"}
+
+def test_output_drops_a_torn_last_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text('{"id": "1", "error": null}\n{"id": "2", "err')
+    output = BatchOutput(str(path))
+    assert output.done == {"1"}
+    output.write({"id": "2", "error": None})
+    output.close()
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [row["id"] for row in rows] == ["1", "2"]
+    assert BatchOutput(str(path)).done == {"1", "2"}
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from agents.compact_store import CompactStore
+
+class HashEmbeddings:
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(16).tolist()
+
+def splits(url, texts, **metadata):
+    return [Document(page_content=text, metadata={"url": url, "title": url, "start_index": i * 10, **metadata})
+            for i, text in enumerate(texts)]
+
+def open_store(directory, **kwargs):
+    return CompactStore(HashEmbeddings(), directory=str(directory), **kwargs)
+
+def contents(store, urls):
+    return sorted(doc.page_content for doc in store.view(urls, k=50).as_retriever().invoke("query"))
+
+def test_upsert_replace_and_reload(tmp_path):
+    store = open_store(tmp_path)
+    assert store.upsert("a", "v1", splits("a", ["one", "two"])) == 2
+    assert store.upsert("a", "v1", splits("a", ["one", "two"])) == 0
+    assert store.upsert("a", "v2", splits("a", ["three"])) == 1
+    store.upsert("b", "v1", splits("b", ["four"]))
+    assert contents(store, ["a"]) == ["three"]
+    reopened = open_store(tmp_path)
+    assert contents(reopened, ["a", "b"]) == ["four", "three"]
+
+def test_document_keeps_split_metadata(tmp_path):
+    store = open_store(tmp_path)
+    store.upsert("doc.pdf#page=2", "v1", splits("doc.pdf", ["text"], page=2, source="doc.pdf"))
+    (row, _), = store.search(store.embeddings.embed_query("text"), k=1)
+    metadata = open_store(tmp_path).document(row).metadata
+    assert metadata == {"url": "doc.pdf", "title": "doc.pdf", "start_index": 0, "page": 2, "source": "doc.pdf",
+                        "doc_id": "doc.pdf#page=2", "content_hash": "v1"}
+
+def test_uncommitted_appends_are_dropped(tmp_path):
+    store = open_store(tmp_path)
+    store.upsert("a", "v1", splits("a", ["one"]))
+    store._commit = lambda: None
+    store.upsert("b", "v1", splits("b", ["two", "three"]))
+    reopened = open_store(tmp_path)
+    assert reopened.rows == 1
+    assert contents(reopened, ["a", "b"]) == ["one"]
+
+def test_compact_removes_replaced_rows(tmp_path):
+    store = open_store(tmp_path)
+    store.upsert("a", "v1", splits("a", ["one", "two"]))
+    store.upsert("a", "v2", splits("a", ["three"]))
+    store.upsert("b", "v1", splits("b", ["four"]))
+    assert store.compact() == 2
+    assert store.rows == 2
+    assert contents(store, ["a", "b"]) == ["four", "three"]
+    assert sorted(os.listdir(tmp_path)) == ["gen-1", "state.json"]
+    assert contents(open_store(tmp_path), ["a", "b"]) == ["four", "three"]
+
+@pytest.mark.parametrize("crash_after_commit", [False, True])
+def test_compact_crash_leaves_a_complete_generation(tmp_path, monkeypatch, crash_after_commit):
+    store = open_store(tmp_path)
+    store.upsert("a", "v1", splits("a", ["one", "two", "three"]))
+    store.upsert("a", "v2", splits("a", ["four"]))
+    store.upsert("b", "v1", splits("b", ["five"]))
+
+    # The process dies right before or right after state.json is replaced
+    def crash():
+        if crash_after_commit:
+            store._commit()
+        raise KeyboardInterrupt("crash")
+
+    monkeypatch.setattr(store, "_commit_or_reload", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact()
+    # Both generations are on disk; state.json decides which one is read
+    assert sorted(os.listdir(tmp_path)) == ["gen-0", "gen-1", "state.json"]
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f)["generation"] == (1 if crash_after_commit else 0)
+    reopened = open_store(tmp_path)
+    assert reopened.rows == (2 if crash_after_commit else 5)
+    assert contents(reopened, ["a", "b"]) == ["five", "four"]
+    assert sorted(os.listdir(tmp_path)) == ["gen-1" if crash_after_commit else "gen-0", "state.json"]
+    reopened.compact()
+    assert contents(open_store(tmp_path), ["a", "b"]) == ["five", "four"]
+
+def test_ivf_search_and_reload(tmp_path):
+    store = open_store(tmp_path, ivf_min_candidates=0, nprobe=4)
+    for i in range(20):
+        store.upsert(f"u{i}", "v1", splits(f"u{i}", [f"chunk {i} {j}" for j in range(5)]))
+    store.build_ivf(nlist=4)
+    query = store.embeddings.embed_query("chunk 3 1")
+    assert store.search(query, k=1)[0][0] == 16
+    reopened = open_store(tmp_path, ivf_min_candidates=0, nprobe=4)
+    assert reopened.stats()["ivf_lists"] == 4
+    assert reopened.search(query, k=1)[0][0] == 16
+    assert sorted(name for name in os.listdir(tmp_path / "gen-0") if name.startswith(("list", "centroids"))) == \
+        ["centroids-1.npy", "list-1.bin"]
+
+def test_retain_drops_pages_missing_from_a_new_upload(tmp_path):
+    store = open_store(tmp_path)
+    changed = []
+    store.on_change(changed.append)
+    for page in (1, 2, 3):
+        store.upsert(f"doc.pdf#page={page}", "v1", splits("doc.pdf", [f"page {page}"]))
+    assert store.retain("doc.pdf", ["doc.pdf#page=1"]) == 2
+    assert store.retain("doc.pdf", ["doc.pdf#page=1"]) == 0
+    assert changed == ["doc.pdf"]
+    assert contents(open_store(tmp_path), ["doc.pdf"]) == ["page 1"]
+    assert store.upsert("doc.pdf#page=2", "v1", splits("doc.pdf", ["page 2"])) == 1
@@ -0,0 +1,17 @@
+from langchain_core.documents import Document
+from agents.context_builder import ContextBuilder
+
+def chunk(text, start, url="doc.pdf", doc_id=None):
+    metadata = {"url": url, "title": "Doc", "start_index": start}
+    if doc_id:
+        metadata["doc_id"] = doc_id
+    return Document(page_content=text, metadata=metadata)
+
+def test_overlapping_chunks_are_stitched():
+    spans = ContextBuilder().merge([chunk("world!", 6), chunk("hello world", 0)])
+    assert spans == [[0, "doc.pdf", "Doc", 0, "hello world!"]]
+
+def test_pages_of_one_url_are_not_merged():
+    docs = [chunk("page one text", 0, doc_id="doc.pdf#page=1"), chunk("page two text", 0, doc_id="doc.pdf#page=2")]
+    spans = ContextBuilder().merge(docs)
+    assert [span[4] for span in spans] == ["page one text", "page two text"]
@@ -0,0 +1,58 @@
+import time
+from conftest import html_page
+from agents.domain_health import DomainHealth
+from agents.scraper import ScraperAgent
+
+def test_circuit_opens_probes_and_closes_against_local_hosts(tmp_path, stub_server):
+    statuses = [503, 503, 503, 200]
+    flaky = stub_server({"/page": lambda request: (statuses.pop(0), {}, html_page("Flaky. "))})
+    steady = stub_server({"/page": lambda request: (200, {}, html_page("Steady. "))})
+    health = DomainHealth(default_timeout=5.0, failure_threshold=3, cooldown=0.2)
+    scraper = ScraperAgent("Scraper", None, cache_path=None, domain_health=health)
+
+    for _ in range(3):
+        scraper._fetch({"url": flaky.url("/page")})
+    assert scraper._fetch({"url": steady.url("/page")})[2] is None
+    error = scraper._fetch({"url": flaky.url("/page")})[2]
+    assert "circuit open" in str(error)
+    assert flaky.hits("/page") == 3
+    stats = health.stats()
+    assert (stats["hosts"], stats["open"]) == (2, 1)
+    assert stats["worst"][0]["host"] == f"127.0.0.1:{flaky.server.server_port}"
+
+    time.sleep(0.25)
+    assert scraper._fetch({"url": flaky.url("/page")})[2] is None
+    assert flaky.hits("/page") == 4
+    assert health.stats()["open"] == 0
+
+def test_close_forgets_failures_but_keeps_backoff_until_recovered():
+    health = DomainHealth(failure_threshold=2, min_samples=3, max_failure_rate=0.6, cooldown=0.05, recovery=3)
+    url = "http://flaky.test/page"
+    for _ in range(2):
+        health.record(url, False)
+    host = health.hosts["flaky.test"]
+    assert host.opened_until and host.cooldown == 0.05
+
+    time.sleep(0.06)
+    assert health.allow(url)
+    health.record(url, True, 0.1)
+    assert list(host.outcomes) == [True] and not host.opened_until
+    # One failure after closing is not a trip, but relapsing doubles the cooldown
+    health.record(url, False)
+    assert not host.opened_until
+    health.record(url, False)
+    assert host.cooldown == 0.1
+
+    time.sleep(0.11)
+    assert health.allow(url)
+    for _ in range(3):
+        health.record(url, True, 0.1)
+    assert host.cooldown == 0.0
+
+def test_hosts_are_capped_least_recently_used_first():
+    health = DomainHealth(max_hosts=2)
+    health.record("http://a.test/", True, 0.1)
+    health.record("http://b.test/", True, 0.1)
+    health.timeout("http://a.test/x")
+    health.record("http://c.test/", True, 0.1)
+    assert list(health.hosts) == ["a.test", "c.test"]
@@ -0,0 +1,46 @@
+from agents.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 0.5]
+
+def test_only_unseen_texts_are_embedded(tmp_path):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "embeddings.sqlite")), "model")
+    assert embeddings.embed_documents(["a", "bb", "a"]) == [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5]]
+    assert embeddings.embed_documents(["bb", "ccc"]) == [[2.0, 0.5], [3.0, 0.5]]
+    assert model.embedded == ["a", "bb", "ccc"]
+    reopened = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "embeddings.sqlite")), "model")
+    reopened.embed_documents(["a", "bb", "ccc"])
+    assert model.embedded == ["a", "bb", "ccc"]
+    # Another model name never reads these vectors
+    CachedEmbeddings(model, reopened.cache, "other").embed_documents(["a"])
+    assert model.embedded == ["a", "bb", "ccc", "a"]
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.get_many(["a"])
+    cache.put_many({"c": [3.0]})
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0], "c": [3.0]}
+    assert cache.stats()["entries"] == 2
+
+def test_tally_counts_only_the_calls_inside_it(tmp_path):
+    embeddings = CachedEmbeddings(CountingEmbeddings(), EmbeddingCache(str(tmp_path / "embeddings.sqlite")), "model")
+    embeddings.embed_documents(["a"])
+    with embeddings.tally() as outer:
+        embeddings.embed_documents(["a", "b", "b"])
+        with embeddings.tally() as inner:
+            embeddings.embed_documents(["b", "c"])
+        embeddings.embed_documents(["c"])
+    embeddings.embed_documents(["d"])
+    assert outer == {"hits": 2, "misses": 1}
+    assert inner == {"hits": 1, "misses": 1}
+    assert embeddings.cache.stats()["misses"] == 4
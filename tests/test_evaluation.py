@@ -0,0 +1,89 @@
+import json
+from langchain_core.documents import Document
+from test_compact_store import HashEmbeddings, open_store
+from evaluation import Checkpoint, evaluate_pipeline, run_query
+
+class EchoOrchestrator:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+
+    def run(self, query, use_cache=True):
+        if query in self.fail:
+            raise RuntimeError("pipeline failed")
+        return f"answer to {query}"
+
+def judge_llm(fail_on=None):
+    def llm(prompt):
+        if fail_on and fail_on in prompt:
+            raise TimeoutError("judge timed out")
+        return "Reasoning.\n4"
+    return llm
+
+def test_judge_failure_is_recorded_per_row(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "eval.jsonl"))
+    scores = evaluate_pipeline(["q1", "q2"], EchoOrchestrator(), judge_llm(fail_on="answer to q2"),
+                               parallelism=2, checkpoint=checkpoint)
+    assert scores["total_runs"] == 2
+    assert scores["judge_errors"] == 1
+    assert scores["relevance"] == 0.8
+    rows = {row["query"]: row for row in checkpoint.rows.values()}
+    assert rows["q2"]["judge_error"] == "TimeoutError('judge timed out')"
+    assert rows["q2"]["relevance"] is None
+
+def test_resume_runs_failed_rows_again(tmp_path):
+    path = str(tmp_path / "eval.jsonl")
+    evaluate_pipeline(["q1", "q2", "q3"], EchoOrchestrator(fail=["q2"]), judge_llm(fail_on="answer to q3"),
+                      checkpoint=Checkpoint(path))
+    resumed = Checkpoint(path)
+    assert [row["query"] for row in resumed.rows.values()] == ["q1"]
+    scores = evaluate_pipeline(["q1", "q2", "q3"], EchoOrchestrator(), judge_llm(), checkpoint=resumed)
+    assert scores["error_rate"] == 0 and scores["judge_errors"] == 0
+    assert len(Checkpoint(path).rows) == 3
+
+def test_checkpoint_drops_a_torn_last_line(tmp_path):
+    path = tmp_path / "eval.jsonl"
+    row = {"system": "pipeline", "query": "q1", "repeat": 0, "error": None, "judge_error": None}
+    path.write_text(json.dumps(row) + "\n" + '{"system": "pipel')
+    checkpoint = Checkpoint(str(path))
+    assert checkpoint.get("pipeline", "q1", 0) == row
+    checkpoint.add({**row, "query": "q2"})
+    assert Checkpoint(str(path)).get("pipeline", "q2", 0) is not None
+
+# Baseline pieces with ChunkerAgent.run's index= contract and a synthesizer that answers with its context
+class SnippetChunker:
+    def __init__(self, index):
+        self.index = index
+        self.embeddings = HashEmbeddings()
+
+    def run(self, sources, logs=None, index=None):
+        index = self.index if index is None else index
+        for source in sources:
+            index.upsert(source["url"], source["content"], [Document(
+                page_content=source["content"], metadata={"url": source["url"], "title": source["title"]}
+            )])
+        return index.view([source["url"] for source in sources])
+
+class ContextSynthesizer:
+    def run(self, query, vectorstore):
+        return " | ".join(doc.page_content for doc in vectorstore.as_retriever().invoke(query))
+
+class SnippetRetriever:
+    def run(self, query):
+        return [{"url": "http://shared.test/", "title": "Shared", "snippet": f"snippet for {query}"}]
+
+class BaselineOrchestrator:
+    def __init__(self, index):
+        self.retriever = SnippetRetriever()
+        self.chunker = SnippetChunker(index)
+        self.synthesizer = ContextSynthesizer()
+
+def test_baseline_never_writes_the_shared_index(tmp_path):
+    shared = open_store(tmp_path)
+    shared.upsert("http://shared.test/", "full", [Document(page_content="full page text",
+                                                          metadata={"url": "http://shared.test/", "title": "Shared"})])
+    orchestrator = BaselineOrchestrator(shared)
+    answers = [run_query(query, orchestrator, is_baseline=True)[0] for query in ("q1", "q2")]
+    assert answers == ["snippet for q1", "snippet for q2"]
+    assert shared.rows == 1
+    assert [doc.page_content for doc in shared.view(["http://shared.test/"]).as_retriever().invoke("x")] == \
+        ["full page text"]
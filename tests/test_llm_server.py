@@ -0,0 +1,29 @@
+import threading
+import pytest
+from llm_server import BatchingLLM
+
+def test_concurrent_prompts_share_a_batch():
+    batches = []
+    release = threading.Event()
+
+    def generate(prompts):
+        batches.append(list(prompts))
+        release.wait(5)
+        return [prompt.upper() for prompt in prompts]
+
+    llm = BatchingLLM(generate, max_batch_size=4, max_wait=0.2)
+    futures = [llm.submit(prompt) for prompt in "abcde"]
+    release.set()
+    assert [future.result(5) for future in futures] == list("ABCDE")
+    assert batches == [list("abcd"), ["e"]]
+    assert llm.metrics()["batch_sizes"] == {1: 1, 4: 1}
+
+def test_failures_reach_every_caller_in_the_batch():
+    def generate(prompts):
+        raise RuntimeError("out of memory")
+
+    llm = BatchingLLM(generate, max_batch_size=2, max_wait=0.2)
+    futures = [llm.submit("a"), llm.submit("b")]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
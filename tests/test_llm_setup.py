@@ -0,0 +1,73 @@
+import os
+import pytest
+from llm_setup import ModelRegistry, embedding_model_name
+
+def test_fake_backend_caches_are_separate():
+    real, fake = ModelRegistry(backend="hf"), ModelRegistry(backend="fake")
+    assert real.cache_directory == "cache"
+    assert fake.cache_directory == os.path.join("cache", "fake")
+    assert real.embedding_cache_name() == embedding_model_name
+    assert fake.embedding_cache_name() == f"fake:{embedding_model_name}"
+
+def test_prefix_path_only_for_single_prompt_batches():
+    registry = ModelRegistry(backend="hf")
+    registry.models["base_llm"] = lambda prompt: f"plain:{prompt}"
+    registry._generate_with_prefix = lambda prompt: f"prefix:{prompt}"
+    registry.register_prefix("Instructions. ")
+    assert registry._generate_batch(["Instructions. a"]) == ["prefix:Instructions. a"]
+    assert registry._generate_batch(["other"]) == ["plain:other"]
+    assert registry._generate_batch(["Instructions. a", "Instructions. b"]) == \
+        ["plain:Instructions. a", "plain:Instructions. b"]
+
+# --- Prefix past-key-values on a tiny random Llama (no download); skipped without torch ---
+PREFIX = "instructions : answer the question from the context . "
+PROMPT = PREFIX + "context : the quick brown fox jumps over the lazy dog . question : what jumps ?"
+
+def tiny_registry():
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    words = sorted(set(PROMPT.split()))
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2, **{word: i + 3 for i, word in enumerate(words)}}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="<unk>", bos_token="<s>", eos_token="</s>", pad_token="</s>"
+    )
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=len(vocab), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=128,
+        initializer_range=0.5, bos_token_id=1, eos_token_id=2, pad_token_id=2
+    )
+    model = transformers.LlamaForCausalLM(config).eval()
+    # Without an EOS every call generates max_new_tokens, a long enough run to compare
+    model.generation_config.eos_token_id = None
+    registry = ModelRegistry(backend="hf", quantize=False)
+    registry.models.update(model=model, tokenizer=tokenizer)
+    return registry
+
+def test_cached_prefix_matches_full_prefill():
+    plain = tiny_registry()
+    cached = tiny_registry()
+    cached.models = plain.models
+    cached.register_prefix(PREFIX)
+    expected = plain.generate(PROMPT, max_new_tokens=12)
+    assert len(expected[len(PROMPT):].split()) >= 8
+    # First call builds the prefix entry; later calls start from copies of it
+    assert [cached.generate(PROMPT, max_new_tokens=12) for _ in range(3)] == [expected] * 3
+    stats = cached.prefix_cache.stats()
+    assert (stats["misses"], stats["hits"]) == (1, 2)
+    assert stats["tokens_reused"] == 2 * len(PREFIX.split())
+    assert stats["prefill_seconds_saved"] >= 0
+    print(f"\nprefill saved over 2 reuses of {len(PREFIX.split())} prefix tokens: "
+          f"{cached.prefix_cache.seconds_saved * 1000:.2f} ms")
+
+def test_streamed_answer_with_cached_prefix_matches():
+    plain = tiny_registry()
+    cached = tiny_registry()
+    cached.models = plain.models
+    cached.register_prefix(PREFIX)
+    expected = "".join(plain.stream_llm(PROMPT, max_new_tokens=12))
+    assert ["".join(cached.stream_llm(PROMPT, max_new_tokens=12)) for _ in range(2)] == [expected] * 2
+    assert cached.prefix_cache.stats()["hits"] == 1
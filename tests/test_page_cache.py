@@ -0,0 +1,22 @@
+from agents.page_cache import PageCache
+
+def test_fresh_stale_and_negative_entries(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.sqlite"), ttl=3600, negative_ttl=0)
+    assert cache.get("http://a.test/") == (None, False)
+    cache.put("http://a.test/", "content", True, etag='"v1"', raw_bytes=100)
+    cache.put("http://b.test/", "", False)
+    entry, fresh = cache.get("http://a.test/")
+    assert fresh and entry["content"] == "content"
+    entry, fresh = cache.get("http://b.test/")
+    assert not fresh and cache.validators(entry) == {}
+    assert cache.validators(cache.get("http://a.test/")[0]) == {"If-None-Match": '"v1"'}
+    assert cache.stats()["bytes_saved"] == 200
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.sqlite"), max_entries=2)
+    cache.put("http://a.test/", "a", True)
+    cache.put("http://b.test/", "b", True)
+    cache.get("http://a.test/")
+    cache.put("http://c.test/", "c", True)
+    assert cache.get("http://b.test/") == (None, False)
+    assert cache.get("http://a.test/")[1] and cache.get("http://c.test/")[1]
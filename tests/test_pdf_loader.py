@@ -0,0 +1,32 @@
+import os
+import threading
+from pypdf import PdfWriter
+from agents.pdf_loader import PDFLoaderAgent
+
+def blank_pdf(path, pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+def test_concurrent_loads_of_one_file(tmp_path):
+    pdf = str(tmp_path / "doc.pdf")
+    blank_pdf(pdf, 3)
+    loader = PDFLoaderAgent("PDFLoader", None, cache_dir=str(tmp_path / "pdf"))
+    results, errors = [], []
+
+    def load():
+        try:
+            results.append(loader.run(pdf))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [[page["doc_id"] for page in pages] for pages in results] == [[f"{pdf}#page={i}" for i in (1, 2, 3)]] * 4
+    assert [name for name in os.listdir(tmp_path / "pdf") if name.endswith(".tmp")] == []
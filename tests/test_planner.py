@@ -0,0 +1,15 @@
+from agents.planner import PlannerAgent
+
+def test_pdf_flow_without_a_pdf_is_never_cached_or_learned():
+    planner = PlannerAgent("Planner", lambda prompt: "3: The answer is in a document.", min_confidence=1.1)
+    flow, _ = planner.run("zebra migration routes", pdf_uploaded=False)
+    assert flow == 2
+    assert planner.decisions["zebra migration routes"][0] == 2
+    assert 3 not in planner.classifier.centroids
+    assert planner.run("zebra migration routes", pdf_uploaded=False)[0] == 2
+    assert planner.run("zebra migration routes", pdf_uploaded=True)[0] == 3
+
+def test_only_the_completion_after_an_echoed_prompt_is_parsed():
+    planner = PlannerAgent("Planner", lambda prompt: prompt + "\n2: Needs several sources weighed.", min_confidence=1.1)
+    assert planner.run("zebra migration routes", pdf_uploaded=False) == (2, "Needs several sources weighed.")
+    assert planner.classifier.predict("zebra migration routes")[0] == 2
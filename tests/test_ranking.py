@@ -0,0 +1,38 @@
+import random
+from collections import Counter
+from urllib.parse import urlsplit
+from agents.ranking import BM25Ranker, hostname, is_trusted, term_frequency, tokenize, top_k
+
+def test_term_frequency_matches_tokenize():
+    rng = random.Random(0)
+    pieces = ["ai", "said", "AI", "main", "x-ai", "ai.", "(ai)", "ai_x", "naïve", "ai ", "\tai\n", "ai's", "é"]
+    for _ in range(300):
+        text = "".join(rng.choice(pieces) + rng.choice(["", " ", ",", "\n"]) for _ in range(rng.randint(0, 12)))
+        counts = Counter(tokenize(text))
+        for term in ("ai", "said", "s", "naïve", "x"):
+            assert term_frequency(text.lower(), term) == counts[term], (text, term)
+
+def test_stopwords_are_dropped_from_queries():
+    ranker = BM25Ranker()
+    assert ranker.query_terms("What is the impact of AI on the climate?") == {"impact", "ai", "climate"}
+    assert ranker.query_terms("to be or not to be") == {"not"}
+    assert ranker.query_terms("the who") == {"the", "who"}
+
+def test_scores_prefer_more_matches_in_shorter_pages():
+    ranker = BM25Ranker()
+    texts = ["Protein folding. Protein structure prediction.", "protein " + "filler " * 50,
+             "unrelated text about the ocean", ""]
+    scores = ranker.scores(texts, "protein folding")
+    assert scores[0] > scores[1] > scores[2] == scores[3] == 0.0
+    assert ranker.scores([], "protein") == []
+
+def test_hostname_matches_urlsplit():
+    urls = ["https://www.Nature.com/articles/1", "http://user:pw@cs.MIT.edu:8080/x?q=1#f", "https://[::1]:443/",
+            "https://data.gov?x=1", "https://example.org#top", "doc.pdf", "", "HTTPS://A.B.AC.UK"]
+    for url in urls:
+        assert hostname(url) == (urlsplit(url).hostname or ""), url
+    assert is_trusted("https://www.ox.ac.uk/news", {"ac.uk"})
+    assert not is_trusted("https://notac.uk.example.com/", {"ac.uk"})
+
+def test_top_k_keeps_input_order_on_ties():
+    assert top_k([0, 1, 2, 3], [1.0, 2.0, 2.0, 0.5], 3) == [1, 2, 0]
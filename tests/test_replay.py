@@ -0,0 +1,55 @@
+import pytest
+import requests
+from conftest import html_page
+from replay import (Archive, RecordingSearchClient, ReplayPolicy, ReplaySearchClient, recording_session,
+                    replay_session)
+
+def test_recorded_pages_replay_offline(tmp_path, stub_server):
+    server = stub_server({"/page": lambda request: (200, {"ETag": '"v1"'}, html_page("Recorded. "))})
+    path = str(tmp_path / "archive.jsonl.gz")
+    archive = Archive(path)
+    recorded = recording_session(archive).get(server.url("/page"))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        recording_session(archive).get("http://127.0.0.1:9/unreachable", timeout=2)
+    archive.save()
+    server.close()
+
+    replayed = Archive(path)
+    session = replay_session(replayed)
+    resp = session.get(server.url("/page"), stream=True)
+    assert resp.status_code == 200 and resp.text == recorded.text
+    assert resp.headers["ETag"] == '"v1"'
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get("http://127.0.0.1:9/unreachable")
+    with pytest.raises(requests.exceptions.ConnectionError, match="not in the replay archive"):
+        session.get(server.url("/other"))
+    assert replayed.stats() == {"keys": 2, "records": 2, "replayed": 2, "missing": 1}
+
+def test_search_records_replay_in_order_and_failures_are_deterministic():
+    class Client:
+        calls = 0
+
+        def results(self, query):
+            Client.calls += 1
+            return {"organic": [{"link": f"http://a.test/{Client.calls}"}]}
+
+    archive = Archive()
+    recorder = RecordingSearchClient(Client(), archive)
+    first, second = recorder.results("q"), recorder.results("q")
+    replay = ReplaySearchClient(archive)
+    assert [replay.results("q"), replay.results("q"), replay.results("q")] == [first, second, first]
+    assert replay.results("unknown") == {"organic": []}
+
+    def outcomes(seed):
+        archive.rewind()
+        client = ReplaySearchClient(archive, ReplayPolicy(failure_rate=0.5, seed=seed))
+        results = []
+        for _ in range(20):
+            try:
+                client.results("q")
+                results.append(True)
+            except requests.exceptions.ConnectionError:
+                results.append(False)
+        return results
+
+    assert outcomes(1) == outcomes(1) and False in outcomes(1) and True in outcomes(1)
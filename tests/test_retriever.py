@@ -0,0 +1,42 @@
+import agents.retriever as retriever_module
+from agents.retriever import RetrieverAgent
+
+class FakeSerper:
+    calls = []
+
+    def __init__(self, serper_api_key, k):
+        self.k = k
+
+    def results(self, query):
+        FakeSerper.calls.append((query, self.k))
+        available = 45 if query == "deep" else 3
+        return {"organic": [{"link": f"http://{query}.test/{i}"} for i in range(min(self.k, available))]}
+
+def make_retriever(monkeypatch, **kwargs):
+    FakeSerper.calls = []
+    monkeypatch.setenv("SERPER_API_KEY", "test")
+    monkeypatch.setattr(retriever_module, "GoogleSerperAPIWrapper", FakeSerper)
+    return RetrieverAgent("Retriever", None, **kwargs)
+
+def test_top_k_past_fetch_k_fetches_deeper(monkeypatch):
+    retriever = make_retriever(monkeypatch, fetch_k=20)
+    assert len(retriever.run("deep", top_k=5)) == 5
+    assert len(retriever.run("deep", top_k=20)) == 20
+    assert len(retriever.run("deep", top_k=30)) == 30
+    assert len(retriever.run("deep", top_k=25)) == 25
+    assert len(retriever.run("deep", top_k=60)) == 45
+    assert FakeSerper.calls == [("deep", 20), ("deep", 40), ("deep", 60)]
+    # A query that came back short has nothing deeper to fetch
+    retriever.run("shallow", top_k=5)
+    assert len(retriever.run("shallow", top_k=50)) == 3
+    assert FakeSerper.calls[-1] == ("shallow", 20)
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    retriever = make_retriever(monkeypatch, max_cached_queries=2)
+    retriever.run("a")
+    retriever.run("b")
+    retriever.run("a")
+    retriever.run("c")
+    assert list(retriever.cache) == ["a", "c"]
+    retriever.run("a")
+    assert [query for query, _ in FakeSerper.calls] == ["a", "b", "c"]
@@ -0,0 +1,101 @@
+import time
+from conftest import html_page
+from agents.domain_health import DomainHealth
+from agents.scraper import ScraperAgent
+
+def make_scraper(tmp_path, **kwargs):
+    return ScraperAgent("Scraper", None, cache_path=str(tmp_path / "pages.sqlite"), domain_health=False, **kwargs)
+
+def test_only_successful_responses_are_cached(tmp_path, stub_server):
+    statuses = [503, 429, 200]
+
+    def flaky(request):
+        return statuses.pop(0), {}, html_page("Temporarily unavailable. ")
+
+    server = stub_server({"/flaky": flaky})
+    scraper = make_scraper(tmp_path)
+    for _ in range(3):
+        scraper._fetch({"url": server.url("/flaky")})
+    assert server.hits("/flaky") == 3
+    _, content, error, _ = scraper._fetch({"url": server.url("/flaky")})
+    assert error is None and "Temporarily unavailable" in content
+    assert server.hits("/flaky") == 3
+
+def test_stale_pages_are_revalidated(tmp_path, stub_server):
+    def page(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return 304, {}, b""
+        return 200, {"ETag": '"v1"'}, html_page("Fresh content. ")
+
+    server = stub_server({"/page": page})
+    scraper = make_scraper(tmp_path, cache_ttl=0)
+    first = scraper._fetch({"url": server.url("/page")})[1]
+    second = scraper._fetch({"url": server.url("/page")})[1]
+    assert first == second and "Fresh content" in first
+    assert [headers.get("If-None-Match") for _, headers in server.requests] == [None, '"v1"']
+    assert scraper.page_cache.stats()["revalidated"] == 1
+
+def test_latency_stats_cover_only_the_current_run(tmp_path, stub_server):
+    server = stub_server({f"/{i}": lambda request: (200, {}, html_page("Some page text. ")) for i in range(4)})
+
+    class Retriever:
+        def run(self, query, top_k=5):
+            return []
+
+    scraper = make_scraper(tmp_path)
+    for paths in (["/0", "/1", "/2"], ["/3"]):
+        logs = []
+        sources = [{"url": server.url(path), "title": path} for path in paths]
+        assert len(scraper.run(sources, Retriever(), "query", desired_count=len(paths), logs=logs)) == len(paths)
+        assert any(f"over {len(paths)} fetches" in line for line in logs)
+
+def fast(request):
+    return 200, {}, html_page("Fast page text. ")
+
+def slow(request):
+    time.sleep(1.0)
+    return 200, {}, html_page("Slow page text. ")
+
+# Hands out the given sources on refill and records the top_k of every call
+class RecordingRetriever:
+    def __init__(self, sources=()):
+        self.sources = list(sources)
+        self.calls = []
+
+    def run(self, query, top_k=5):
+        self.calls.append(top_k)
+        return self.sources
+
+def sources(server, paths):
+    return [{"url": server.url(path), "title": path} for path in paths]
+
+def test_enough_fast_pages_stop_early_without_the_retriever(tmp_path, stub_server):
+    server = stub_server({"/a": fast, "/b": fast, "/c": fast})
+    retriever = RecordingRetriever()
+    pages = make_scraper(tmp_path).run(sources(server, ["/a", "/b", "/c"]), retriever, "query", desired_count=2)
+    assert len(pages) == 2
+    assert retriever.calls == []
+
+def test_timed_out_fetches_refill_with_a_larger_top_k(tmp_path, stub_server):
+    server = stub_server({"/slow-1": slow, "/slow-2": slow, "/fast-1": fast, "/fast-2": fast})
+    retriever = RecordingRetriever(sources(server, ["/fast-1", "/fast-2"]))
+    scraper = make_scraper(tmp_path, timeout=0.2)
+    pages = scraper.run(sources(server, ["/slow-1", "/slow-2"]), retriever, "query", desired_count=2)
+    assert sorted(page["title"] for page in pages) == ["/fast-1", "/fast-2"]
+    assert retriever.calls == [4]
+
+def test_fetch_slower_than_its_host_usually_is_hedged(tmp_path, stub_server):
+    server = stub_server({"/slow": slow})
+    backup = stub_server({"/fast": fast})
+    health = DomainHealth(default_timeout=5.0, min_samples=5)
+    for _ in range(5):
+        health.record(server.url("/"), True, 0.02)
+    retriever = RecordingRetriever(sources(backup, ["/fast"]))
+    scraper = ScraperAgent("Scraper", None, cache_path=None, domain_health=health)
+    start = time.perf_counter()
+    logs = []
+    pages = scraper.run(sources(server, ["/slow"]), retriever, "query", desired_count=1, logs=logs)
+    assert [page["title"] for page in pages] == ["/fast"]
+    assert time.perf_counter() - start < 0.9
+    assert retriever.calls == [2]
+    assert any("hedging with a backup URL" in line for line in logs)
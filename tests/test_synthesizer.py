@@ -0,0 +1,23 @@
+from langchain_core.documents import Document
+from agents.base import request_context
+from agents.context_builder import ContextBuilder
+from agents.synthesizer import SynthesizerAgent
+
+class OneDocStore:
+    def as_retriever(self, **kwargs):
+        return self
+
+    def get_relevant_documents(self, query):
+        return [Document(page_content="Tides follow the moon.", metadata={"url": "http://a.test/", "title": "Tides"})]
+
+def test_run_logs_prompt_and_completion_tokens():
+    synthesizer = SynthesizerAgent("Synthesizer", lambda prompt: prompt + " The moon drives tides.",
+                                   context_builder=ContextBuilder(count_tokens=lambda text: len(text.split())))
+    logs = []
+    with request_context(logs=logs):
+        answer = synthesizer.run("what causes tides", OneDocStore())
+    assert answer.startswith("The moon drives tides.")
+    prompt_line = next(line for line in logs if line.startswith("Synthesizer: Prompt is"))
+    prompt_tokens = int(prompt_line.split()[3])
+    generation_line = next(line for line in logs if line.startswith("Synthesizer: Generation took"))
+    assert f"({prompt_tokens} prompt tokens in, 4 tokens out;" in generation_line
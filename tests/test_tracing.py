@@ -0,0 +1,14 @@
+from agents.tracing import Span, SpanMetrics
+
+def test_prometheus_prints_exact_counters():
+    metrics = SpanMetrics()
+    span = Span("Scraper.run", "Scraper")
+    span.add("bytes", 123_456_789)
+    span.cpu = 0.1
+    metrics.observe(span, 1.25)
+    lines = metrics.prometheus().splitlines()
+    assert 'intellimesh_span_bytes_total{span="Scraper.run"} 123456789' in lines
+    assert 'intellimesh_span_calls_total{span="Scraper.run"} 1' in lines
+    assert 'intellimesh_span_errors_total{span="Scraper.run"} 0' in lines
+    assert 'intellimesh_span_wall_seconds_total{span="Scraper.run"} 1.25' in lines
+    assert 'intellimesh_span_cpu_seconds_total{span="Scraper.run"} 0.1' in lines
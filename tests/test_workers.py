@@ -0,0 +1,43 @@
+import time
+import pytest
+from agents.base import current_request
+from workers import RequestPool, ServerBusy
+
+def test_results_are_published():
+    def handler(n):
+        for i in range(n):
+            yield i
+
+    pool = RequestPool(handler, max_workers=2)
+    assert pool.submit(3).result() == 2
+    assert pool.stats()["completed"] == 1
+
+def test_cancel_reaches_the_request_context():
+    seen = []
+
+    def handler():
+        request = current_request()
+        try:
+            while True:
+                yield "partial"
+                time.sleep(0.01)
+        finally:
+            seen.append(request.cancelled.is_set())
+
+    pool = RequestPool(handler, max_workers=1)
+    handle = pool.submit()
+    next(handle.updates(interval=0.05))
+    handle.cancel()
+    assert handle.result() == "partial"
+    assert seen == [True]
+
+def test_full_pool_rejects():
+    def handler():
+        time.sleep(0.2)
+        yield "done"
+
+    pool = RequestPool(handler, max_workers=1, max_queue=0)
+    handle = pool.submit()
+    with pytest.raises(ServerBusy):
+        pool.submit()
+    assert handle.result() == "done"
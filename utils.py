@@ -1,31 +1,27 @@
+import json
 import re
-from datetime import datetime
+import sys
 
-def style_logs(logs_text):
+# --- Log panel rendered from structured trace events: log lines in order, then one
+# row per finished agent span ---
+def render_events(events, extra_lines=()):
     styled = "<details><summary>📜 Click to expand full pipeline logs</summary>\n\n"
     styled += "### 🔧 Pipeline Execution Log\n\n"
-    lines = logs_text.splitlines()
-    new_lines = []
-    url_counter = 1
-    for line in lines:
-        ts = datetime.now().strftime("[%H:%M:%S]")
-        if "Scraping http" in line:
-            line = re.sub(r"(Scraping )", f"Scraping URL {url_counter}/5 - ", line)
-            url_counter += 1
-        elif any(agent in line for agent in ["Retriever", "Scraper", "Evaluator", "Chunker", "Synthesizer", "PDFLoader"]):
-            line = f"{ts} > **{line}**"
-        new_lines.append(line)
-    logs_text = '\n'.join(new_lines)
-    logs_text = re.sub(r"(Planner chose flow \d+: [^\n]+)", r"> 🔁 **\1**", logs_text)
-    logs_text = re.sub(r"(Pipeline: [^\n]+)", r"**\1**", logs_text)
-    for label in ["Retriever", "Scraper", "Evaluator", "Chunker", "Synthesizer", "PDFLoader"]:
-        logs_text = re.sub(rf"\b({label}):", rf"**\1:**", logs_text)
-    logs_text = re.sub(r"(Fetching|Scraping|Retrieving|Evaluating|Chunking|Synthesizing)", r"🔄 \1", logs_text, flags=re.IGNORECASE)
-    logs_text = re.sub(r"(Selected|Success|Succeeded|Found)", r"✅ **\1**", logs_text, flags=re.IGNORECASE)
-    logs_text = re.sub(r"(Final scraped results: \d+)", r"📦 **\1**", logs_text)
-    logs_text = re.sub(r"(Error|Exception)", r"❌ **\1**", logs_text, flags=re.IGNORECASE)
-    logs_text = logs_text.replace('\n', '  \n')
-    styled += logs_text + "\n</details>"
+    lines = [f"`{event['t']:7.2f}s` {event['message']}" for event in events if event["type"] == "log"]
+    lines.extend(extra_lines)
+    styled += "  \n".join(lines)
+    spans = [event for event in events if event["type"] == "span"]
+    if spans:
+        styled += "\n\n### ⏱️ Agent calls\n\n"
+        styled += "| Call | Wall (s) | CPU (s) | Items | Bytes | Tokens in / out | Cache hits / misses |\n"
+        styled += "|---|---|---|---|---|---|---|\n"
+        for span in spans:
+            counts = span["counts"]
+            name = f"❌ {span['name']}" if span["error"] else span["name"]
+            styled += (f"| {name} | {span['wall']:.2f} | {span['cpu']:.2f} | {counts.get('items', 0)} | "
+                       f"{counts.get('bytes', 0)} | {counts.get('tokens_in', 0)} / {counts.get('tokens_out', 0)} | "
+                       f"{counts.get('cache_hits', 0)} / {counts.get('cache_misses', 0)} |\n")
+    styled += "\n</details>"
     return styled
 
 def style_answer(answer_text):
@@ -35,3 +31,35 @@ def style_answer(answer_text):
     answer_text = re.sub(r"(Sources:)", r"\n\n### 📚 \1", answer_text)
     answer_text = answer_text.replace(". [", ".  \n[")
     return answer_text
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def read_jsonl(path):
+    # Rows of a JSON-lines file that is appended to as work finishes. A last line without
+    # its newline is a write cut short by a crash: it is truncated away, so the next
+    # append starts on a line of its own. Other unreadable lines are skipped
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    rows = []
+    size = 0
+    for number, line in enumerate(lines, 1):
+        if not line.endswith(b"\n"):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+            print(f"{path}: dropped a partial last line", file=sys.stderr)
+            break
+        size += len(line)
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            print(f"{path}: skipping unreadable line {number}", file=sys.stderr)
+    return rows
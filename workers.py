@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from agents.base import request_context
+from agents.tracing import write_jsonl
+from utils import percentile
+
+class ServerBusy(Exception):
+    pass
+
+# --- One pipeline run: the worker publishes results, the caller polls the latest one ---
+class RequestHandle:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.context = None
+        self.latest = None
+        self.done = False
+        self.error = None
+        self.cancelled = False
+
+    def publish(self, value):
+        with self.cond:
+            self.latest = value
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.context is not None:
+            self.context.cancelled.set()
+
+    @property
+    def logs(self):
+        return list(self.context.logs) if self.context else []
+
+    @property
+    def events(self):
+        return list(self.context.events) if self.context else []
+
+    # Yields (latest, events) every `interval` seconds while the request is queued or
+    # running, then once more when it finishes; a slow reader only skips states
+    def updates(self, interval=0.1):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.done, timeout=interval)
+                latest, done = self.latest, self.done
+            if done:
+                break
+            yield latest, self.events
+        if self.error is not None:
+            raise self.error
+        yield self.latest, self.events
+
+    def result(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.latest
+
+# --- Runs pipeline requests on a fixed number of worker threads, each inside its own
+# request context. At most max_workers run and max_queue wait; beyond that submit()
+# raises ServerBusy (after admission_timeout seconds) instead of queueing forever.
+# With trace_path set, every finished request's trace is appended there as JSON lines ---
+class RequestPool:
+    def __init__(self, handler, max_workers=4, max_queue=16, admission_timeout=0.0, trace_path=None):
+        self.handler = handler
+        self.trace_path = trace_path
+        self.trace_lock = threading.Lock()
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.admission_timeout = admission_timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="request")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.counts = {"admitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.latencies = deque(maxlen=1000)
+        self.queue_waits = deque(maxlen=1000)
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    # The handler is a generator function; every value it yields is published
+    def submit(self, *args, **kwargs):
+        if self.admission_timeout:
+            admitted = self.slots.acquire(timeout=self.admission_timeout)
+        else:
+            admitted = self.slots.acquire(blocking=False)
+        if not admitted:
+            with self.lock:
+                self.counts["rejected"] += 1
+            raise ServerBusy(f"{self.active} requests running and {self.queued} queued")
+        handle = RequestHandle()
+        with self.lock:
+            self.counts["admitted"] += 1
+            self.queued += 1
+        self.pool.submit(self._run, handle, time.perf_counter(), args, kwargs)
+        return handle
+
+    def _run(self, handle, submitted, args, kwargs):
+        started = time.perf_counter()
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        self.queue_waits.append(started - submitted)
+        error = None
+        try:
+            with request_context() as context:
+                handle.context = context
+                if handle.cancelled:
+                    context.cancelled.set()
+                results = self.handler(*args, **kwargs)
+                try:
+                    for value in results:
+                        handle.publish(value)
+                        if handle.cancelled:
+                            break
+                finally:
+                    results.close()
+                    if self.trace_path:
+                        with self.trace_lock:
+                            write_jsonl(context, self.trace_path)
+        except Exception as e:
+            error = e
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.counts["failed" if error else "completed"] += 1
+            self.latencies.append(time.perf_counter() - submitted)
+            self.slots.release()
+            handle.finish(error)
+
+    def stats(self):
+        latencies, waits = list(self.latencies), list(self.queue_waits)
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            **self.counts,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+            "queue_wait_p50": percentile(waits, 50),
+            "queue_wait_p99": percentile(waits, 99)
+        }